@@ -45,6 +45,7 @@ from parser.support import ROLES, CREDITS
 from parser.my_mongo_db_login import DB_LOGIN_INFO
 import gale.general.errors as gerr
 import parser.support as support
+import parser.reader as read
 
 
 def make_filename(directory, network_type, parameter_dict, ver=None):
@@ -89,36 +90,13 @@ def get_parameters(file_names):
     param_list = list(set(param_list))
     return param_list
 
-def read_files_w_parameter(result_dir, param,N=1):
-    '''
-    read files with the given parameter divided by N, either 1 or total number of players
-    '''
-    df_list = []
-    file_names = [join(result_dir, f) for f in listdir(result_dir) if isfile(join(result_dir, f))]
-    file_param = [fs for fs in file_names if param in fs]
-    v = re.compile(r'ver_[0-9]+')
-    for fs in file_param:
-        df = pd.read_json(fs, orient='split')
-        ver = v.search(fs).group()
-        df.name = ver
-        #divide df by N except for the year column
-        df.loc[:,df.columns != 'year'] = df.loc[:,df.columns != 'year']/N
-        #rename columns to drop duplicate columns
-        rename_col = {col:'{}_{}'.format(col, ver) for col in df.columns}
-        df = df.rename(columns=rename_col)
-        df_list.append(df)
-    return df_list
-    
-def mean_ci(df, high=0.975, low=0.025):
-    mean = df.mean(axis=1).tolist()
-    low_ci = df.quantile(low, axis=1).tolist()
-    high_ci = df.quantile(high, axis=1).tolist()
-    return mean, low_ci, high_ci
-
-def median_ci(df, high=0.975, low=0.025):
-    mean = df.median(axis=1).tolist()
-    low_ci = df.quantile(low, axis=1).tolist()
-    high_ci = df.quantile(high, axis=1).tolist()
+def streaming_median_ci(summary, high=0.975, low=0.025):
+    """
+    median and confidence interval of every row of a common.stats.StreamingSummary, the quantiles are exact
+    """
+    mean = summary.quantile(0.5).tolist()
+    low_ci = summary.quantile(low).tolist()
+    high_ci = summary.quantile(high).tolist()
     return mean, low_ci, high_ci
 
 ###Functions###
@@ -153,44 +131,37 @@ def main(args):
         print(param)
         print('reading files')
         print('N', N)
-        df_list = read_files_w_parameter(data_dir, param,N)
-        print('len df_list', len(df_list))
-        df_param = pd.concat(df_list, axis=1)
-        print('columns', len(df_param.columns))
-        #check if all year columns have the same value
-        year_columns = [col for col in df_param.columns if 'year' in col]
-        #check if the columns are same to reference column
-        year_same_df = df_param[year_columns].eq(df_param['year_ver_0'], axis=0).all(axis=0)
-        #check if all columns are same
-        year_true = year_same_df.all() #supposed return 
-        print(year_true)
-        if year_true == True:
-            none_year_columns = [c for c in df_param.columns if c not in year_columns]
-            mean, low_ci, high_ci = median_ci(df_param[none_year_columns])
-            color='teal'
-            fontsize=12
-            #plot the figure:
-            fig, ax = plt.subplots(figsize=(5,3))
-            #get the bipartite data:
-            #plot bipartite results
-            print('mean', mean[-1])
-            ax.plot(df_param.index, mean, label='Multipartite', color=color)
-            ax.fill_between(df_param.index, low_ci, high_ci, color=color, alpha=0.2)
-            ax.set_ylim([0, 1])
-            #figure style
-            ax.set_ylabel('Adopter ratio', fontsize=1.3*fontsize)
-            ax.set_xlabel('Number of cumulative movies', fontsize=1.3*fontsize)
-            ax.tick_params(axis='both', which='major', labelsize=fontsize)
-            ax.tick_params(axis='both', which='minor', labelsize=fontsize)
-            ax.spines['right'].set_visible(False)
-            ax.spines['top'].set_visible(False)
-
-            plt.tight_layout()
-            plt.savefig(os.path.join(result_dir, 'adoption_curve_{}.pdf'.format(param)), 
-                dpi=300, transparent=True)
-            del df_param
-        else:
+        #the files are summarized one at a time instead of concatenating every replicate
+        try:
+            summary, year = read.summarize_files_w_parameter(data_dir, param, N, '0')
+        except ValueError as e:
+            print(e)
             print('years dont line up')
+            continue
+        print('replicates', summary.count)
+        mean, low_ci, high_ci = streaming_median_ci(summary)
+        color='teal'
+        fontsize=12
+        #plot the figure:
+        fig, ax = plt.subplots(figsize=(5,3))
+        #get the bipartite data:
+        #plot bipartite results
+        print('mean', mean[-1])
+        ax.plot(year.index, mean, label='Multipartite', color=color)
+        ax.fill_between(year.index, low_ci, high_ci, color=color, alpha=0.2)
+        ax.set_ylim([0, 1])
+        #figure style
+        ax.set_ylabel('Adopter ratio', fontsize=1.3*fontsize)
+        ax.set_xlabel('Number of cumulative movies', fontsize=1.3*fontsize)
+        ax.tick_params(axis='both', which='major', labelsize=fontsize)
+        ax.tick_params(axis='both', which='minor', labelsize=fontsize)
+        ax.spines['right'].set_visible(False)
+        ax.spines['top'].set_visible(False)
+
+        plt.tight_layout()
+        plt.savefig(os.path.join(result_dir, 'adoption_curve_{}.pdf'.format(param)), 
+            dpi=300, transparent=True)
+        plt.close(fig)
 if __name__ == '__main__':
     parser = ArgumentParser()
 
@@ -58,16 +58,13 @@ def make_filename(directory, network_type, parameter_dict, ver=None):
     #order of contagion_[sched_type]_[parameters]_ver_[network version]_[iteration of the version].json
     return save_name
 
-def mean_ci(df, high=0.975, low=0.025):
-    mean = df.mean(axis=1).tolist()
-    low_ci = df.quantile(low, axis=1).tolist()
-    high_ci = df.quantile(high, axis=1).tolist()
-    return mean, low_ci, high_ci
-
-def median_ci(df, high=0.975, low=0.025):
-    mean = df.median(axis=1).tolist()
-    low_ci = df.quantile(low, axis=1).tolist()
-    high_ci = df.quantile(high, axis=1).tolist()
+def streaming_median_ci(summary, high=0.975, low=0.025):
+    """
+    median and confidence interval of every row of a common.stats.StreamingSummary, the quantiles are exact
+    """
+    mean = summary.quantile(0.5).tolist()
+    low_ci = summary.quantile(low).tolist()
+    high_ci = summary.quantile(high).tolist()
     return mean, low_ci, high_ci
 
 ###Functions###
@@ -105,31 +102,23 @@ def main(args):
         print(param)
         print('reading files')
         print('N', N)
-        df_list = read.read_raw_files_w_parameter(data_dir, param,N)
-        print('len df_list', len(df_list))
-        df_param = pd.concat(df_list, axis=1)
-        print('columns', len(df_param.columns))
-        #check if all year columns have the same value
-        year_columns = [col for col in df_param.columns if 'year' in col]
-        #check if the columns are same to reference column
-        year_same_df = df_param[year_columns].eq(df_param['year_ver_{}'.format(ver)].iloc[:,0], axis=0).all(axis=0)
-        #check if all columns are same
-        year_true = year_same_df.all() #supposed return 
-        print(year_true)
-        if year_true == True:
-            none_year_columns = [c for c in df_param.columns if c not in year_columns]
-            mean, low_ci, high_ci = median_ci(df_param[none_year_columns])
-            df_mean = pd.DataFrame(index=df_param.index)
-            df_mean['mean'] = mean
-            df_mean['low_ci'] = low_ci
-            df_mean['high_ci'] = high_ci
-            df_mean['year'] = df_param[year_columns[0]].iloc[:,0]
-            fname = '_'.join(['mean', param])
-            path = os.path.join(result_dir, fname+'.json')
-            df_mean.to_json(path, orient='split')
-        else:
+        #the files are summarized one at a time instead of concatenating every replicate
+        try:
+            summary, year = read.summarize_files_w_parameter(data_dir, param, N, ver)
+        except ValueError as e:
+            print(e)
             print('years dont line up')
             break
+        print('replicates', summary.count)
+        mean, low_ci, high_ci = streaming_median_ci(summary)
+        df_mean = pd.DataFrame(index=year.index)
+        df_mean['mean'] = mean
+        df_mean['low_ci'] = low_ci
+        df_mean['high_ci'] = high_ci
+        df_mean['year'] = year
+        fname = '_'.join(['mean', param])
+        path = os.path.join(result_dir, fname+'.json')
+        df_mean.to_json(path, orient='split')
 if __name__ == '__main__':
     parser = ArgumentParser()
 
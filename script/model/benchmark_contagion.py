@@ -0,0 +1,126 @@
+"""
+Benchmark of the temporal contagion engines on the real network
+
+Summary:
+1. Read the movies of the period and build the temporal network once
+2. Time the networkx, array and jit engines over the same network, the array engines play the
+   interactions one by one (aggregate=False) as the networkx engine does
+3. Print the time per run and the speedup against the networkx engine
+4. Time the array engines again with aggregated interaction rounds and print that speedup apart,
+   against the same engine without aggregation, since it samples the movies differently
+*The first jit run compiles the kernel, so it is not counted
+*The rounds are only aggregated when dose >= threshold, see contagion.rounds_convert
+"""
+
+##########Packages##########
+#System
+import sys
+import os
+import time
+from argparse import ArgumentParser
+import numpy as np
+#Local
+src_dir = os.path.abspath(os.path.join(os.pardir, os.pardir, 'src'))
+sys.path[0] = src_dir
+import model.contagion as contagion
+import network.network_builder as build
+import parser.support as support
+
+
+def time_engine(run, repeat):
+    """
+    time the given run function
+    input:
+        run - function without arguments that runs the dynamics once
+        repeat - number of runs
+    output:
+        seconds - average seconds per run
+        final - list of final number of adopters of each run
+    """
+    final = []
+    start = time.time()
+    for i in range(repeat):
+        adopter_history = run()
+        final.append(adopter_history[-1, 2])
+    seconds = (time.time() - start)/repeat
+    return seconds, final
+
+###Functions###
+def main(args):
+    P, D, T = args.p, args.d, args.t
+    repeat = args.i
+
+    role = 'producing'
+    role_key = role + "_gender_percentage"
+    movie_df = support.get_movies_df(role_key)
+    gender_df = support.get_staff_df('producers')[['_id', 'female_count', 'first_movie', 'last_movie', 'gender']]
+    movies_period = movie_df[(movie_df.year >= args.start_year) & (movie_df.year < args.end_year)]
+    movies_period = movies_period.sort_values('year')
+    seeds = build.generate_gender_seeds(gender_df)
+
+    print('Building network')
+    G = build.build_temporal_network(movies_period, seeds, args.belief_type, T)
+    topology = contagion.compile_temporal_network(G)
+    print('\t movies: {}, producers: {}'.format(topology.n_movies, topology.n_producers))
+    print('\t numba installed: {}'.format(contagion.HAS_NUMBA))
+
+    #one state reused by every run, reset in place
+    state = topology.new_state()
+    #compile the kernel before timing
+    contagion.contagion_belief_propagation_temporal_jit(None, P, D, T, topology=topology, state=state)
+
+    def array_run(engine, aggregate):
+        return lambda: engine(None, P, D, T, topology=topology, state=state, aggregate=aggregate)
+    array = contagion.contagion_belief_propagation_temporal_array
+    jit = contagion.contagion_belief_propagation_temporal_jit
+    #the same dynamics as the networkx engine, interaction by interaction
+    engines = [
+        ('networkx', lambda: contagion.contagion_belief_propagation_temporal_network(topology.reset_graph(G), P, D, T), args.networkx_i),
+        ('array', array_run(array, False), repeat),
+        ('jit', array_run(jit, False), repeat),
+    ]
+    #the aggregated rounds, timed apart
+    aggregated = [
+        ('array', array_run(array, True), repeat),
+        ('jit', array_run(jit, True), repeat),
+    ]
+    results = {}
+    print('Interaction by interaction')
+    for name, run, n in engines:
+        seconds, final = time_engine(run, n)
+        results[name] = seconds
+        print('{:>10}: {:10.4f} s per run, final adopters {:.1f} +- {:.1f} ({} runs)'.format(
+              name, seconds, np.mean(final), np.std(final), n))
+    for name in ['array', 'jit']:
+        print('{:>10}: {:.1f}x faster than networkx'.format(name, results['networkx']/results[name]))
+
+    if not contagion.rounds_convert(D, T):
+        print('Aggregated rounds: not used with dose {:.2f} < threshold {:.2f}'.format(D, T))
+        return
+    print('Aggregated rounds')
+    for name, run, n in aggregated:
+        seconds, final = time_engine(run, n)
+        print('{:>10}: {:10.4f} s per run, final adopters {:.1f} +- {:.1f} ({} runs), {:.1f}x faster than without'.format(
+              name, seconds, np.mean(final), np.std(final), n, results[name]/seconds))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--belief_type', default='empirical', type=str,
+                        choices = {'empirical', 'random', 'apriori'},
+                        help='''Ways to instantiate the belief per producer''')
+    parser.add_argument('--start_year', default=1990, type=int,
+                        help='''which year to start. Includes start year''')
+    parser.add_argument('--end_year', default=2000, type=int,
+                    help='''which year to end. Excludes end year''')
+
+    parser.add_argument('-p', type=float, default=0.1, help='the probability parameter')
+    parser.add_argument('-d', type=float, default=1.0,  help='the dose parameter')
+    parser.add_argument('-t', type=float, default=1.0, help='threshold parameter')
+
+    parser.add_argument('-i', type=int, default=20, help='number of runs of the array engines')
+    parser.add_argument('--networkx_i', type=int, default=2, help='number of runs of the networkx engine')
+
+    args = parser.parse_args()
+    main(args)
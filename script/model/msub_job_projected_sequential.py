@@ -44,6 +44,7 @@ if not os.path.exists(r_path ):
 
 programname = 'sequential_contagion.py'
 belief_type = 'empirical'
+workers = 1 #processes per job, the replicates are split between them
 pdtna = [np.arange(0.0,1.1,0.1), [1.0], [1.0], list(range(20)), [1,2]]
 pdtna_list  = list(product(*pdtna))
 
@@ -64,7 +65,7 @@ for p, d, t, n, a in pdtna_list:
 #MSUB -A b1022
 
 # ressource list                                                
-#MSUB -l nodes=1:ppn=1
+#MSUB -l nodes=1:ppn={}
 #MSUB -l walltime=32:00:00
 #MSUB -q buyin
 
@@ -78,8 +79,8 @@ module load python/anaconda3
 source activate movie-network
 cd
 cd {}
-python {} {} {} --belief_type {} -p {} -d {} -t {} -n {} -a {}
-""".format(o_path, e_path, current_path, programname, d_path, r_path, belief_type, p, d, t, n, a))
+python {} {} {} --belief_type {} -p {} -d {} -t {} -n {} -a {} --workers {}
+""".format(workers, o_path, e_path, current_path, programname, d_path, r_path, belief_type, p, d, t, n, a, workers))
 
 
 
@@ -44,17 +44,38 @@ if not os.path.exists(r_path ):
 
 programname = 'temporal_contagion.py'
 belief_type = 'empirical'
+workers = 1 #processes per job, the replicates are split between them
+engine = 'batch' #array engine of the jobs, 'networkx' only fits one parameter per job in the walltime
 pdtn = [np.arange(0.0,1.1,0.1), [1.0], [1.0], list(range(30))]
-pdtn_list  = list(product(*pdtn))
+#one job per network version runs the whole p, d, t grid on one network with the array engines,
+#the networkx engine keeps one job per parameter
+sweep = engine != 'networkx'
+seed = 0 #master seed of every job, the jobs derive the shuffle and the replicates of n from [seed, n].
+         #The same seed lets a resubmitted job resume from its checkpoints and find the cached networks
+#networks pre-built by script/network/shift_graph_maker.py with the same --seed and --threshold as t,
+#memory mapped by the jobs. A network that is not there yet is built and saved by the first job that needs it
+cache_path = os.path.abspath(os.path.join('/projects/b1022/Projects/junelee/', 'movie', 'network_cache'))
+resume = True #continue from the checkpoints of a job that hit the walltime
+if sweep:
+    pdtn_list = [(list(pdtn[0]), pdtn[1], pdtn[2], n) for n in pdtn[3]]
+else:
+    pdtn_list = [([p], [d], [t], n) for p, d, t, n in product(*pdtn)]
+
+def values_to_argument(values):
+    return ' '.join(str(v) for v in values)
+
+def values_to_name(values):
+    return '_'.join(str(int(100*v)) for v in values)
 
 for p, d, t, n in pdtn_list:
     date = subprocess.Popen('date', stdout=subprocess.PIPE, shell=True)
     (datetime, err) = date.communicate()
     print ('Time process ran', datetime)
-    print ('\t Parameter p is equal to {:.2f}'.format(p))
-    print ('\t Parameter d is equal to {:.2f}'.format(d))
-    print ('\t Parameter t is equal to {:.2f}'.format(t))   
-    with open(bash_path + "/job_script_real_p{}d{}t{}n{}.sh".format(int(100*p), int(100*d), int(100*t), int(n)), 'w') as queue_out:
+    print ('\t Parameter p is equal to {}'.format(values_to_argument(p)))
+    print ('\t Parameter d is equal to {}'.format(values_to_argument(d)))
+    print ('\t Parameter t is equal to {}'.format(values_to_argument(t)))
+    job_name = "job_script_real_p{}d{}t{}n{}.sh".format(values_to_name(p), values_to_name(d), values_to_name(t), int(n))
+    with open(os.path.join(bash_path, job_name), 'w') as queue_out:
             queue_out.write(
 """
 #!/bin/bash
@@ -62,7 +83,7 @@ for p, d, t, n in pdtn_list:
 #MSUB -A b1022
 
 # ressource list                                                
-#MSUB -l nodes=1:ppn=1
+#MSUB -l nodes=1:ppn={}
 #MSUB -l walltime=72:00:00
 #MSUB -q buyin
 
@@ -76,10 +97,12 @@ module load python/anaconda3
 source activate movie-network
 cd
 cd {}
-python {} {} {} --belief_type {} -p {} -d {} -t {} -n {}
-""".format(o_path, e_path, current_path, programname, d_path, r_path, belief_type, p, d, t, n))
+python {} {} {} --belief_type {} -p {} -d {} -t {} -n {} --engine {} --workers {} --seed {} --cache_dir {}{}
+""".format(workers, o_path, e_path, current_path, programname, d_path, r_path, belief_type,
+           values_to_argument(p), values_to_argument(d), values_to_argument(t), n, engine, workers, seed, cache_path,
+           ' --resume' if resume else ''))
 
 
 
     queue_out.close()
-    os.system("msub {}/job_script_real_p{}d{}t{}n{}.sh".format(bash_path, int(100*p), int(100*d), int(100*t), int(n)))
+    os.system("msub {}/{}".format(bash_path, job_name))
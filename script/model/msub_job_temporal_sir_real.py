@@ -36,7 +36,7 @@ if not os.path.exists(o_path ):
     raise ValueError
 
 # Path to save output  file for result
-r_path = os.path.abspath(os.path.join( '/projects/b1022/Projects/junelee/', 'movie', 'contagion','temporal', 'real'))
+r_path = os.path.abspath(os.path.join( '/projects/b1022/Projects/junelee/', 'movie', 'contagion','temporal', 'sir_real')) #kept apart from the threshold results
 
 if not os.path.exists(r_path ):
     os.makedirs(r_path)
@@ -44,17 +44,25 @@ if not os.path.exists(r_path ):
 
 programname = 'temporal_contagion.py'
 belief_type = 'empirical'
-pdtn = [np.arange(0.0,1.1,0.1), [1.0], [1.0], list(range(30))]
-pdtn_list  = list(product(*pdtn))
-
-for p, d, t, n in pdtn_list:
+dynamics = 'sir'
+engine = 'batch'
+#sir has no dose, and -t only builds the initial adopters, so both are left to the defaults of the script.
+#r is the probability of recovery per movie
+prn = [np.arange(0.0,1.1,0.1), np.arange(0.1,1.1,0.1), list(range(30))]
+prn_list  = list(product(*prn))
+
+for p, r, n in prn_list:
+    #every recovery gets its own result folder, the result files are named by p, d, t only
+    r_path_recovery = os.path.join(r_path, 'r{}'.format(int(round(100*r))))
+    if not os.path.exists(r_path_recovery):
+        os.makedirs(r_path_recovery)
     date = subprocess.Popen('date', stdout=subprocess.PIPE, shell=True)
     (datetime, err) = date.communicate()
     print ('Time process ran', datetime)
     print ('\t Parameter p is equal to {:.2f}'.format(p))
-    print ('\t Parameter d is equal to {:.2f}'.format(d))
-    print ('\t Parameter t is equal to {:.2f}'.format(t))   
-    with open(bash_path + "/job_script_real_p{}d{}t{}n{}.sh".format(int(100*p), int(100*d), int(100*t), int(n)), 'w') as queue_out:
+    print ('\t Parameter r is equal to {:.2f}'.format(r))
+    job_name = "job_script_real_p{}r{}n{}.sh".format(int(100*p), int(round(100*r)), int(n))
+    with open(os.path.join(bash_path, job_name), 'w') as queue_out:
             queue_out.write(
 """
 #!/bin/bash
@@ -76,10 +84,10 @@ module load python/anaconda3
 source activate movie-network
 cd
 cd {}
-python {} {} {} --belief_type {} -p {} -d {} -t {} -n {}
-""".format(o_path, e_path, current_path, programname, d_path, r_path, belief_type, p, d, t, n))
+python {} {} {} --belief_type {} -p {} -n {} --dynamics {} --recovery {} --engine {}
+""".format(o_path, e_path, current_path, programname, d_path, r_path_recovery, belief_type, p, n, dynamics, r, engine))
 
 
 
     queue_out.close()
-    os.system("msub {}/job_script_real_p{}d{}t{}n{}.sh".format(bash_path, int(100*p), int(100*d), int(100*t), int(n)))
+    os.system("msub {}".format(os.path.join(bash_path, job_name)))
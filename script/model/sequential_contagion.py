@@ -84,6 +84,37 @@ def make_filename(directory, network_type, parameter_dict, ver=None):
     #order of contagion_[network_type]_[parameters]_ver_[network version]_[iteration of the version].json
     return save_name
 
+def make_checkpoint(result_dir, param_dict, interval, n, key, resume):
+    """
+    checkpoint of one parameter, in the checkpoint folder of the result directory
+    so the result readers do not pick it up
+    Input
+        param_dict - dict {'p':0.1, 'd':1.0, 't':1.0}
+        interval - number of years aggregated
+        n - network version
+        key - the arguments besides p, d, t, a and n that change the replicates
+        resume - load the replicates that are already done, otherwise start over
+    """
+    formatted_parameters = {k: save.parameter_to_string(v, k) for k, v in param_dict.items()}
+    file_name = '_'.join(['contagion', 'agg_{}'.format(interval), '{p:}_{d:}_{t:}'.format(**formatted_parameters),
+                          str(n), key])
+    checkpoint = save.ReplicateCheckpoint(os.path.join(result_dir, 'checkpoint', file_name + '.jsonl'))
+    if resume:
+        return checkpoint.load()
+    return checkpoint.reset()
+
+def checkpoint_replicate(checkpoint, i, adopter_history):
+    """
+    append replicate i to the checkpoint, the first replicate writes the steps and the year intervals.
+    The aggregated history is [year interval, step, adopters]
+    """
+    if checkpoint.index is None:
+        checkpoint.start(adopter_history[:, 1], adopter_history[:, 0])
+    elif not np.array_equal(checkpoint.year, adopter_history[:, 0]):
+        m = "years are not matching"
+        gerr.generic_error_handler(message=m)
+    checkpoint.append(i, adopter_history[:, 2])
+
 ###Functions###
 def main(args):
     #input file as args[0] transform final_schedule.csv
@@ -101,7 +132,18 @@ def main(args):
     start_year = args.start_year #1990
     end_year = args.end_year #2000
     interval = args.a
+    workers = args.workers
+    seed = args.seed #master seed of the shuffle and of the replicates
+    #the replicates of every network version get their own streams from the master seed
+    run_seed = contagion.derive_seed(seed, n)
+    param_dict = {'p':P, 'd':D, 't':T}
 
+    #every finished replicate is appended to the checkpoint, so a stopped job continues with --resume
+    key = '_'.join(['i{}'.format(iter_no), '{}-{}'.format(start_year, end_year), belief_type, 'seed{}'.format(seed)])
+    checkpoint = make_checkpoint(result_dir, param_dict, interval, n, key, args.resume)
+    if checkpoint.complete:
+        print ('Already done with parameter prob: {:.2f}, dose: {:.2f}, threshold: {:.2f}'.format(P, D, T))
+        return
 
     #Read data
     print('Reading file')
@@ -127,40 +169,29 @@ def main(args):
     if n == 0:
         movies_period = movies_period.sort_values('year')
     else:
-        movies_period = movies_period.sample(frac=1).sort_values('year')
+        if args.resume and seed is None:
+            m = "--resume needs --seed, so the shuffled network is the same as in the first run"
+            gerr.generic_error_handler(message=m)
+        #the shuffle follows the master seed, so a resumed run gets the same network
+        random_state = None if seed is None else np.random.RandomState([seed, n])
+        movies_period = movies_period.sample(frac=1, random_state=random_state).sort_values('year')
     #for the real schedule
     print('\t\t Building network')
     print('\t\t Contagion propagation!')
-    for i in range(iter_no):
-        adopter_history = contagion.cumulative_adopters_projected_network_sequential(movies_period, interval, seeds, belief_type, P, D, T)
-        if i == 0:
-            print('\t\t Initializing df')
-            df_adopter = pd.DataFrame(adopter_history, columns=['year', 'movie_order', '{}'.format(i)])
-            df_adopter = df_adopter.set_index(['movie_order'])
-            year_list = adopter_history[:,0]
-        else:
-            print('\t\t appending df')
-            if np.array_equal(year_list,adopter_history[:,0]):
-                df_adopter['{}'.format(i)] = pd.Series(adopter_history[:, 2], index=adopter_history[:, 1])
-            else:
-                m = "years are not matching"
-                gerr.generic_error_handler(message=m)
-        
-        print(i, int(iter_no/2))
-        if (i != 0) and (i % int(iter_no/2)==0): # save half way
-            print('Half way saving')
-            param_dict = {'p':P, 'd':D, 't':T}
-            formatted_parameters = {k: save.parameter_to_string(v, k) for k, v in param_dict.items()}    
-            save_path = make_filename(result_dir, 'agg_{}'.format(interval), formatted_parameters,n)
-            save.save_file_json(df_adopter, save_path)
+    if checkpoint.n_replicates:
+        print('\t\t Resuming after {} iterations'.format(checkpoint.n_replicates))
+    replicates = contagion.iter_replicates(contagion.cumulative_adopters_projected_network_sequential,
+                                           (movies_period, interval, seeds, belief_type, P, D, T),
+                                           iter_no, workers, run_seed, start=checkpoint.n_replicates)
+    for i, adopter_history in replicates:
+        checkpoint_replicate(checkpoint, i, adopter_history)
 
     print('Saving result')
-    param_dict = {'p':P, 'd':D, 't':T}
     formatted_parameters = {k: save.parameter_to_string(v, k) for k, v in param_dict.items()}
-    
     save_path = make_filename(result_dir, 'agg_{}'.format(interval), formatted_parameters, n)
-    save.save_file_json(df_adopter, save_path)
-    del df_adopter
+    save.save_file_json(checkpoint.to_frame(), save_path)
+    #the result is saved, the checkpoint only keeps that the parameter is done
+    checkpoint.finish(save_path)
 
 
 if __name__ == '__main__':
@@ -190,6 +221,12 @@ if __name__ == '__main__':
 
     parser.add_argument('-i', type=int, default=500, help='number of iterations')
     parser.add_argument('-n', type=int, default=20, help='number of network generation')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes running the iterations')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='''master seed of the shuffled network and of the replicates,
+                          every iteration gets its own random stream from it''')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='continue from the checkpoint of an earlier run with the same arguments')
     
     args = parser.parse_args()
     main(args)
@@ -37,6 +37,7 @@ from os import listdir
 from os.path import isfile, join
 import re
 import json
+from itertools import product
 #Local
 src_dir = os.path.abspath(os.path.join(os.pardir, os.pardir, 'src'))
 sys.path[0] = src_dir
@@ -47,13 +48,14 @@ import parser.saver as save
 import parser.support as support
 
 
-def make_filename(directory, network_type, parameter_dict, ver=None):
+def make_filename(directory, network_type, parameter_dict, ver=None, ext='json'):
     """
     save the pandas dataframe to csv
     Input
         directory - name of save directory
         network_type - string type of nework type
         parameter_dict - dict {p:0.1, d:1.0, t:1.0}
+        ext - extension of the file, json or csv
     output
         save_name - string of save_name
     """
@@ -71,18 +73,93 @@ def make_filename(directory, network_type, parameter_dict, ver=None):
     file_name = '_'.join([file_name, '{p:}_{d:}_{t:}'.format(**parameter_dict)])
     # add verson 
     file_name_iter = '_'.join([file_name, str(ver), str(i)])
-    file_name_iter = '.'.join([file_name_iter, 'json'])
+    file_name_iter = '.'.join([file_name_iter, ext])
 
     save_name = os.path.abspath(os.path.join(directory, file_name_iter))
     while os.path.isfile(save_name):
         #check to see if the name exists already
         file_name_iter = '_'.join([file_name, 'ver', str(ver), str(i)])
-        file_name_iter = '.'.join([file_name_iter, 'json'])
+        file_name_iter = '.'.join([file_name_iter, ext])
         save_name = os.path.abspath(os.path.join(directory, file_name_iter))
         i += 1
     #order of contagion_[sched_type]_[parameters]_ver_[network version]_[iteration of the version].json
     return save_name
 
+def run_networkx_replicate(G, topology, P, D, T, rng=random):
+    """
+    one replicate of the networkx engine.
+    The engine changes the beliefs in G, so every replicate puts the initial beliefs
+    of the topology back on G instead of building the network again
+    """
+    topology.reset_graph(G)
+    return contagion.contagion_belief_propagation_temporal_network(G, P, D, T, rng=rng)
+
+def save_result(checkpoint, result_dir, param_dict, n, output='json'):
+    """
+    save the adopters of one parameter from its checkpoint with the make_filename naming
+    Input
+        checkpoint - ReplicateCheckpoint with every replicate of the parameter
+        param_dict - dict {'p':0.1, 'd':1.0, 't':1.0}
+        n - network version
+        output - json builds the dataframe of adopters per movie, one column per iteration,
+                 csv streams the replicates through a HistoryWriter one row at a time
+    Output
+        save_path - path of the saved file
+    """
+    formatted_parameters = {k: save.parameter_to_string(v, k) for k, v in param_dict.items()}
+    save_path = make_filename(result_dir, 'real', formatted_parameters, n, output)
+    if output == 'csv':
+        return checkpoint.save_csv(save_path)
+    save.save_file_json(checkpoint.to_frame(), save_path)
+    return save_path
+
+def run_key(args):
+    """
+    the arguments besides p, d, t and n that change the replicates, in the checkpoint name
+    so --resume only continues a run with the same arguments
+    """
+    parts = ['i{}'.format(args.i), '{}-{}'.format(args.start_year, args.end_year), args.belief_type,
+             args.dynamics, args.engine, 'block{}'.format(args.block) if args.engine == 'batch' else '',
+             'recovery{}'.format(args.recovery) if args.dynamics in ('sir', 'sis') else '',
+             'exposures{}'.format(args.exposures) if args.dynamics == 'exposure' else '',
+             'common' if args.common_random else '', 'seed{}'.format(args.seed)]
+    return '_'.join(x for x in parts if x)
+
+def make_checkpoint(result_dir, param_dict, n, key, resume):
+    """
+    checkpoint of one parameter, in the checkpoint folder of the result directory
+    so the result readers do not pick it up
+    Input
+        param_dict - dict {'p':0.1, 'd':1.0, 't':1.0}
+        n - network version
+        key - run_key of the arguments
+        resume - load the replicates that are already done, otherwise start over
+    """
+    formatted_parameters = {k: save.parameter_to_string(v, k) for k, v in param_dict.items()}
+    file_name = '_'.join(['contagion', '0', '{p:}_{d:}_{t:}'.format(**formatted_parameters), str(n), key])
+    checkpoint = save.ReplicateCheckpoint(os.path.join(result_dir, 'checkpoint', file_name + '.jsonl'))
+    if resume:
+        return checkpoint.load()
+    return checkpoint.reset()
+
+def checkpoint_replicate(checkpoint, i, adopter_history):
+    """
+    append replicate i to the checkpoint, the first replicate writes the movie order and the years
+    """
+    if checkpoint.index is None:
+        checkpoint.start(adopter_history[:, 0], adopter_history[:, 1])
+    elif not np.array_equal(checkpoint.year, adopter_history[:, 1]):
+        m = "years are not matching"
+        gerr.generic_error_handler(message=m)
+    checkpoint.append(i, adopter_history[:, 2])
+
+def finish_checkpoint(checkpoint, result_dir, param_dict, n, output='json'):
+    """
+    save the result of a parameter from its checkpoint and mark the parameter as done
+    """
+    print ('Saving data with parameter prob: {p:.2f}, dose: {d:.2f}, threshold: {t:.2f}'.format(**param_dict))
+    checkpoint.finish(save_result(checkpoint, result_dir, param_dict, n, output))
+
 ###Functions###
 def main(args):
     #input file as args[0] transform final_schedule.csv
@@ -92,10 +169,29 @@ def main(args):
     print ('Data_file', data_file)
     print ('Result_dir', result_dir)
     
-    P, D, T = args.p, args.d, args.t
+    #every combination of the given p, d and t values
+    parameters = list(product(args.p, args.d, args.t))
     belief_type = args.belief_type
     iter_no = args.i
     n = args.n #number of times to generate new nework
+    engine = args.engine
+    workers = args.workers
+    seed = args.seed #master seed of the shuffles and of the replicates
+    #the replicates of every network version get their own streams from the master seed
+    run_seed = contagion.derive_seed(seed, n)
+    dynamics = args.dynamics
+    if args.common_random and engine != 'batch':
+        m = "--common_random needs --engine batch"
+        gerr.generic_error_handler(message=m)
+    if dynamics != 'threshold' and engine == 'networkx':
+        m = "--dynamics {} runs on the compiled network, choose --engine batch or array".format(dynamics)
+        gerr.generic_error_handler(message=m)
+    if dynamics in ('sir', 'sis') and args.recovery is None:
+        m = "--dynamics {} needs --recovery, the probability of recovery per movie".format(dynamics)
+        gerr.generic_error_handler(message=m)
+    if dynamics == 'exposure' and (args.exposures is None or args.exposures < 1):
+        m = "--dynamics exposure needs --exposures, the number of exposures to adopt, of at least 1"
+        gerr.generic_error_handler(message=m)
     #year
     start_year = args.start_year #1990
     end_year = args.end_year #2000
@@ -112,49 +208,87 @@ def main(args):
     movie_df = support.get_movies_df(role_key)
     print('Got all_movies')
     gender_df = support.get_staff_df('producers')[['_id', 'female_count', 'first_movie', 'last_movie', 'gender']]
-    movies_period = movie_df[(movie_df.year >= start_year) & (movie_df.year < ennetwork_builders = build.generate_gender_seeds(gender_df)
-    #starting the dynamics
-    print ('Making data with parameter prob: {:.2f}, dose: {:.2f}, threshold: {:.2f}'.format(P, D, T))
-    
+    movies_period = movie_df[(movie_df.year >= start_year) & (movie_df.year < end_year)]
+    seeds = build.generate_gender_seeds(gender_df)
     # for n in range(gen_no):
     print('\t Iteration: {}'.format(n))
     #Build network
     if n == 0:
         movies_period = movies_period.sort_values('year')
     else:
-        movies_period = movies_period.sample(frac=1).sort_values('year')
+        if args.resume and seed is None:
+            m = "--resume needs --seed, so the shuffled network is the same as in the first run"
+            gerr.generic_error_handler(message=m)
+        #the shuffle follows the master seed, so a resumed run gets the same network
+        random_state = None if seed is None else np.random.RandomState([seed, n])
+        movies_period = movies_period.sample(frac=1, random_state=random_state).sort_values('year')
     #for the real schedule
     print('\t\t Building network')
     print('\t\t Contagion propagation!')
-    for i in range(inetwork_builderG = build.build_temporal_network(movies_period, seeds, belief_type, T)
-        adopter_history = contagion.contagion_belief_propagation_temporal_network(G, P, D, T)
-        if i == 0:
-            print('\t\t Initializing df')
-            df_adopter = pd.DataFrame(adopter_history, columns=['movie_order', 'year', '{}'.format(i)])
-            df_adopter = df_adopter.set_index('movie_order')
-            year_list = adopter_history[:,1]
-        else:
-            print('\t\t appending df')
-            if np.array_equal(year_list,adopter_history[:,1]):
-                df_adopter['{}'.format(i)] = pd.Series(adopter_history[:, 2], index=adopter_history[:, 0])
-            else:
-                m = "years are not matching"
-                gerr.generic_error_handler(message=m)
-        if i % int(iter_no/2): # save half way
-            print('Half way saving')
+    #every finished replicate is appended to the checkpoint of its parameter
+    key = run_key(args)
+    checkpoints = {(P, D, T): make_checkpoint(result_dir, {'p':P, 'd':D, 't':T}, n, key, args.resume)
+                   for P, D, T in parameters}
+    done = [x for x in parameters if checkpoints[x].complete]
+    for P, D, T in done:
+        print ('Already done with parameter prob: {:.2f}, dose: {:.2f}, threshold: {:.2f}'.format(P, D, T))
+    parameters = [x for x in parameters if x not in done]
+    if engine == 'networkx':
+        #every replicate puts the initial beliefs back on G, so one graph serves every parameter with
+        #the same threshold, and only the initial beliefs and status depend on the threshold.
+        #The parameters run threshold by threshold, so only one graph is kept at a time
+        graphs = {}
+        for P, D, T in sorted(parameters, key=lambda x: x[2]):
+            #starting the dynamics
+            print ('Making data with parameter prob: {:.2f}, dose: {:.2f}, threshold: {:.2f}'.format(P, D, T))
             param_dict = {'p':P, 'd':D, 't':T}
-            formatted_parameters = {k: save.parameter_to_string(v, k) for k, v in param_dict.items()}    
-            save_path = make_filename(result_dir, 'real', formatted_parameters,n)
-            save.save_file_json(df_adopter, save_path)
-
-    print('Saving result')
-    param_dict = {'p':P, 'd':D, 't':T}
-    formatted_parameters = {k: save.parameter_to_string(v, k) for k, v in param_dict.items()}
-    
-    save_path = make_filename(result_dir, 'real', formatted_parameters, n)
-    save.save_file_json(df_adopter, save_path)
-    del df_adopter
+            checkpoint = checkpoints[(P, D, T)]
+            if checkpoint.n_replicates:
+                print('\t\t Resuming after {} iterations'.format(checkpoint.n_replicates))
+            if T not in graphs:
+                G = build.build_temporal_network(movies_period, seeds, belief_type, T)
+                graphs = {T: (G, contagion.compile_temporal_network(G))}
+            G, topology = graphs[T]
+            replicates = contagion.iter_replicates(run_networkx_replicate, (G, topology, P, D, T),
+                                                   iter_no, workers, run_seed, start=checkpoint.n_replicates)
+            for i, adopter_history in replicates:
+                checkpoint_replicate(checkpoint, i, adopter_history)
 
+            finish_checkpoint(checkpoint, result_dir, param_dict, n, args.output)
+    elif parameters:
+        #the array engines run on their own copy of the beliefs, so one topology serves every parameter
+        #with the same threshold. The initial beliefs and status are built with the threshold, so every
+        #threshold gets its own topology, compiled from the sparse incidence without networkx.
+        #The shuffle of the movies follows [seed, n], so the same cache key is the same network
+        cache = args.cache_dir is not None and (n == 0 or seed is not None)
+        fingerprint = build.dataset_fingerprint(movie_df, seeds) if cache else None
+        topologies = {}
+        for T in sorted(set(T for P, D, T in parameters)):
+            if cache:
+                incidence = build.cached_temporal_incidence(args.cache_dir, fingerprint, movies_period, seeds, belief_type, T,
+                                                            start_year, end_year, None if n == 0 else [seed, n])
+            else:
+                incidence = build.build_temporal_incidence(movies_period, seeds, belief_type, T)
+            topologies[T] = contagion.compile_temporal_network(incidence)
+        for P, D, T in parameters:
+            if checkpoints[(P, D, T)].n_replicates:
+                print('Resuming parameter prob: {:.2f}, dose: {:.2f}, threshold: {:.2f} after {} iterations'.format(
+                      P, D, T, checkpoints[(P, D, T)].n_replicates))
+        #every replicate is checkpointed as it comes, the batch engine finishes --block replicates at a time
+        start = {x: checkpoints[x].n_replicates for x in parameters}
+        sweep = contagion.iter_sweep_replicates(topologies, parameters, iter_no, engine, workers, run_seed,
+                                                dynamics=dynamics, common_random=args.common_random,
+                                                start=start, block=args.block, recovery=args.recovery,
+                                                exposures=args.exposures)
+        for (P, D, T), i, adopter_history in sweep:
+            checkpoint = checkpoints[(P, D, T)]
+            checkpoint_replicate(checkpoint, i, adopter_history)
+            if checkpoint.n_replicates == iter_no:
+                finish_checkpoint(checkpoint, result_dir, {'p':P, 'd':D, 't':T}, n, args.output)
+        #the parameters whose replicates were all in the checkpoint already
+        for P, D, T in parameters:
+            if not checkpoints[(P, D, T)].complete:
+                finish_checkpoint(checkpoints[(P, D, T)], result_dir, {'p':P, 'd':D, 't':T}, n, args.output)
 
 if __name__ == '__main__':
     parser = ArgumentParser()
@@ -176,14 +310,47 @@ if __name__ == '__main__':
                     help='''which year to start. Excludes end year''')
 
 
-    parser.add_argument('-p', type=float, default=0.1, help='the probability parameter')
-    parser.add_argument('-d', type=float, default=1.0,  help='the dose parameter')
-    parser.add_argument('-t', type=float, default=1.0, help='threshold parameter')
+    parser.add_argument('-p', type=float, nargs='+', default=[0.1], help='the probability parameter, one or more values')
+    parser.add_argument('-d', type=float, nargs='+', default=[1.0],  help='the dose parameter, one or more values')
+    parser.add_argument('-t', type=float, nargs='+', default=[1.0], help='threshold parameter, one or more values')
     
 
     parser.add_argument('-i', type=int, default=1000, help='number of iterations')
     parser.add_argument('-n', type=int, default=30, help='number of network generation')
     parser.add_argument('-r', action='store_true', default=False, help='is it real schedule?')
+    parser.add_argument('--engine', default='networkx', type=str,
+                        choices = {'networkx', 'array', 'batch', 'jit'},
+                        help='''Which contagion engine to use.
+                          networkx walks the graph, array runs on the compiled index arrays,
+                          batch runs all the iterations at once on the compiled index arrays,
+                          jit runs the compiled index arrays in a numba kernel (plain python without numba)
+                            ''')
+    parser.add_argument('--dynamics', default='threshold', type=str,
+                        choices = {'threshold', 'sir', 'sis', 'exposure'},
+                        help='''Dynamics of the contagion.
+                          threshold is the belief model, sir and sis take --recovery as the probability of recovery per movie,
+                          exposure is the k-exposure complex contagion with --exposures as k
+                            ''')
+    parser.add_argument('--recovery', type=float, default=None,
+                        help='probability of recovery per movie of the sir and sis dynamics')
+    parser.add_argument('--exposures', type=int, default=None,
+                        help='number of exposures k a producer needs to adopt in the exposure dynamics')
+    parser.add_argument('--block', type=int, default=100,
+                        help='number of iterations the batch engine runs together between checkpoints')
+    parser.add_argument('--common_random', action='store_true', default=False,
+                        help='same random numbers for the same iteration at every parameter, to compare the parameters')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes running the iterations')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='''master seed of the shuffle of the network and of the iterations, every network version
+                          and iteration gets its own random stream from it, so give every -n the same seed''')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='continue from the checkpoint of an earlier run with the same arguments')
+    parser.add_argument('--cache_dir', default=None, type=str,
+                        help='''folder of the network cache, the array engines open the network from it
+                          instead of building it, or build it once and save it there''')
+    parser.add_argument('--output', default='json', type=str, choices={'json', 'csv'},
+                        help='''format of the results. json saves the dataframe of every iteration at once,
+                          csv streams the iterations from the checkpoint one row at a time''')
     
     args = parser.parse_args()
     main(args)
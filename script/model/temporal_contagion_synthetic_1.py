@@ -47,13 +47,14 @@ import parser.saver as save
 import parser.support as support
 
 
-def make_filename(directory, network_type, parameter_dict, ver=None):
+def make_filename(directory, network_type, parameter_dict, ver=None, ext='json'):
     """
     save the pandas dataframe to csv
     Input
         directory - name of save directory
         network_type - string type of nework type
         parameter_dict - dict {p:0.1, d:1.0, t:1.0}
+        ext - extension of the file, json or csv
     output
         save_name - string of save_name
     """
@@ -70,12 +71,21 @@ def make_filename(directory, network_type, parameter_dict, ver=None):
     file_name = '_'.join([file_name, '{p:}_{d:}_{t:}'.format(**parameter_dict)])
     # add verson 
     file_name_iter = '_'.join([file_name, 'ver', str(ver)])
-    file_name_iter = '.'.join([file_name_iter, 'json'])
+    file_name_iter = '.'.join([file_name_iter, ext])
 
     save_name = os.path.abspath(os.path.join(directory, file_name_iter))
     #order of contagion_[sched_type]_[parameters]_ver_[network version]_[iteration of the version].json
     return save_name
 
+def run_networkx_replicate(G, topology, P, D, T, rng=random):
+    """
+    one replicate of the networkx engine.
+    The engine changes the beliefs in G, so every replicate puts the initial beliefs
+    of the topology back on G instead of building the network again
+    """
+    topology.reset_graph(G)
+    return contagion.contagion_belief_propagation_temporal_network(G, P, D, T, rng=rng)
+
 ###Functions###
 def main(args):
     #input file as args[0] transform final_schedule.csv
@@ -89,6 +99,8 @@ def main(args):
     belief_type = args.belief_type
     iter_no = args.i
     n = args.n #number of times to generate new nework
+    workers = args.workers
+    seed = args.seed #master seed of the seed adopters, the shuffles and the replicates
     #year
     start_year = args.start_year #1990
     end_year = args.end_year #2000
@@ -103,9 +115,11 @@ def main(args):
 
         #make movie data into dataframe
         movies_period = movie_df[(movie_df.year >= start_year) & (movie_df.year < end_year)]
+        #the seed adopters and the shuffle of the version follow [seed, version, n]
+        random_state = np.random.RandomState(None if seed is None else [seed, int(ver), n])
         num_seeds = 1064
-        total_producers = list(set([i for sublist in movies_period.producers.tolist() for i in sublist]))
-        seeds = np.random.choice(total_producers, size=num_seeds, replace=False)
+        total_producers = sorted(set([i for sublist in movies_period.producers.tolist() for i in sublist]))
+        seeds = random_state.choice(total_producers, size=num_seeds, replace=False)
         #starting the dynamics
         print ('Making data with parameter prob: {:.2f}, dose: {:.2f}, threshold: {:.2f}'.format(P, D, T))
     
@@ -114,39 +128,51 @@ def main(args):
         if n == 0:
             movies_period = movies_period.sort_values('year')
         else:
-            movies_period = movies_period.sample(frac=1).sort_values('year')
+            movies_period = movies_period.sample(frac=1, random_state=random_state).sort_values('year')
         #for the real schedule
         print('\t\t Building network')
         print('\t\t Contagion propagation!')
-        for i in range(iter_no):
-            G = build.build_temporal_network(movies_period, seeds, belief_type, T)
-            adopter_history = contagion.contagion_belief_propagation_temporal_network(G, P, D, T)
-            if i == 0:
-                print('\t\t Initializing df')
-                df_adopter = pd.DataFrame(adopter_history, columns=['movie_order', 'year', '{}'.format(i)])
-                df_adopter = df_adopter.set_index('movie_order')
-                year_list = adopter_history[:,1]
-            else:
-                print('\t\t appending df')
-                if np.array_equal(year_list,adopter_history[:,1]):
-                    df_adopter['{}'.format(i)] = pd.Series(adopter_history[:, 2], index=adopter_history[:, 0])
-                else:
+        G = build.build_temporal_network(movies_period, seeds, belief_type, T)
+        topology = contagion.compile_temporal_network(G)
+        replicates = contagion.iter_replicates(run_networkx_replicate,
+                                               (G, topology, P, D, T),
+                                               iter_no, workers, contagion.derive_seed(seed, int(ver), n))
+        param_dict = {'p':P, 'd':D, 't':T}
+        formatted_parameters = {k: save.parameter_to_string(v, k) for k, v in param_dict.items()}
+        save_path = make_filename(result_dir, 'synthetic', formatted_parameters, '_'.join([ver, str(n)]), args.output)
+        if args.output == 'csv':
+            #every iteration is written as a row as soon as it is done, nothing is kept in memory
+            writer = None
+            year = None
+            for i, adopter_history in replicates:
+                if writer is None:
+                    writer = save.replicate_history_writer(save_path, adopter_history[:, 0], adopter_history[:, 1])
+                    year = adopter_history[:, 1]
+                elif not np.array_equal(year, adopter_history[:, 1]):
                     m = "years are not matching"
                     gerr.generic_error_handler(message=m)
-            if i % int(iter_no/2) and i!= 0: # save half way
+                writer([i, adopter_history[:, 2]])
+            print('Saving result')
+            if writer is not None:
+                writer.close()
+            continue
+        #one preallocated movies x iterations matrix, made into a dataframe when saving
+        matrix = None
+        for i, adopter_history in replicates:
+            if matrix is None:
+                print('\t\t Initializing matrix')
+                matrix = save.ReplicateMatrix.from_history(adopter_history, iter_no)
+            elif not matrix.matches(adopter_history):
+                m = "years are not matching"
+                gerr.generic_error_handler(message=m)
+            matrix.set(i, adopter_history)
+            if i != 0 and i % int(iter_no/2) == 0: # save half way
                 print('Half way saving')
-                param_dict = {'p':P, 'd':D, 't':T}
-                formatted_parameters = {k: save.parameter_to_string(v, k) for k, v in param_dict.items()}    
-                save_path = make_filename(result_dir, 'synthetic', formatted_parameters, '_'.join([ver, str(n)]))
-                save.save_file_json(df_adopter, save_path)
+                matrix.save_json(save_path)
 
         print('Saving result')
-        param_dict = {'p':P, 'd':D, 't':T}
-        formatted_parameters = {k: save.parameter_to_string(v, k) for k, v in param_dict.items()}
-        
-        save_path = make_filename(result_dir, 'synthetic', formatted_parameters, '_'.join([ver, str(n)]))
-        save.save_file_json(df_adopter, save_path)
-        del df_adopter
+        matrix.save_json(save_path)
+        del matrix
 
 
 if __name__ == '__main__':
@@ -176,7 +202,13 @@ if __name__ == '__main__':
 
     parser.add_argument('-i', type=int, default=100, help='number of iterations')
     parser.add_argument('-n', type=int, default=10, help='number of network generation')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes running the iterations')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='''master seed, every network version and iteration gets its own random stream from it''')
     parser.add_argument('-r', action='store_true', default=False, help='is it real schedule?')
+    parser.add_argument('--output', default='json', type=str, choices={'json', 'csv'},
+                        help='''format of the results. json saves the dataframe of every iteration,
+                          csv writes every iteration as a row as soon as it is done''')
     
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,135 @@
+"""
+Statistical check of the aggregated interaction rounds of the temporal contagion model
+
+Summary:
+1. Single movie: play the interactions of one movie one by one many times and compare the
+   number of new adopters with min(Binomial(interaction, p), non adopters) with a chi-square test
+2. Real network: run the batch engine with and without aggregate and compare the number of
+   adopters at the quartiles of the movies and at the end with two-sample Kolmogorov-Smirnov tests
+*Only the regime where every successful interaction converts (dose >= threshold) is aggregated
+*Small p-values on every row mean the two samplers differ, a few small ones are expected by chance
+"""
+
+##########Packages##########
+#System
+import sys
+import os
+import time
+from argparse import ArgumentParser
+import numpy as np
+from scipy import stats
+#Local
+src_dir = os.path.abspath(os.path.join(os.pardir, os.pardir, 'src'))
+sys.path[0] = src_dir
+import model.contagion as contagion
+import network.network_builder as build
+import gale.general.errors as gerr
+import parser.support as support
+
+
+def single_movie_topology(n_adopters, n_nonadopters):
+    """
+    topology of one movie with the given adopters and non adopters
+    """
+    n = n_adopters + n_nonadopters
+    belief = [1.0]*n_adopters + [0.0]*n_nonadopters
+    status = [True]*n_adopters + [False]*n_nonadopters
+    return contagion.ContagionTopology([1], [0], [0, n], list(range(n)), list(range(n)), belief, status)
+
+def single_movie_test(n_adopters, n_nonadopters, prob, dose, threshold, interaction, replicates, rng):
+    """
+    chi-square test of the step by step interactions of one movie against the aggregated distribution
+    output:
+        statistic, p_value - of the chi-square test, nan when nearly every replicate falls in one cell
+        mean - mean number of new adopters of the step by step interactions
+    """
+    topology = single_movie_topology(n_adopters, n_nonadopters)
+    df_adopter = contagion.contagion_belief_propagation_temporal_batch(None, prob, dose, threshold, replicates,
+                                                                       interaction, topology, aggregate=False, rng=rng)
+    new_adopters = df_adopter.iloc[-1, 1:].values - n_adopters
+    observed = np.bincount(new_adopters, minlength=n_nonadopters + 1)
+    #min(Binomial(interaction, prob), n_nonadopters)
+    expected = stats.binom.pmf(np.arange(n_nonadopters + 1), interaction, prob)
+    expected[-1] = stats.binom.sf(n_nonadopters - 1, interaction, prob)
+    expected = expected*replicates
+    #pool the cells that are too small for the chi-square approximation
+    keep = expected >= 5
+    observed = np.append(observed[keep], observed[~keep].sum())
+    expected = np.append(expected[keep], expected[~keep].sum())
+    if expected[-1] < 5:
+        observed = np.append(observed[:-2], observed[-2:].sum())
+        expected = np.append(expected[:-2], expected[-2:].sum())
+    statistic, p_value = stats.chisquare(observed, expected)
+    return statistic, p_value, new_adopters.mean()
+
+###Functions###
+def main(args):
+    P, D, T = args.p, args.d, args.t
+    interaction = args.interaction
+    replicates = args.i
+    if not contagion.rounds_convert(D, T):
+        m = "the rounds are only aggregated when every success converts, the dose has to reach the threshold"
+        gerr.generic_error_handler(message=m)
+    rng = np.random.RandomState(args.seed)
+
+    print('Single movie, {} replicates'.format(replicates))
+    for n_adopters, n_nonadopters in [(1, 1), (1, 4), (2, 8), (1, 30)]:
+        for prob in sorted(set([0.05, 0.3, P])):
+            statistic, p_value, mean = single_movie_test(n_adopters, n_nonadopters, prob, D, T, interaction,
+                                                         replicates, rng)
+            print('\t adopters {:2d}, non adopters {:2d}, p {:.2f}: mean new adopters {:6.3f}, '
+                  'chi-square {:8.2f}, p-value {:.3f}'.format(n_adopters, n_nonadopters, prob, mean, statistic, p_value))
+
+    if args.no_network:
+        return
+    role = 'producing'
+    role_key = role + "_gender_percentage"
+    movie_df = support.get_movies_df(role_key)
+    gender_df = support.get_staff_df('producers')[['_id', 'female_count', 'first_movie', 'last_movie', 'gender']]
+    movies_period = movie_df[(movie_df.year >= args.start_year) & (movie_df.year < args.end_year)]
+    movies_period = movies_period.sort_values('year')
+    seeds = build.generate_gender_seeds(gender_df)
+    print('Building network')
+    incidence = build.build_temporal_incidence(movies_period, seeds, args.belief_type, T)
+    topology = contagion.compile_temporal_network(incidence)
+    print('\t movies: {}, producers: {}'.format(topology.n_movies, topology.n_producers))
+
+    results = {}
+    for aggregate in [False, True]:
+        start = time.time()
+        results[aggregate] = contagion.contagion_belief_propagation_temporal_batch(None, P, D, T, replicates, interaction,
+                                                                                   topology, aggregate=aggregate, rng=rng)
+        print('\t aggregate {}: {:.2f} s'.format(aggregate, time.time() - start))
+    print('Real network, p {:.2f}, {} replicates each'.format(P, replicates))
+    for q in [0.25, 0.5, 0.75, 1.0]:
+        row = int(q*topology.n_movies)
+        step = results[False].iloc[row, 1:].values
+        aggregated = results[True].iloc[row, 1:].values
+        statistic, p_value = stats.ks_2samp(step, aggregated)
+        print('\t movie {:6d}: mean adopters {:8.2f} step by step, {:8.2f} aggregated, KS {:.3f}, p-value {:.3f}'.format(
+              row, step.mean(), aggregated.mean(), statistic, p_value))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--belief_type', default='empirical', type=str,
+                        choices = {'empirical', 'random', 'apriori'},
+                        help='''Ways to instantiate the belief per producer''')
+    parser.add_argument('--start_year', default=1990, type=int,
+                        help='''which year to start. Includes start year''')
+    parser.add_argument('--end_year', default=2000, type=int,
+                    help='''which year to end. Excludes end year''')
+
+    parser.add_argument('-p', type=float, default=0.1, help='the probability parameter')
+    parser.add_argument('-d', type=float, default=1.0,  help='the dose parameter')
+    parser.add_argument('-t', type=float, default=1.0, help='threshold parameter')
+    parser.add_argument('--interaction', type=int, default=20, help='number of interactions per movie')
+
+    parser.add_argument('-i', type=int, default=2000, help='number of replicates of each sampler')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random numbers')
+    parser.add_argument('--no_network', action='store_true', default=False,
+                        help='only run the single movie test, without the database')
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,105 @@
+"""
+Benchmark of the movie-producer edges of network_builder.build_temporal_network
+
+Summary:
+1. Read the movies of each period, 1990-2000 and the whole century by default
+2. Make the movie and producer attributes once, and add the nodes to a graph
+3. Time the edges of the nested scan (every movie against every producer) and of movie_producer_edges
+4. Check that both graphs have the same neighbors, in the same order
+*The nested scan is O(movies x producers x movies per producer), so it is skipped for
+ the periods with more than --nested_limit movies
+"""
+
+##########Packages##########
+#System
+import sys
+import os
+import time
+from argparse import ArgumentParser
+import networkx as nx
+#Local
+src_dir = os.path.abspath(os.path.join(os.pardir, os.pardir, 'src'))
+sys.path[0] = src_dir
+import network.network_builder as build
+import parser.support as support
+
+
+def add_nodes(movies, producers):
+    """
+    graph with the movie and producer nodes of build_temporal_network, without edges
+    """
+    G = nx.Graph()
+    for _id, key in enumerate(movies, 1):
+        G.add_node(_id, node_type=key.type, movie_id=key.node_ID)
+    for key in producers:
+        G.add_node(key.node_ID, node_type=key.type, movies=key.movie_ids)
+    return G
+
+def add_edges_nested(G):
+    """
+    the edges as build_temporal_network used to add them
+    """
+    for node1 in G.nodes():
+        if G.node[node1]['node_type'] =='M':
+            movie = G.node[node1]['movie_id']
+            for node2 in G.nodes():
+                if G.node[node2]['node_type'] == 'P':
+                    movies = G.node[node2]['movies']
+                    if movie in movies:
+                        G.add_edge(node1, node2)
+    return G
+
+def same_neighbors(G1, G2):
+    """
+    True if every node has the same neighbors in the same order
+    """
+    return all(list(G1.neighbors(n)) == list(G2.neighbors(n)) for n in G1.nodes())
+
+###Functions###
+def main(args):
+    role = 'producing'
+    role_key = role + "_gender_percentage"
+    movie_df = support.get_movies_df(role_key)
+    gender_df = support.get_staff_df('producers')[['_id', 'female_count', 'first_movie', 'last_movie', 'gender']]
+    seeds = build.generate_gender_seeds(gender_df)
+
+    for start_year, end_year in [(1990, 2000), (args.start_year, args.end_year)]:
+        movies_period = movie_df[(movie_df.year >= start_year) & (movie_df.year < end_year)].sort_values('year')
+        print('Period {}-{}'.format(start_year, end_year))
+        start = time.time()
+        movies, producers = build.make_attribute_list(movies_period, seeds, args.belief_type, args.t)
+        print('\t movies: {}, producers: {}, attributes: {:.2f} s'.format(len(movies), len(producers),
+                                                                          time.time() - start))
+
+        start = time.time()
+        G = add_nodes(movies, producers)
+        G.add_edges_from(build.movie_producer_edges(movies, producers))
+        linear = time.time() - start
+        print('\t movie_producer_edges: {:.3f} s, {} edges'.format(linear, G.number_of_edges()))
+
+        if len(movies) > args.nested_limit:
+            print('\t nested scan skipped, more than {} movies'.format(args.nested_limit))
+            continue
+        start = time.time()
+        G_nested = add_edges_nested(add_nodes(movies, producers))
+        nested = time.time() - start
+        print('\t nested scan: {:.3f} s, {:.1f}x slower, same neighbors: {}'.format(
+              nested, nested/max(linear, 1e-9), same_neighbors(G, G_nested)))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--belief_type', default='empirical', type=str,
+                        choices = {'empirical', 'random', 'apriori'},
+                        help='''Ways to instantiate the belief per producer''')
+    parser.add_argument('--start_year', default=1900, type=int,
+                        help='''start of the large period. Includes start year''')
+    parser.add_argument('--end_year', default=2000, type=int,
+                        help='''end of the large period. Excludes end year''')
+    parser.add_argument('-t', type=float, default=1.0, help='threshold parameter')
+    parser.add_argument('--nested_limit', type=int, default=20000,
+                        help='largest number of movies to run the nested scan on')
+
+    args = parser.parse_args()
+    main(args)
@@ -1,11 +1,10 @@
 """
 Object: Open movie schedule from database (bipartite temporal network)
-        1. make network using networkx
-        2. detect community using nested block model
+        1. make the network of the movies in year order and of every shuffle
+        2. save them in the binary network cache (network_builder.save_network_cache)
 
 Input: data base name, data/raw_dta/movies.json
-Output: 1. network
-        2. community
+Output: 1. network cache folder per shuffle in the result directory
 
 Created by Hyojun Ada Lee, June 12, 2018 
 """
@@ -25,7 +24,7 @@ sys.path[0] = src_dir
 from parser.support import ROLES, CREDITS
 from parser.my_mongo_db_login import DB_LOGIN_INFO
 import parser.support as support
-import network.shift_graph_maker as sgm
+import network.network_builder as build
 def main(args):
     '''
     Produces a shift graph.
@@ -40,6 +39,7 @@ def main(args):
 
     T = args.threshold
     belief_type = args.belief_type
+    seed = args.seed #master seed of the shuffles, the same as temporal_contagion.py
     with open(os.path.abspath(data_file)) as f:
         movie_file = f.read()
         movie_data = json.loads(movie_file)
@@ -48,17 +48,22 @@ def main(args):
     role_key = role + '_gender_percentage'
     all_movies = support.get_movies_df(role_key)
     print('Got_all movies')
+    gender_df = support.get_staff_df('producers')[['_id', 'female_count', 'first_movie', 'last_movie', 'gender']]
+    seeds = build.generate_gender_seeds(gender_df)
+    fingerprint = build.dataset_fingerprint(all_movies, seeds)
 
     #read movies during the period of interest
     movies_period = all_movies[(all_movies.year >= start_year) & (all_movies.year < end_year)]
     for i in range(shuffle):
+        #every shuffle starts from the movies of the period, as in temporal_contagion.py
         if i == 0:
-            movies_period = movies_period.sort_values('year')
+            movies_shuffle = movies_period.sort_values('year')
         if i != 0:
-            movies_period = movies_period.sample(frac=1).sort_values('year')
-        G = sgm.build_temporal_network(movies_period, belief_type, T, False)#, opt.belief_type, opt.belief_threshold, plot_graph = opt.visualize)
-        #Save the network
-        sgm.save_network(G,'real', i, result_dir)
+            movies_shuffle = movies_period.sample(frac=1, random_state=np.random.RandomState([seed, i])).sort_values('year')
+        #Save the network in the binary cache, the model scripts open it with --cache_dir
+        build.cached_temporal_incidence(result_dir, fingerprint, movies_shuffle, seeds, belief_type, T,
+                                        start_year, end_year, None if i == 0 else [seed, i])
+        print('\t network {} saved'.format(i))
 
 if __name__ == '__main__':
     parser = ArgumentParser()
@@ -83,6 +88,8 @@ if __name__ == '__main__':
     parser.add_argument('-p', type=float, default=0.1, help='the probability parameter')
     parser.add_argument('-d', type=float, default=0.5,  help='the dose parameter')
     parser.add_argument('--threshold', type=float, default=0.5, help='threshold parameter')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='master seed of the shuffles, use the --seed of temporal_contagion.py')
     
     args = parser.parse_args()
     main(args)
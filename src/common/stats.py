@@ -203,3 +203,126 @@ def custom_freq_rolling_mean(df, val_col, dt_col, num, freq):
     freq_count = val_grouped.count().rolling(num, min_periods=1).sum()
 
     return freq_sum/freq_count
+
+
+class StreamingSummary(object):
+    """
+    Running count, mean, variance and quantiles of a set of series of integer
+    counts (e.g. number of adopters) that arrive one replicate at a time,
+    so the replicates never have to be held in memory together.
+    The mean and variance are updated with Welford's algorithm and the quantiles
+    come from an exact histogram of every row, e.g. one row per movie_order:
+    the number of replicates with each value, kept as sorted (row, value) keys.
+    The histogram only holds the values that were seen, and the quantiles are
+    the same as pandas (linear interpolation) for any number of replicates.
+
+    n_rows - length of every replicate
+    quantiles - quantiles the summary is read at, quantile takes any q between 0 and 1
+    divisor - the statistics are of the counts divided by divisor, e.g. the number of producers
+    """
+    #a row is the high half of a key, the value the low half
+    _value_bits = 32
+
+    def __init__(self, n_rows, quantiles=(0.025, 0.5, 0.975), divisor=1):
+        self.n_rows = n_rows
+        self.quantiles = tuple(float(q) for q in quantiles)
+        if any(q < 0 or q > 1 for q in self.quantiles):
+            raise ValueError('quantiles must be between 0 and 1')
+        self.divisor = float(divisor)
+        self.count = 0
+        self._mean = np.zeros(n_rows)
+        self._m2 = np.zeros(n_rows)
+        self._row_keys = np.arange(n_rows, dtype=np.int64) << self._value_bits
+        #sorted (row, value) keys of the histogram and their number of replicates
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._counts = np.zeros(0, dtype=np.int64)
+        #keys of the replicates that are not merged into the histogram yet
+        self._pending = []
+
+    def add(self, values):
+        """
+        Add one replicate, an array with one count per row.
+        """
+        x = np.asarray(values, dtype=float).ravel()
+        if x.shape[0] != self.n_rows:
+            raise ValueError('replicate has {} rows, expected {}'.format(x.shape[0], self.n_rows))
+        counts = x.astype(np.int64)
+        if not (np.array_equal(counts, x) and (counts >= 0).all() and (counts < 2**self._value_bits).all()):
+            raise ValueError('replicate values must be non negative integer counts')
+        self.count += 1
+        delta = x - self._mean
+        self._mean += delta/self.count
+        self._m2 += delta*(x - self._mean)
+        self._pending.append(self._row_keys + counts)
+        #merge every few replicates, so the pending keys stay a small multiple of the rows
+        if len(self._pending) >= 64:
+            self._merge()
+
+    def update(self, values):
+        """
+        Add several replicates, a 2d array with one column per replicate.
+        """
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            values = values[:, None]
+        for j in range(values.shape[1]):
+            self.add(values[:, j])
+
+    def _merge(self):
+        if not self._pending:
+            return
+        keys = np.concatenate([self._keys] + self._pending)
+        counts = np.concatenate([self._counts, np.ones(len(keys) - len(self._keys), dtype=np.int64)])
+        self._keys, inverse = np.unique(keys, return_inverse=True)
+        self._counts = np.bincount(inverse.ravel(), weights=counts, minlength=len(self._keys)).astype(np.int64)
+        self._pending = []
+
+    def _order_statistic(self, k):
+        """
+        k-th smallest value (from 0) of every row
+        """
+        #every row holds count values, so the k-th value of row r is the (r*count + k)-th key
+        cumulative = np.cumsum(self._counts)
+        position = np.searchsorted(cumulative, np.arange(self.n_rows)*self.count + k, side='right')
+        return self._keys[position] - self._row_keys
+
+    @property
+    def mean(self):
+        return self._mean/self.divisor
+
+    @property
+    def variance(self):
+        """
+        Sample variance (ddof=1) per row, nan with less than two replicates.
+        """
+        if self.count < 2:
+            return np.full(self.n_rows, np.nan)
+        return self._m2/(self.count - 1)/self.divisor**2
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def histogram(self, row):
+        """
+        values of the row and the number of replicates with each value, of the counts before the divisor
+        """
+        self._merge()
+        start, end = np.searchsorted(self._keys, self._row_keys[row] + np.array([0, 2**self._value_bits]))
+        return self._keys[start:end] - self._row_keys[row], self._counts[start:end].copy()
+
+    def quantile(self, q):
+        """
+        Exact quantile q per row, with linear interpolation as pandas
+        """
+        if q < 0 or q > 1:
+            raise ValueError('quantiles must be between 0 and 1')
+        if self.count == 0:
+            return np.full(self.n_rows, np.nan)
+        self._merge()
+        h = (self.count - 1)*q
+        low = int(np.floor(h))
+        high = min(low + 1, self.count - 1)
+        low_value = self._order_statistic(low).astype(float)
+        value = low_value + (h - low)*(self._order_statistic(high) - low_value)
+        return value/self.divisor
@@ -25,24 +25,40 @@ Made by Hyojun Ada Lee October 13, 2016
 import sys
 import os
 from operator import itemgetter
-from itertools import combinations
+from bisect import bisect_right
+import weakref
+from itertools import combinations, groupby
 from math import ceil
 import random
 from copy import deepcopy
+from multiprocessing import Pool
 import numpy as np
 import networkx as nx
 import pandas as pd
+import scipy.sparse as sparse
+from scipy import stats
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    #without numba the kernels run as plain python
+    HAS_NUMBA = False
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
 #from dateutil import parse
 
 #Local
 src_dir = os.path.abspath(os.path.join(os.pardir, os.pardir, 'src'))
 sys.path[0] = src_dir
 import model.general as gen
-import network.shift_graph_maker as sgm
+import network.network_builder as build
+import parser.saver as save
 
 #############Functions#########################3
 
-def calculate_belief(agent_i, agent_j, probability, dose, threshold, weight=1):
+def calculate_belief(agent_i, agent_j, probability, dose, threshold, weight=1, rng=random):
     '''
     Calculate the change in belief values for the two agents
     Input:
@@ -51,6 +67,23 @@ def calculate_belief(agent_i, agent_j, probability, dose, threshold, weight=1):
         probability - probability of being infected
         dose - infection size
         threshold - belief threshold
+        rng - random number generator, random module or random.Random instance
+    Output:
+        belief_i: New belief value of agent i
+        belief_j: New belief value of agent j
+    '''
+    return calculate_belief_values(agent_i['belief'], agent_j['belief'], probability, dose, threshold, weight, rng)
+
+def calculate_belief_values(belief_i, belief_j, probability, dose, threshold, weight=1, rng=random):
+    '''
+    Same as calculate_belief, but on the belief values instead of the node dictionaries
+    Input:
+        belief_i: belief of the first agent
+        belief_j: belief of the second agent
+        probability - probability of being infected
+        dose - infection size
+        threshold - belief threshold
+        rng - random number generator, random module or random.Random instance
     Output:
         belief_i: New belief value of agent i
         belief_j: New belief value of agent j
@@ -58,10 +91,8 @@ def calculate_belief(agent_i, agent_j, probability, dose, threshold, weight=1):
     w = weight
     #Update in beliefs
     #both non adopters
-    belief_i = agent_i['belief']
-    belief_j = agent_j['belief']
-    prob_inf = random.random() #probability of getting infected
-    # prob_imm = random.random() #probability of
+    prob_inf = rng.random() #probability of getting infected
+    # prob_imm = rng.random() #probability of
     #i adopter, j non adopter
     if belief_i >= threshold and belief_j < threshold:
         #gets infected with probability 
@@ -78,17 +109,64 @@ def calculate_belief(agent_i, agent_j, probability, dose, threshold, weight=1):
     
     return belief_i, belief_j
     
-def contagion_belief_propagation_temporal_network(G, prob, dose, threshold, interaction=20):
+def rounds_convert(dose, threshold):
+    '''
+    True if every successful interaction turns the non adopter into an adopter, whatever its belief:
+    a belief in [0, 1] plus the dose, limited to [0, 1], always reaches the threshold.
+    Then the interactions of a movie only matter through their number of successes, and the new
+    adopters of the movie are min(Binomial(interaction, prob), non adopters) non adopters drawn
+    at random, which the engines sample directly instead of playing the interactions one by one
+    '''
+    return threshold <= min(dose, 1.0)
+
+def sample_binomial(n, p, rng=random):
+    '''
+    Binomial(n, p) from one uniform number of a random module rng, by inversion
+    '''
+    if p >= 1:
+        return n
+    if p <= 0:
+        return 0
+    u = rng.random()
+    pmf = (1 - p)**n
+    cdf = pmf
+    k = 0
+    while u > cdf and k < n:
+        pmf *= (n - k)/(k + 1)*p/(1 - p)
+        k += 1
+        cdf += pmf
+    return k
+
+def contagion_belief_propagation_temporal_network(G, prob, dose, threshold, interaction=20, return_events=False, rng=random):
     """
-    Runs the dynamics for the persusaion model on the shift network
+    Runs the dynamics for the persusaion model on the shift network.
+    The run stops once no adopter is left in the coming movies (or everyone adopted),
+    and the remaining movies keep the final number of adopters.
     Input:
         G - The shift network
         prob - Probability of being infected
         dose - Size of the dose
         threshold - belief threshold
+        return_events - also return the adoption events [node, movie_order, status]
+        rng - random number generator, random module or random.Random instance
     Output:
         adopter_history - list of paired datapoints (day, number adopters)
     """
+    events = [] if return_events else None
+    adopter_history = np.array(list(iter_contagion_temporal_network(G, prob, dose, threshold, interaction,
+                                                                    events=events, rng=rng)))
+    if return_events:
+        return adopter_history, events
+    return adopter_history
+
+def iter_contagion_temporal_network(G, prob, dose, threshold, interaction=20, events=None, rng=random):
+    """
+    Generator version of contagion_belief_propagation_temporal_network, yields the
+    [movie_order, year, number of adopters] record of each movie as soon as it is played,
+    so long runs can be streamed to a sink without keeping the history
+    Input:
+        events - list that receives the adoption events [node, movie_order, status] as they happen
+    """
     #Find the first shift date (project start date)
     start_year = sorted([G.node[n]['year'] for n in G.nodes() \
                                 if G.node[n]['node_type']=='M'])[0]
@@ -103,52 +181,1096 @@ def contagion_belief_propagation_temporal_network(G, prob, dose, threshold, inte
     #Get the producer node ids
     producer_node_ids = [n for n in G.nodes() if G.node[n]['node_type']=='P']
 
-    #Doctor Adopters, node ids
-    adopters = [n for n in producer_node_ids if G.node[n]['status'] == 'Adopter']
+    #Doctor Adopters, tracked instead of recounted
+    tracker = gen.AdoptionTracker.from_graph(G, producer_node_ids, threshold, record_events=events is not None)
+    if events is not None:
+        tracker.events = events
+    #position of the last movie of every producer, to see when no adopter is left in the coming movies,
+    #and the positions of all the movies of every producer, to jump to the movies with an adopter
+    last_movie = {}
+    producer_movies = {x: [] for x in producer_node_ids}
+    for k, (movie_order, movie_id) in enumerate(movie_nodes):
+        for x in G.neighbors(movie_order):
+            last_movie[x] = k
+            producer_movies[x].append(k)
+    tracker.track_horizon(last_movie)
+    tracker.track_frontier(producer_movies)
+    frozen = prob <= 0 or dose == 0 #no belief can change
 
-    #Adopter dictionary and their time points: {time:#of adopters}
-    adopter_history = [[0, start_year, len(adopters)]]
+    #Adopter time points: [movie, year, #of adopters]
+    yield [0, start_year, tracker.n_adopters]
     #print 'START---->'
-    #Iterate through the movies
-    #Get the list of moives in order
-    for movie_order, movie_id in movie_nodes:
+    #Iterate through the movies with an adopter in them, in order
+    k = 0 #first movie without a record
+    while k < len(movie_nodes):
+        #next movie with an adopter, the movies before it cannot change anything
+        play = None if frozen else tracker.frontier.pop()
+        if play is None or tracker.is_absorbed(play):
+            play = len(movie_nodes)
+        for m, _ in movie_nodes[k:play]:
+            yield [m, G.node[m]['year'], tracker.n_adopters]
+        if play == len(movie_nodes):
+            break
+        movie_order = movie_nodes[play][0]
         year = G.node[movie_order]['year']
-        #Identify the movie node
-        movie_node = G.node[movie_order]
         #Iterate through producer
         #If any of the producer in the group is an adopter, she will influce everyone
-        movie_producer_ids = list(G.neighbors(movie_order))
-        movie_adopters = [x for x in movie_producer_ids if G.node[x]['status'] == 'Adopter']
-        movie_nonadopters = [x for x in movie_producer_ids if G.node[x]['status'] == 'NonAdopter']
+        movie = tracker.partition(G.neighbors(movie_order))
         i = 0
-        if any(movie_adopters): #if any of the producers in the movie is an adopter:
-            while i < interaction and movie_nonadopters:
-                adopter = random.choice(movie_adopters) #choose random adopters from the movie producers
-                nonadopter = random.choice(movie_nonadopters) #choose random non adopter from ovie producers
-                b_a, b_na = calculate_belief(G.node[adopter], G.node[nonadopter], prob, dose, threshold)
+        if movie.adopters: #if any of the producers in the movie is an adopter:
+            while i < interaction and movie.nonadopters:
+                adopter = rng.choice(movie.adopters) #choose random adopters from the movie producers
+                nonadopter = rng.choice(movie.nonadopters) #choose random non adopter from ovie producers
+                b_a, b_na = calculate_belief(G.node[adopter], G.node[nonadopter], prob, dose, threshold, rng=rng)
                 G.node[adopter]['belief'] = b_a
                 G.node[nonadopter]['belief'] = b_na
-                #update producer status
-                G = gen.update_adoption_status(G, producer_node_ids, threshold)
-                #update movie adopter and movie non adopter
-                movie_adopters = [x for x in movie_producer_ids if G.node[x]['status'] == 'Adopter']
-                movie_nonadopters = [x for x in movie_producer_ids if G.node[x]['status'] == 'NonAdopter']
+                #update status of the two producers, and the movie adopters and non adopters
+                for x, b in ((adopter, b_a), (nonadopter, b_na)):
+                    if movie.update(x, b, movie_order):
+                        G.node[x]['status'] = 'Adopter' if tracker.is_adopter(x) else 'NonAdopter'
                 i += 1
-        #Calculate the number of adopters
-        adopters = [n for n in producer_node_ids if (G.node[n]['status'] == 'Adopter')]# and (G.node[n]['doc_type'] == 'A')]
         #Calculate the order of the movie 1
         movie_count = movie_order
-        # print(shift_node['start_date'], day_count, len(adopters))
-        adopter_history.append([movie_count, year, len(adopters)])
-    #get the end date
-    final_year = year
+        yield [movie_count, year, tracker.n_adopters]
+        k = play + 1
     #Backfill the missing days
     # adopter_history = np.array(gen.backfill_dates(adopter_history, end_date = final_year))
 
-    return np.array(adopter_history)
 
+class ContagionTopology(object):
+    """
+    Immutable snapshot of the temporal movie-producer network, built once and shared by every run.
+    Holds the movie order and years, the movie -> producer incidence as CSR index arrays,
+    the producer ids and the initial beliefs. The beliefs of a run live in a ContagionState.
+    """
+    def __init__(self, movie_order, year, indptr, indices, producer_ids, belief, status):
+        '''
+        Input:
+            movie_order - movie node ids in the order they are played
+            year - year of each movie
+            indptr, indices - CSR arrays, the producers of the k-th movie are indices[indptr[k]:indptr[k+1]]
+            producer_ids - producer node ids, list position is the producer index
+            belief - initial belief of each producer
+            status - initial status of each producer, True for the adopters
+        '''
+        self.movie_order = self._freeze(movie_order, int)
+        self.year = self._freeze(year, int)
+        self.indptr = self._freeze(indptr, int)
+        self.indices = self._freeze(indices, int)
+        self.producer_ids = tuple(producer_ids)
+        self.belief = self._freeze(belief, float)
+        self.status = self._freeze(status, bool)
+        self.seeds = tuple(self.producer_ids[x] for x in np.nonzero(self.status)[0])
+        self.start_year = int(self.year.min()) if len(self.year) else 0
+        #position of the last movie of every producer, -1 without movies
+        last_movie = np.full(len(self.producer_ids), -1, dtype=int)
+        np.maximum.at(last_movie, self.indices, np.repeat(np.arange(len(self.movie_order)), np.diff(self.indptr)))
+        self.last_movie = self._freeze(last_movie, int)
+        #positions of the movies of every producer in play order, the producer -> movie incidence
+        movie_position = np.repeat(np.arange(len(self.movie_order)), np.diff(self.indptr))
+        by_producer = movie_position[np.argsort(self.indices, kind='mergesort')]
+        bounds = np.cumsum(np.bincount(self.indices, minlength=len(self.producer_ids)))
+        self.producer_movies = tuple(by_producer[start:end].tolist()
+                                     for start, end in zip(np.append(0, bounds[:-1]), bounds))
+
+    @staticmethod
+    def _freeze(values, dtype):
+        '''
+        read only array of values. An array of the same kind of dtype (i.e. the int32 indices of a csr matrix)
+        is kept as a view instead of copied, so the memory mapped columns of the network cache stay mapped
+        '''
+        array = np.asarray(values)
+        if array.dtype.kind != np.dtype(dtype).kind:
+            array = array.astype(dtype)
+        else:
+            array = array.view()
+        array.flags.writeable = False
+        return array
+
+    @classmethod
+    def from_graph(cls, G):
+        """
+        Compiles the movie network from network_builder.build_temporal_network
+        """
+        #Same ordering as contagion_belief_propagation_temporal_network
+        movie_nodes = [[n, G.node[n]['movie_id']] for n in G.nodes() if G.node[n]['node_type']=='M']
+        movie_nodes.sort(key=itemgetter(0, 1))
+        producer_ids = [n for n in G.nodes() if G.node[n]['node_type']=='P']
+        producer_index = {n:k for k, n in enumerate(producer_ids)}
+
+        indptr = [0]
+        indices = []
+        for movie_order, movie_id in movie_nodes:
+            #keep the neighbor order, so the random choices are the same as the networkx engine
+            indices.extend(producer_index[x] for x in G.neighbors(movie_order))
+            indptr.append(len(indices))
+
+        return cls([n for n, _ in movie_nodes], [G.node[n]['year'] for n, _ in movie_nodes], indptr, indices,
+                   producer_ids, [G.node[n]['belief'] for n in producer_ids],
+                   [G.node[n]['status'] == 'Adopter' for n in producer_ids])
+
+    @classmethod
+    def from_incidence(cls, incidence):
+        """
+        Compiles the network_builder.BipartiteIncidence of the movie network, the movie rows are
+        already in play order and the producers of every row in neighbor order
+        """
+        B = incidence.movie_producers
+        return cls(np.arange(1, incidence.n_movies + 1), incidence.year, B.indptr, B.indices,
+                   incidence.producer_ids.tolist(), incidence.belief, incidence.status)
+
+    @property
+    def n_movies(self):
+        return len(self.movie_order)
+
+    @property
+    def n_producers(self):
+        return len(self.producer_ids)
+
+    def new_state(self, replicates=None):
+        """
+        Mutable beliefs and status at their initial values.
+        One row per replicate if replicates is given
+        """
+        return ContagionState(self, replicates)
+
+    def reset_graph(self, G):
+        """
+        Put the initial beliefs and status back on the producer nodes of G, so the networkx
+        engine can run again on the same graph without rebuilding it. O(P)
+        """
+        for n, belief, status in zip(self.producer_ids, self.belief.tolist(), self.status.tolist()):
+            G.node[n]['belief'] = belief
+            G.node[n]['status'] = 'Adopter' if status else 'NonAdopter'
+        return G
+
+
+class ContagionState(object):
+    """
+    Beliefs and adoption status of one run (or of a batch of replicates) on a ContagionTopology
+    """
+    def __init__(self, topology, replicates=None):
+        self.topology = topology
+        self.replicates = replicates
+        if replicates is None:
+            self.belief = topology.belief.copy()
+            self.status = topology.status.copy()
+        else:
+            self.belief = np.tile(topology.belief, (replicates, 1))
+            self.status = np.tile(topology.status, (replicates, 1))
+
+    def reset(self):
+        """
+        Back to the initial beliefs and status in O(P), without new allocations
+        """
+        self.belief[...] = self.topology.belief
+        self.status[...] = self.topology.status
+        return self
+
+def compile_temporal_network(G):
+    """
+    Compiles the movie-producer network into index arrays, so the dynamics do not
+    have to walk the networkx dictionaries
+    Input:
+        G - The movie network from network_builder.build_temporal_network,
+            or its BipartiteIncidence from network_builder.build_temporal_incidence
+    Output:
+        topology - ContagionTopology of G
+    """
+    if hasattr(G, 'movie_producers'):
+        return ContagionTopology.from_incidence(G)
+    return ContagionTopology.from_graph(G)
+
+def contagion_belief_propagation_temporal_array(G, prob, dose, threshold, interaction=20, topology=None, state=None,
+                                                 return_events=False, aggregate=True, rng=random):
+    """
+    Array version of contagion_belief_propagation_temporal_network.
+    Beliefs are kept in a float array and the adoption status in a boolean mask,
+    and only the two agents of an interaction are updated instead of the whole network.
+    Stops like the networkx engine once nothing can change.
+    Input:
+        G - The movie network, ignored if topology is given
+        prob - Probability of being infected
+        dose - Size of the dose
+        threshold - belief threshold
+        topology - ContagionTopology of G, to avoid compiling G again
+        state - ContagionState to reuse, it is reset before the run
+        return_events - also return the adoption events [producer_id, movie_order, status]
+        aggregate - sample the new adopters of a movie at once when rounds_convert(dose, threshold),
+                    instead of playing the interactions one by one. Same distribution, other random numbers
+        rng - random number generator, random module or random.Random instance
+    Output:
+        adopter_history - array of [movie_order, year, number of adopters]
+    """
+    if topology is None:
+        topology = compile_temporal_network(G)
+    events = [] if return_events else None
+    adopter_history = np.empty([topology.n_movies + 1, 3], dtype=int)
+    records = iter_contagion_temporal_array(None, prob, dose, threshold, interaction, topology, state, events,
+                                            aggregate, rng)
+    for k, record in enumerate(records):
+        adopter_history[k] = record
+    if return_events:
+        return adopter_history, events
+    return adopter_history
+
+def iter_contagion_temporal_array(G, prob, dose, threshold, interaction=20, topology=None, state=None, events=None,
+                                  aggregate=True, rng=random):
+    """
+    Generator version of contagion_belief_propagation_temporal_array, yields the
+    [movie_order, year, number of adopters] record of each movie as soon as it is played
+    Input:
+        events - list that receives the adoption events [producer_id, movie_order, status] at the end of the run
+    """
+    if topology is None:
+        topology = compile_temporal_network(G)
+    state = topology.new_state() if state is None else state.reset()
+    movie_order = topology.movie_order.tolist()
+    years = topology.year.tolist()
+    indptr = topology.indptr
+    indices = topology.indices.tolist()
+    belief = state.belief
+    status = state.status
+    tracker = gen.AdoptionTracker(dict(enumerate(status.tolist())), threshold, record_events=events is not None)
+    tracker.track_horizon(dict(enumerate(topology.last_movie.tolist())))
+    tracker.track_frontier(topology.producer_movies)
+    frozen = prob <= 0 or dose == 0 #no belief can change
+    aggregate = aggregate and rounds_convert(dose, threshold)
+
+    yield [0, topology.start_year, tracker.n_adopters]
+    k = 0 #first movie without a record
+    while k < len(movie_order):
+        #next movie with an adopter, the movies before it keep the count
+        play = None if frozen else tracker.frontier.pop()
+        if play is None or tracker.is_absorbed(play):
+            play = len(movie_order)
+        for m, year in zip(movie_order[k:play], years[k:play]):
+            yield [m, year, tracker.n_adopters]
+        if play == len(movie_order):
+            break
+        movie = tracker.partition(indices[indptr[play]:indptr[play+1]])
+        if movie.adopters and aggregate:
+            #every success converts a non adopter, so only the number of successes is drawn
+            n_new = min(sample_binomial(interaction, prob, rng), len(movie.nonadopters))
+            for x in rng.sample(movie.nonadopters, n_new):
+                belief[x] = gen.limit_belief(belief[x] + dose)
+                movie.update(x, belief[x], movie_order[play])
+                status[x] = True
+        elif movie.adopters: #if any of the producers in the movie is an adopter:
+            i = 0
+            while i < interaction and movie.nonadopters:
+                adopter = rng.choice(movie.adopters)
+                nonadopter = rng.choice(movie.nonadopters)
+                b_a, b_na = calculate_belief_values(belief[adopter], belief[nonadopter], prob, dose, threshold, rng=rng)
+                belief[adopter] = b_a
+                belief[nonadopter] = b_na
+                #update the status of the two agents only
+                for x, b in ((adopter, b_a), (nonadopter, b_na)):
+                    if movie.update(x, b, movie_order[play]):
+                        status[x] = tracker.is_adopter(x)
+                i += 1
+        yield [movie_order[play], years[play], tracker.n_adopters]
+        k = play + 1
+    if events is not None:
+        producer_ids = topology.producer_ids
+        events.extend([producer_ids[x], t, st] for x, t, st in tracker.event_log())
+
+
+def contagion_belief_propagation_temporal_batch(G, prob, dose, threshold, replicates, interaction=20, topology=None,
+                                                 state=None, aggregate=True, rng=np.random):
+    """
+    Runs many independent replicates of contagion_belief_propagation_temporal_network at once.
+    The beliefs are a (replicates x producers) matrix and every interaction draws the
+    random numbers for all replicates together, one movie at a time.
+    Only the non adopter of an interaction changes belief, so the adopter is not drawn.
+    Stops once no replicate can change anymore.
+    Input:
+        G - The movie network, ignored if topology is given
+        prob - Probability of being infected
+        dose - Size of the dose
+        threshold - belief threshold
+        replicates - number of replicates
+        topology - ContagionTopology of G, to avoid compiling G again
+        state - ContagionState with one row per replicate to reuse, it is reset before the run
+        aggregate - sample the new adopters of a movie at once when rounds_convert(dose, threshold)
+        rng - numpy random number generator, np.random or a np.random.RandomState
+    Output:
+        df_adopter - DataFrame indexed by movie_order, with the year and one column
+                     of number of adopters per replicate ('0', '1', ...)
+    """
+    return contagion_temporal_kernel(G, ThresholdKernel(prob, dose, threshold, aggregate), replicates, interaction,
+                                     topology, state, rng)
+
+def iter_contagion_temporal_batch(G, prob, dose, threshold, replicates, interaction=20, topology=None, state=None,
+                                  aggregate=True, rng=np.random):
+    """
+    Generator version of contagion_belief_propagation_temporal_batch, yields
+    (movie_order, year, array of number of adopters per replicate) for each movie as soon as it is played
+    """
+    if topology is None:
+        topology = compile_temporal_network(G)
+    return iter_contagion_temporal_kernel(topology, ThresholdKernel(prob, dose, threshold, aggregate), replicates,
+                                          interaction, state, rng)
+
+def _pick_columns(mask, rng=np.random):
+    """
+    Choose one random True column per row of mask, uniformly. Rows without a True column get column 0
+    """
+    pick = np.floor(rng.random_sample(mask.shape[0]) * mask.sum(axis=1))
+    return np.argmax(np.cumsum(mask, axis=1) > pick[:, None], axis=1)
+
+
+class ContagionKernel(object):
+    """
+    Dynamics of one movie for a batch of replicates, so the same compiled topology, state and
+    engines (iter_contagion_temporal_kernel, the replicate pool and the sweeps) run any dynamics.
+    A kernel keeps its per producer value in state.belief and the producers that can spread in state.status,
+    both (replicates x producers). Only producers with status can change others, so a run stops
+    once none of them is left in the coming movies.
+    Subclasses set:
+        name - name in KERNELS
+        absorbing - True if the counted producers never leave the count,
+                    so a replicate where everyone is counted is done
+    and implement prepare, count and play.
+    """
+    name = None
+    absorbing = True
+
+    @property
+    def frozen(self):
+        """
+        True if the parameters do not let anything change
+        """
+        return False
+
+    def prepare(self, state):
+        """
+        Set the kernel values of a state that was just reset to the topology beliefs and status
+        """
+        return state
+
+    def count(self, state):
+        """
+        Number of counted producers (the adopters) per replicate
+        """
+        return state.status.sum(axis=1)
+
+    def play(self, state, producers, interaction, rng=np.random):
+        """
+        Play one movie of the given producers, updating state in place
+        Input:
+            producers - producer indices of the movie
+            interaction - number of interactions per movie
+            rng - numpy random number generator
+        Output:
+            delta - change of count per replicate, None if no replicate changed
+        """
+        raise NotImplementedError
+
+
+class ThresholdKernel(ContagionKernel):
+    """
+    The belief model of calculate_belief: in every interaction a random non adopter of the movie
+    gets the dose with probability prob if the movie has an adopter, and adopts once its belief
+    reaches the threshold.
+    With aggregate, when rounds_convert(dose, threshold) the new adopters of a movie are sampled
+    at once instead of playing the interactions one by one
+    """
+    name = 'threshold'
+
+    def __init__(self, prob, dose, threshold, aggregate=True):
+        self.prob = prob
+        self.dose = dose
+        self.threshold = threshold
+        self.aggregate = aggregate and rounds_convert(dose, threshold)
+
+    @property
+    def frozen(self):
+        return self.prob <= 0 or self.dose == 0
+
+    def play(self, state, producers, interaction, rng=np.random):
+        belief = state.belief
+        replicates = belief.shape[0]
+        movie_belief = belief[:, producers]
+        movie_adopters = movie_belief >= self.threshold
+        #replicates where the movie has both adopters and non adopters
+        live = movie_adopters.any(axis=1) & ~movie_adopters.all(axis=1)
+        if not live.any():
+            return None
+        start_adopters = movie_adopters.sum(axis=1)
+        if self.aggregate:
+            #number of successes, each converts a different non adopter drawn at random
+            n_new = np.minimum(rng.binomial(interaction, min(self.prob, 1.0), replicates),
+                               movie_adopters.shape[1] - start_adopters)
+            n_new[~live] = 0
+            #the non adopters in a random order, the first n_new of them adopt
+            order = np.where(movie_adopters, 2.0, rng.random_sample(movie_adopters.shape))
+            rank = order.argsort(axis=1).argsort(axis=1)
+            convert = rank < n_new[:, None]
+            movie_belief[convert] = np.clip(movie_belief[convert] + self.dose, 0.0, 1.0)
+            movie_adopters |= convert
+        else:
+            i = 0
+            while i < interaction and live.any():
+                #choose a random non adopter of the movie, per replicate
+                column = _pick_columns(~movie_adopters, rng)
+                infected = live & (rng.random_sample(replicates) <= self.prob)
+                rows = np.nonzero(infected)[0]
+                cols = column[rows]
+                movie_belief[rows, cols] = np.clip(movie_belief[rows, cols] + self.dose, 0.0, 1.0)
+                movie_adopters[rows, cols] = movie_belief[rows, cols] >= self.threshold
+                live &= ~movie_adopters.all(axis=1)
+                i += 1
+        belief[:, producers] = movie_belief
+        state.status[:, producers] = movie_adopters
+        return movie_adopters.sum(axis=1) - start_adopters
+
+
+class SIRKernel(ContagionKernel):
+    """
+    SIR on the movies. state.belief holds the compartment, 0 susceptible, 1 infected, 2 recovered,
+    and the initial adopters start infected.
+    In every interaction a random susceptible producer of a movie with an infected producer is
+    infected with probability prob. At the end of the movie every producer that was infected when
+    the movie started recovers with probability recovery, so the infection lasts a number of movies
+    of the producer instead of a number of calendar steps.
+    The count is the number of producers ever infected (infected and recovered)
+    """
+    name = 'sir'
+    #producer compartment after recovering
+    recovered = 2
+
+    def __init__(self, prob, recovery):
+        self.prob = prob
+        self.recovery = recovery
+
+    @property
+    def frozen(self):
+        return self.prob <= 0
+
+    def prepare(self, state):
+        state.belief[...] = state.status
+        return state
+
+    def count(self, state):
+        return (state.belief > 0).sum(axis=1)
+
+    def play(self, state, producers, interaction, rng=np.random):
+        movie = state.belief[:, producers]
+        infected = movie == 1
+        if not infected.any():
+            return None
+        replicates = movie.shape[0]
+        start_infected = infected.copy()
+        susceptible = movie == 0
+        delta = np.zeros(replicates, dtype=int)
+        live = infected.any(axis=1) & susceptible.any(axis=1)
+        i = 0
+        while i < interaction and live.any():
+            column = _pick_columns(susceptible, rng)
+            rows = np.nonzero(live & (rng.random_sample(replicates) <= self.prob))[0]
+            cols = column[rows]
+            movie[rows, cols] = 1
+            infected[rows, cols] = True
+            susceptible[rows, cols] = False
+            delta[rows] += 1
+            live &= susceptible.any(axis=1)
+            i += 1
+        if self.recovery > 0:
+            recover = start_infected & (rng.random_sample(movie.shape) < self.recovery)
+            movie[recover] = self.recovered
+            infected &= ~recover
+            delta -= self._recovery_delta(recover)
+        state.belief[:, producers] = movie
+        state.status[:, producers] = infected
+        return delta
+
+    def _recovery_delta(self, recover):
+        #recovered producers stay in the count of ever infected
+        return 0
+
+
+class SISKernel(SIRKernel):
+    """
+    SIS on the movies, the same as SIRKernel but recovered producers are susceptible again.
+    The count is the number of producers infected at the time, so it can go down
+    """
+    name = 'sis'
+    absorbing = False
+    recovered = 0
+
+    @property
+    def frozen(self):
+        return self.prob <= 0 and self.recovery <= 0
+
+    def count(self, state):
+        return state.status.sum(axis=1)
+
+    def _recovery_delta(self, recover):
+        return recover.sum(axis=1)
+
+
+class ExposureKernel(ContagionKernel):
+    """
+    k-exposure complex contagion. state.belief holds the number of exposures of every producer.
+    In every movie each adopter exposes each non adopter of the movie with probability prob,
+    and a non adopter adopts once it has k exposures.
+    Exposures are counted per movie and adopter, the same adopter in two movies exposes twice.
+    All the exposures of a movie happen at once, so interaction is not used
+    """
+    name = 'exposure'
+
+    def __init__(self, prob, k):
+        self.prob = prob
+        self.k = k
+
+    @property
+    def frozen(self):
+        return self.prob <= 0
 
-def contagion_sequential_projected_network(G, step, interval, prob, dose, threshold, iterations=20):
+    def prepare(self, state):
+        state.belief[...] = np.where(state.status, self.k, 0)
+        return state
+
+    def play(self, state, producers, interaction, rng=np.random):
+        adopters = state.status[:, producers]
+        n_adopters = adopters.sum(axis=1)
+        live = (n_adopters > 0) & (n_adopters < len(producers))
+        if not live.any():
+            return None
+        exposures = state.belief[:, producers]
+        #number of the adopters of the movie that expose each non adopter
+        hits = rng.binomial(np.broadcast_to(n_adopters[:, None], exposures.shape), self.prob)
+        exposures += np.where(adopters | ~live[:, None], 0, hits)
+        new_adopters = ~adopters & (exposures >= self.k)
+        state.belief[:, producers] = exposures
+        state.status[:, producers] = adopters | new_adopters
+        return new_adopters.sum(axis=1)
+
+#kernels by name, the parameters of make_kernel are mapped to each kernel in its entry
+KERNELS = {'threshold': (ThresholdKernel, lambda prob, dose, threshold, recovery, exposures: (prob, dose, threshold)),
+           'sir': (SIRKernel, lambda prob, dose, threshold, recovery, exposures: (prob, recovery)),
+           'sis': (SISKernel, lambda prob, dose, threshold, recovery, exposures: (prob, recovery)),
+           'exposure': (ExposureKernel, lambda prob, dose, threshold, recovery, exposures: (prob, exposures))}
+
+def make_kernel(dynamics, prob, dose, threshold, recovery=None, exposures=None):
+    """
+    Kernel of the given dynamics from the (prob, dose, threshold) parameters of the scripts
+    Input:
+        dynamics - 'threshold', 'sir', 'sis' or 'exposure'
+        prob - probability of infection per interaction (per adopter for 'exposure')
+        dose - dose for 'threshold'
+        threshold - belief threshold for 'threshold'
+        recovery - probability of recovery per movie, needed by 'sir' and 'sis'
+        exposures - integer number of exposures k, needed by 'exposure'
+    Output:
+        kernel - ContagionKernel
+    *the threshold is also the one the initial status of the topology is built with, so it is not k
+    """
+    if dynamics not in KERNELS:
+        raise ValueError("`dynamics` must be one of: {}".format(", ".join(KERNELS)))
+    if dynamics in ('sir', 'sis') and recovery is None:
+        raise ValueError("the '{}' dynamics need the probability of recovery".format(dynamics))
+    if dynamics == 'exposure' and (exposures is None or int(exposures) != exposures or exposures < 1):
+        raise ValueError("the 'exposure' dynamics need a whole number of exposures of at least 1, not {}".format(exposures))
+    kernel_class, kernel_parameters = KERNELS[dynamics]
+    return kernel_class(*kernel_parameters(prob, dose, threshold, recovery, None if exposures is None else int(exposures)))
+
+def _splitmix64(x):
+    """
+    splitmix64 finalizer of an array of uint64, wraps around like the C version
+    """
+    z = x + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+class CounterRandom(object):
+    """
+    Counter based random numbers for common random numbers across parameter values.
+    The uniforms are a hash (splitmix64) of (seed, replicate, movie, draw, column) instead of the
+    next numbers of a stream, so replicate i sees the same numbers at the same movie and draw
+    whatever the parameters, the other replicates or the movies that were skipped.
+    With the same seed, the difference between two parameter values then comes from the
+    parameters instead of the noise, e.g. a success u <= p at one p is a success at every larger p.
+    Has the random_sample and binomial methods of np.random.RandomState that the kernels use,
+    with the replicates on the first axis. iter_contagion_temporal_kernel calls seek before every movie
+    """
+    def __init__(self, seed, replicates, start=0):
+        '''
+        Input:
+            seed - int seed
+            replicates - number of replicates, the first axis of every draw
+            start - index of the first replicate, so a batch can continue the replicates of another one
+        '''
+        self.seed = seed
+        self.replicates = replicates
+        replicate = np.arange(start, start + replicates, dtype=np.uint64)
+        self.replicate_key = _splitmix64(_splitmix64(np.full(replicates, seed, dtype=np.uint64)) ^ replicate)
+        self.movie = 0
+        self.draw = 0
+
+    def seek(self, movie):
+        """
+        Move to the draws of the movie at the given position
+        """
+        self.movie = movie
+        self.draw = 0
+
+    def random_sample(self, size=None):
+        """
+        Uniforms in (0, 1) of the next draw, size is replicates or (replicates, columns)
+        """
+        shape = (self.replicates,) if size is None else tuple(np.atleast_1d(size))
+        if shape[0] != self.replicates:
+            raise ValueError('the first axis of the draw has to be the {} replicates'.format(self.replicates))
+        key = self.replicate_key ^ _splitmix64(np.full(self.replicates, self.movie, dtype=np.uint64))
+        key = _splitmix64(key ^ np.uint64(self.draw))
+        self.draw += 1
+        columns = int(np.prod(shape[1:]))
+        bits = _splitmix64(key[:, None] + np.arange(columns, dtype=np.uint64))
+        #the top 53 bits, shifted to the middle of their interval so 0 is never drawn
+        u = ((bits >> np.uint64(11)).astype(float) + 0.5)/2.0**53
+        return u.reshape(shape)
+
+    def binomial(self, n, p, size=None):
+        """
+        Binomial(n, p) by inversion of one uniform each, so the number of successes only grows with p
+        """
+        shape = np.shape(n) if size is None else size
+        u = self.random_sample(shape)
+        return stats.binom.ppf(u, n, p).astype(int)
+
+
+def iter_contagion_temporal_kernel(topology, kernel, replicates, interaction=20, state=None, rng=np.random):
+    """
+    Runs the dynamics of kernel on the movies of topology for a batch of replicates at once,
+    and yields (movie_order, year, array of the count of the kernel per replicate) for each movie
+    as soon as it is played.
+    Stops once no replicate can change anymore: no producer that can spread is left in the coming
+    movies, or everyone is counted for an absorbing kernel.
+    Input:
+        topology - ContagionTopology
+        kernel - ContagionKernel, see make_kernel
+        replicates - number of replicates
+        interaction - number of interactions per movie
+        state - ContagionState with one row per replicate to reuse, it is reset before the run
+        rng - numpy random number generator, np.random, a np.random.RandomState or a CounterRandom
+    """
+    state = topology.new_state(replicates) if state is None else state.reset()
+    kernel.prepare(state)
+    movie_order = topology.movie_order
+    years = topology.year
+    indptr = topology.indptr
+    indices = topology.indices
+    counts = kernel.count(state)
+    last_movie = topology.last_movie
+    #per replicate, the last movie with a producer that can spread in it
+    horizon = np.where(state.status, last_movie, -1).max(axis=1) if topology.n_producers else np.full(replicates, -1)
+
+    #movies with a producer that can spread in any replicate. A producer stays in it once it could spread,
+    #the kernel plays its movies without any change where it cannot anymore
+    spreaders = state.status.any(axis=0)
+    frontier = gen.GroupFrontier(topology.producer_movies, np.nonzero(spreaders)[0].tolist())
+    #counter based generators draw by movie, see CounterRandom
+    seek = getattr(rng, 'seek', None)
+
+    yield 0, topology.start_year, counts.copy()
+    k = 0 #first movie without a record
+    while k < len(movie_order):
+        #next movie with a producer that can spread, the movies before it keep the counts
+        play = None if kernel.frozen else frontier.pop()
+        if play is not None:
+            live = horizon >= play
+            if kernel.absorbing:
+                live &= counts < topology.n_producers
+            if not live.any():
+                play = None
+        if play is None:
+            play = len(movie_order)
+        for m, year in zip(movie_order[k:play], years[k:play]):
+            yield m, year, counts.copy()
+        if play == len(movie_order):
+            break
+        movie_producers = indices[indptr[play]:indptr[play+1]]
+        if seek is not None:
+            seek(play)
+        delta = kernel.play(state, movie_producers, interaction, rng)
+        if delta is not None:
+            counts += delta
+            movie_spreaders = state.status[:, movie_producers]
+            horizon = np.maximum(horizon, np.where(movie_spreaders, last_movie[movie_producers], -1).max(axis=1))
+            for x in movie_producers[movie_spreaders.any(axis=0) & ~spreaders[movie_producers]].tolist():
+                spreaders[x] = True
+                frontier.add(x)
+        yield movie_order[play], years[play], counts.copy()
+        k = play + 1
+
+def contagion_temporal_kernel(G, kernel, replicates, interaction=20, topology=None, state=None, rng=np.random):
+    """
+    Runs the dynamics of kernel for a batch of replicates, like contagion_belief_propagation_temporal_batch
+    Input:
+        G - The movie network, ignored if topology is given
+        kernel - ContagionKernel, see make_kernel
+    Output:
+        df_adopter - DataFrame indexed by movie_order, with the year and one column
+                     of the count per replicate ('0', '1', ...)
+    """
+    if topology is None:
+        topology = compile_temporal_network(G)
+    history = np.empty([topology.n_movies + 1, replicates], dtype=int)
+    for k, (movie, year, counts) in enumerate(iter_contagion_temporal_kernel(topology, kernel, replicates,
+                                                                             interaction, state, rng)):
+        history[k] = counts
+
+    index = pd.Index(np.append(0, topology.movie_order), name='movie_order')
+    df_adopter = pd.DataFrame(history, index=index, columns=['{}'.format(i) for i in range(replicates)])
+    df_adopter.insert(0, 'year', np.append(topology.start_year, topology.year))
+    return df_adopter
+
+def contagion_temporal_kernel_replicate(G, kernel, interaction=20, topology=None, state=None, rng=random):
+    """
+    One replicate of the dynamics of kernel, for iter_replicates
+    Input:
+        rng - random.Random instance, seeds the numpy random numbers of the run
+    Output:
+        adopter_history - array of [movie_order, year, count]
+    """
+    if topology is None:
+        topology = compile_temporal_network(G)
+    np_rng = np.random.RandomState(rng.randint(0, 2**31 - 1))
+    adopter_history = np.empty([topology.n_movies + 1, 3], dtype=int)
+    for k, (movie, year, counts) in enumerate(iter_contagion_temporal_kernel(topology, kernel, 1, interaction,
+                                                                             state, np_rng)):
+        adopter_history[k] = [movie, year, counts[0]]
+    return adopter_history
+
+@njit(cache=True)
+def _temporal_interaction_kernel(indptr, indices, last_movie, belief, status, prob, dose, threshold, interaction, seed,
+                                 aggregate=False):
+    """
+    Compiled loop over the movies and their interactions, see contagion_belief_propagation_temporal_jit.
+    belief and status are updated in place.
+    Output:
+        counts - number of adopters after each movie
+    """
+    if seed >= 0:
+        np.random.seed(seed)
+    n_movies = len(indptr) - 1
+    counts = np.empty(n_movies, dtype=np.int64)
+    n_adopters = 0
+    horizon = -1 #last movie with an adopter in it
+    for x in range(len(status)):
+        if status[x]:
+            n_adopters += 1
+            horizon = max(horizon, last_movie[x])
+    frozen = prob <= 0 or dose == 0
+    max_team = 0
+    for k in range(n_movies):
+        max_team = max(max_team, indptr[k+1] - indptr[k])
+    adopters = np.empty(max_team, dtype=np.int64)
+    nonadopters = np.empty(max_team, dtype=np.int64)
+    for k in range(n_movies):
+        if frozen or k > horizon or n_adopters == len(status):
+            #nothing can change anymore
+            counts[k:] = n_adopters
+            break
+        n_a = 0
+        n_na = 0
+        for e in range(indptr[k], indptr[k+1]):
+            x = indices[e]
+            if status[x]:
+                adopters[n_a] = x
+                n_a += 1
+            else:
+                nonadopters[n_na] = x
+                n_na += 1
+        if n_a > 0 and aggregate:
+            #every success converts a non adopter, so only the number of successes is drawn
+            n_new = min(np.random.binomial(interaction, min(prob, 1.0)), n_na)
+            for i in range(n_new):
+                j = int(np.random.random() * n_na)
+                nonadopter = nonadopters[j]
+                belief[nonadopter] = min(max(belief[nonadopter] + dose, 0.0), 1.0)
+                status[nonadopter] = True
+                n_adopters += 1
+                horizon = max(horizon, last_movie[nonadopter])
+                n_na -= 1
+                nonadopters[j] = nonadopters[n_na]
+        elif n_a > 0:
+            i = 0
+            while i < interaction and n_na > 0:
+                #only the non adopter can change belief, so the adopter does not need to be drawn
+                j = int(np.random.random() * n_na)
+                nonadopter = nonadopters[j]
+                if np.random.random() <= prob:
+                    b = min(max(belief[nonadopter] + dose, 0.0), 1.0)
+                    belief[nonadopter] = b
+                    if b >= threshold:
+                        status[nonadopter] = True
+                        n_adopters += 1
+                        horizon = max(horizon, last_movie[nonadopter])
+                        adopters[n_a] = nonadopter
+                        n_a += 1
+                        n_na -= 1
+                        nonadopters[j] = nonadopters[n_na]
+                i += 1
+        counts[k] = n_adopters
+    return counts
+
+def contagion_belief_propagation_temporal_jit(G, prob, dose, threshold, interaction=20, topology=None, state=None,
+                                               seed=None, aggregate=True, rng=None):
+    """
+    contagion_belief_propagation_temporal_array with the whole movie loop in one compiled kernel.
+    Uses numba when it is installed, otherwise the same kernel runs as plain python.
+    Input:
+        G - The movie network, ignored if topology is given
+        prob - Probability of being infected
+        dose - Size of the dose
+        threshold - belief threshold
+        topology - ContagionTopology of G, to avoid compiling G again
+        state - ContagionState to reuse, it is reset before the run
+        seed - int, seed of the kernel random numbers. numba keeps its own random state,
+               so use this instead of np.random.seed to reproduce a run
+        aggregate - sample the new adopters of a movie at once when rounds_convert(dose, threshold)
+        rng - random.Random instance, draws the seed if seed is not given
+    Output:
+        adopter_history - array of [movie_order, year, number of adopters]
+    """
+    if topology is None:
+        topology = compile_temporal_network(G)
+    if seed is None and rng is not None:
+        seed = rng.randint(0, 2**31 - 1)
+    state = topology.new_state() if state is None else state.reset()
+    n_start = int(state.status.sum())
+    counts = _temporal_interaction_kernel(topology.indptr.astype(np.int64), topology.indices.astype(np.int64),
+                                          topology.last_movie.astype(np.int64), state.belief, state.status, float(prob), float(dose), float(threshold),
+                                          int(interaction), -1 if seed is None else int(seed),
+                                          bool(aggregate and rounds_convert(dose, threshold)))
+
+    adopter_history = np.empty([topology.n_movies + 1, 3], dtype=int)
+    adopter_history[0] = [0, topology.start_year, n_start]
+    adopter_history[1:, 0] = topology.movie_order
+    adopter_history[1:, 1] = topology.year
+    adopter_history[1:, 2] = counts
+    return adopter_history
+
+def replicate_seeds(master_seed, replicates):
+    """
+    Derive one seed per replicate from a master seed.
+    Replicate i always gets the same seed, no matter how the replicates are split between workers.
+    Input:
+        master_seed - int, or None for a seed from the operating system
+        replicates - number of replicates
+    Output:
+        seeds - list of int seeds
+    """
+    return np.random.RandomState(master_seed).randint(0, 2**31 - 1, size=replicates).tolist()
+
+def derive_seed(master_seed, *keys):
+    """
+    One int seed for the given keys (i.e. the network version n), derived from the master seed,
+    so runs that share the master seed get independent streams
+    Input:
+        master_seed - int, or None for a seed from the operating system
+        keys - non negative ints
+    Output:
+        seed - int, None if master_seed is None
+    """
+    if master_seed is None:
+        return None
+    return int(np.random.RandomState([master_seed] + [int(k) for k in keys]).randint(0, 2**31 - 1))
+
+#the job of each worker of iter_replicates, set once per process
+_replicate_job = None
+
+def _init_replicate_worker(func, args, kwargs):
+    global _replicate_job
+    _replicate_job = (func, args, kwargs)
+
+def _run_replicate(seed):
+    func, args, kwargs = _replicate_job
+    return func(*args, rng=random.Random(seed), **kwargs)
+
+def iter_replicates(func, args, replicates, workers=1, master_seed=None, start=0, **kwargs):
+    """
+    Runs func(*args, rng=random.Random(seed), **kwargs) once per replicate, each with its own
+    random stream derived from master_seed, and yields the results in replicate order
+    Input:
+        func - contagion function that takes an rng keyword, defined at module level
+               so the workers can load it
+        args - positional arguments of func, sent once to every worker
+        replicates - number of replicates
+        workers - number of processes, 1 runs in this process
+        master_seed - int seed of the whole run
+        start - first replicate to run, to resume a run that stopped after start replicates.
+                The replicates keep their seeds, so a resumed run gives the same results
+    Output:
+        yields (i, result) for i = start, ..., replicates-1
+    """
+    seeds = replicate_seeds(master_seed, replicates)[start:]
+    if workers > 1:
+        pool = Pool(workers, initializer=_init_replicate_worker, initargs=(func, args, kwargs))
+        try:
+            #imap keeps the order of the seeds, so the columns are always in the same order
+            for i, result in enumerate(pool.imap(_run_replicate, seeds), start):
+                yield i, result
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for i, seed in enumerate(seeds, start):
+            yield i, func(*args, rng=random.Random(seed), **kwargs)
+
+def adopter_matrix(replicates, n_replicates, path=None):
+    """
+    Collect the adopter histories of the replicates into one preallocated parser.saver.ReplicateMatrix
+    Input:
+        replicates - iterable of (i, adopter_history), adopter_history as [movie_order, year, n_adopters]
+        n_replicates - number of replicates
+        path - file of the np.memmap of the matrix, in memory if None
+    Output:
+        matrix - ReplicateMatrix, movies x replicates
+    """
+    matrix = None
+    for i, adopter_history in replicates:
+        if matrix is None:
+            matrix = save.ReplicateMatrix.from_history(adopter_history, n_replicates, path=path)
+        elif not matrix.matches(adopter_history):
+            raise ValueError('years are not matching')
+        matrix.set(i, adopter_history)
+    return matrix
+
+def adopter_frame(replicates, n_replicates):
+    """
+    Collect the adopter histories of the replicates into one DataFrame
+    Input:
+        replicates - iterable of (i, adopter_history), adopter_history as [movie_order, year, n_adopters]
+        n_replicates - number of replicates
+    Output:
+        df_adopter - DataFrame indexed by movie_order, with the year and one column per replicate
+    """
+    return adopter_matrix(replicates, n_replicates).to_frame()
+
+def sweep_topologies(topology, parameters):
+    """
+    Topology of every threshold of the sweep
+    Input:
+        topology - ContagionTopology, or a dictionary {threshold: ContagionTopology}
+        parameters - list of (prob, dose, threshold)
+    Output:
+        topologies - dictionary {threshold: ContagionTopology}
+    """
+    thresholds = set(threshold for prob, dose, threshold in parameters)
+    if isinstance(topology, dict):
+        missing = thresholds - set(topology)
+        if missing:
+            raise ValueError('no topology for the thresholds {}'.format(sorted(missing)))
+        return topology
+    if len(thresholds) > 1:
+        raise ValueError('the initial beliefs and status are built with the threshold, '
+                         'give one topology per threshold as {threshold: topology}')
+    return {threshold: topology for threshold in thresholds}
+
+def iter_sweep_replicates(topology, parameters, replicates, engine='batch', workers=1, master_seed=None, interaction=20,
+                          dynamics='threshold', common_random=False, start=None, block=None, recovery=None,
+                          exposures=None):
+    """
+    Runs the temporal model for a grid of parameters on one compiled network, replicate by replicate,
+    so every finished replicate can be checkpointed (i.e. with parser.saver.ReplicateCheckpoint)
+    Input:
+        topology - ContagionTopology of the network, or a dictionary {threshold: ContagionTopology}
+                   when the thresholds differ, since the initial beliefs and status are built
+                   with the threshold. A single topology is only taken for a single threshold
+        parameters - list of (prob, dose, threshold)
+        replicates - number of replicates per parameter
+        engine - 'batch', 'array' or 'jit'. For the dynamics other than 'threshold',
+                 'array' runs the replicates one at a time on the workers and 'jit' is not available
+        workers - number of processes for the 'array' and 'jit' engines
+        master_seed - int seed of the whole sweep, each parameter gets its own seed from it
+        dynamics - 'threshold', 'sir', 'sis' or 'exposure', see make_kernel for the parameters
+        common_random - drive replicate i of every parameter with the same CounterRandom numbers,
+                        so the curves of neighboring parameters differ by the parameters rather than
+                        by the noise. Only for the 'batch' engine
+        start - dictionary {(prob, dose, threshold): first replicate to run}, to resume a sweep, 0 if missing
+        block - number of replicates the 'batch' engine runs together, all of them if None.
+                Block b gets the b-th seed derived from the seed of the parameter, so the replicates
+                are the same when a sweep resumes with the same block
+        recovery - probability of recovery per movie of the 'sir' and 'sis' dynamics, the same for every parameter
+        exposures - number of exposures k of the 'exposure' dynamics, the same for every parameter
+    Output:
+        yields ((prob, dose, threshold), i, adopter_history) in the order of parameters and replicates,
+        adopter_history is the array of [movie_order, year, n_adopters] of replicate i.
+        The replicates of a block of the 'batch' engine come out together once the block is done
+    """
+    valid = {'batch', 'array', 'jit'}
+    if engine not in valid:
+        raise ValueError("`engine` must be one of: {}".format(", ".join(valid)))
+    if dynamics != 'threshold' and engine == 'jit':
+        raise ValueError("the 'jit' engine only runs the 'threshold' dynamics")
+    if common_random and engine != 'batch':
+        raise ValueError("common random numbers need the 'batch' engine")
+    topologies = sweep_topologies(topology, parameters)
+    start = {} if start is None else start
+    block = replicates if block is None else block
+    seeds = replicate_seeds(master_seed, len(parameters))
+    for (prob, dose, threshold), seed in zip(parameters, seeds):
+        parameter = (prob, dose, threshold)
+        topology = topologies[threshold]
+        kernel = make_kernel(dynamics, prob, dose, threshold, recovery, exposures)
+        first = start.get(parameter, 0)
+        if first >= replicates:
+            continue
+        if engine == 'batch':
+            block_seeds = replicate_seeds(seed, -(-replicates//block))
+            index = np.append(0, topology.movie_order)
+            year = np.append(topology.start_year, topology.year)
+            #a block cut by the end of the last run is played again and only its missing replicates are kept
+            for block_start in range(first - first % block, replicates, block):
+                size = min(block, replicates - block_start)
+                if common_random:
+                    #with common random numbers every parameter uses the seed of the first one
+                    rng = CounterRandom(seeds[0], size, start=block_start)
+                else:
+                    rng = np.random.RandomState(block_seeds[block_start//block])
+                df_adopter = contagion_temporal_kernel(None, kernel, size, interaction, topology, rng=rng)
+                for j in range(max(first - block_start, 0), size):
+                    yield parameter, block_start + j, np.column_stack([index, year, df_adopter['{}'.format(j)].values])
+        else:
+            if dynamics != 'threshold':
+                func, args = contagion_temporal_kernel_replicate, (None, kernel, interaction)
+            elif engine == 'jit':
+                func, args = contagion_belief_propagation_temporal_jit, (None, prob, dose, threshold, interaction)
+            else:
+                func, args = contagion_belief_propagation_temporal_array, (None, prob, dose, threshold, interaction)
+            for i, adopter_history in iter_replicates(func, args, replicates, workers, seed, start=first,
+                                                      topology=topology):
+                yield parameter, i, adopter_history
+
+def iter_sweep_temporal_network(topology, parameters, replicates, engine='batch', workers=1, master_seed=None, interaction=20,
+                                dynamics='threshold', common_random=False, block=None, recovery=None, exposures=None):
+    """
+    Runs the temporal model for a grid of parameters on one compiled network, see iter_sweep_replicates
+    Output:
+        yields ((prob, dose, threshold), df_adopter) in the order of parameters
+    """
+    sweep = iter_sweep_replicates(topology, parameters, replicates, engine, workers, master_seed, interaction,
+                                  dynamics, common_random, block=block, recovery=recovery, exposures=exposures)
+    for parameter, group in groupby(sweep, key=itemgetter(0)):
+        yield parameter, adopter_frame(((i, adopter_history) for _, i, adopter_history in group), replicates)
+
+def sweep_temporal_network(topology, parameters, replicates, engine='batch', workers=1, master_seed=None, interaction=20,
+                           dynamics='threshold', common_random=False, block=None, recovery=None, exposures=None):
+    """
+    Same as iter_sweep_temporal_network, but returns every result at once
+    Output:
+        results - dictionary {(prob, dose, threshold): df_adopter}
+    """
+    return dict(iter_sweep_temporal_network(topology, parameters, replicates, engine, workers, master_seed, interaction,
+                                            dynamics, common_random, block, recovery, exposures))
+
+def contagion_sequential_projected_network(G, step, interval, prob, dose, threshold, iterations=20, rng=random):
     """
     Sequential belief update of contagion
     input:
@@ -157,87 +1279,118 @@ def contagion_sequential_projected_network(G, step, interval, prob, dose, thresh
         interval - pandas object interval (start_year, end_year) of the aggregation block
         prob, dose, threshold, contagion model parameters 
         iterations - how many iterations I will use for so called one 'step' of belief update
+        rng - random number generator, random module or random.Random instance
     output:
         G - updated G
         adopter_history - number of adopter increase over the steps
     """
     G = G.copy()
-    #get the initial adopters
-    adopters = [n for n in G.nodes() if G.node[n]['status'] == 'Adopter']
-    adopter_history = [[(interval.left, interval.right),0, len(adopters)]]
+    #get the initial adopters, tracked instead of recounted after every interaction
+    tracker = gen.AdoptionTracker.from_graph(G, G.nodes(), threshold, record_events=False)
+    everyone = tracker.partition(G.nodes())
+    adopter_history = [[(interval.left, interval.right),0, tracker.n_adopters]]
 
 
     for step in range(step): #one movie is noe step
         i = 0
         #chose a random node to start
-        adopter = random.choice(adopters)
-        neighbors = list(G.neighbors(adopter))
-        nonadopter_neighbors = [x for x in neighbors if G.node[x]['status']=='NonAdopter']
-        while i < iterations and nonadopter_neighbors:
+        adopter = rng.choice(everyone.adopters)
+        neighbors = tracker.partition(G.neighbors(adopter))
+        while i < iterations and neighbors.nonadopters:
             #choose non adopter from neighbors
-            nonadopter = random.choice(nonadopter_neighbors)
-            b_a, b_na = calculate_belief(G.node[adopter], G.node[nonadopter], prob, dose, threshold)
+            nonadopter = rng.choice(neighbors.nonadopters)
+            b_a, b_na = calculate_belief(G.node[adopter], G.node[nonadopter], prob, dose, threshold, rng=rng)
             G.node[adopter]['belief'] = b_a
             G.node[nonadopter]['belief'] = b_na
-            #update network status
-            G = gen.update_adoption_status(G, G.nodes(), threshold)
+            #update status of the two producers
+            for x, b in ((adopter, b_a), (nonadopter, b_na)):
+                if everyone.update(x, b, step+1):
+                    G.node[x]['status'] = 'Adopter' if tracker.is_adopter(x) else 'NonAdopter'
             #get adopters from the neighbors
-            adopter_neighbors = [x for x in neighbors if G.node[x]['status']=='Adopter']
-            if adopter_neighbors != []:
-                adopter = random.choice(adopter_neighbors)
-            nonadopter_neighbors = [x for x in neighbors if G.node[x]['status']=='NonAdopter']
-            neighbors = list(G.neighbors(adopter))
+            neighbors = tracker.partition(G.neighbors(adopter))
+            if neighbors.adopters:
+                adopter = rng.choice(neighbors.adopters)
             i += 1
-        adopters = [n for n in G.nodes() if (G.node[n]['status'] == 'Adopter')]
-        adopter_history.append([(interval.left, interval.right),step+1, len(adopters)])
+        adopter_history.append([(interval.left, interval.right),step+1, tracker.n_adopters])
     return G, np.array(adopter_history)
 
-def cumulative_adopters_projected_network_sequential(df_raw, interval, seeds, belief_type, p, d, threshold):
+def contagion_sequential_projected_window(window, belief, tracker, step, interval, prob, dose, threshold, iterations=20,
+                                           rng=random):
+    """
+    contagion_sequential_projected_network on a ProjectedWindow, with the beliefs in one global array
+    input:
+        window - network_builder.ProjectedWindow of the aggregation block
+        belief - array of beliefs of all the producers of the window, updated in place
+        tracker - AdoptionTracker of all the producers, keyed by producer index
+        step - int, number of movies in the block
+        interval - pandas object interval (start_year, end_year) of the aggregation block
+        prob, dose, threshold, contagion model parameters
+        iterations - how many iterations I will use for so called one 'step' of belief update
+        rng - random number generator, random module or random.Random instance
+    output:
+        adopter_history - [interval, step, number of adopters in the system] over the steps
+    """
+    everyone = tracker.partition(window.nodes())
+    adopter_history = np.empty([step + 1, 3], dtype=object)
+    adopter_history[0] = [(interval.left, interval.right), 0, tracker.n_adopters]
+    for s in range(step): #one movie is one step
+        i = 0
+        if everyone.adopters:
+            #chose a random adopter to start
+            adopter = rng.choice(everyone.adopters)
+            neighbors = tracker.partition(window.neighbors(adopter))
+            while i < iterations and neighbors.nonadopters:
+                #choose non adopter from neighbors
+                nonadopter = rng.choice(neighbors.nonadopters)
+                b_a, b_na = calculate_belief_values(belief[adopter], belief[nonadopter], prob, dose, threshold, rng=rng)
+                belief[adopter] = b_a
+                belief[nonadopter] = b_na
+                for x, b in ((adopter, b_a), (nonadopter, b_na)):
+                    everyone.update(x, b, s+1)
+                #get adopters from the neighbors
+                neighbors = tracker.partition(window.neighbors(adopter))
+                if neighbors.adopters:
+                    adopter = rng.choice(neighbors.adopters)
+                i += 1
+        adopter_history[s+1] = [(interval.left, interval.right), s+1, tracker.n_adopters]
+    return adopter_history
+
+def cumulative_adopters_projected_network_sequential(df_raw, interval, seeds, belief_type, p, d, threshold, rng=random):
     """
-    Calculate cumulative of projected network over time
+    Calculate cumulative of projected network over time.
+    The projected network of each block is made by sliding one ProjectedWindow
+    over the movies, and the beliefs carry over in one array
     input
         df_raw - df data with movies as rows
         interval - interval of aggregation
         seeds - initial adopters
+        rng - random number generator of the dynamics, random module or random.Random instance
     """
     start_year = df_raw.year.iloc[0] - 1
     end_year = df_raw.year.iloc[-1] + 1
     grouped_by_year = df_raw.groupby(pd.cut(df_raw['year'], np.arange(start_year, end_year, interval)))
-    
-    #make dictionary that keeps track of belief scale
-    total_nodes = list(set([i[0] for sublist in df_raw.producers.tolist() for i in sublist]))
-    belief_dict = {n:1 if n in seeds else 0 for n in total_nodes}
-    
-    existing_adopters = list(set(seeds))
-    total_adopter_history = []
-    total_steps = 0
+
+    #the cliques of every movie are found once, and the window moves over them
+    window = build.ProjectedWindow.from_dataframe(df_raw)
+    teams = window.teams(df_raw)
+    #the beliefs of all the producers in the system, seeds start as adopters
+    seeds = set(seeds)
+    belief = np.array([1.0 if n in seeds else 0.0 for n in window.producer_ids])
+    tracker = gen.AdoptionTracker(dict(enumerate((belief >= threshold).tolist())), threshold, record_events=False)
+
+    total_adopter_history = None
     for interval, df in grouped_by_year:
-        #make network
-        G = sgm.build_projected_network(df, seeds, belief_type, threshold)
-        #update beliefs in new G for the nodes that were already been in the system
-        for n in G.nodes():
-            G.node[n]['belief'] = belief_dict[n]
-        #update adoption status
-        G = gen.update_adoption_status(G, G.nodes(), threshold)
-        #calculate adopter
-        G_update, adopter_history = contagion_sequential_projected_network(G, len(df), interval, p, d, threshold)
-        
-        #calculating adopters that are in the system, but was not in G
-        adopter_update = [n for n in G_update.nodes() if G_update.node[n]['status']=='Adopter'] 
-        adopters_not_in_G = [k for k in belief_dict.keys() if (belief_dict[k] >= threshold) and (k not in adopter_update)]
-        #add adopters that are not in the sub G but are actually in the system
-        adopter_history[:,2] += len(adopters_not_in_G)
-
-        if total_adopter_history == []:
-            total_adopter_history = adopter_history    
+        #drop the movies of the last block and add the movies of this block
+        window.slide(teams[k] for k in df.index)
+        #the tracker counts the adopters that are in the system, but not in the block
+        adopter_history = contagion_sequential_projected_window(window, belief, tracker, len(df), interval,
+                                                                p, d, threshold, rng=rng)
+        if total_adopter_history is None:
+            total_adopter_history = adopter_history
         else:
             #add the dates
-            adopter_history[:,1] += (len(total_adopter_history)-1)            
+            adopter_history[:,1] += (len(total_adopter_history)-1)
             total_adopter_history = np.append(total_adopter_history, adopter_history[1:], axis=0)
-        #update the belief dictionary
-        for k in G_update.nodes():
-            belief_dict[k] = G_update.node[k]['belief']
-        
     return total_adopter_history
 
 #################################################################################################################################
@@ -272,9 +1425,8 @@ def contagion_synchronous_belief_propagation_projected_network(G, prob, dose, th
             new_belief = deepcopy(old_belief)
             total_edge_weights = sum([G[subject_id][key]['weight'] for key in G.edge[subject_id]])
             for object_id in G.neighbors(subject_id):
-                shift_length = 1
                 w = G[subject_id][object_id]['weight']/total_edge_weights
-                b1, b2 = calculate_belief(G.node[subject_id], G.node[object_id], shift_length, prob, dose, threshold, w)
+                b1, b2 = calculate_belief(G.node[subject_id], G.node[object_id], prob, dose, threshold, w)
                 new_belief += (b1 - old_belief) #only update teh delta
             new_belief = gen.limit_belief(new_belief)
             #Saving the new belief in the dictionary
@@ -290,45 +1442,264 @@ def contagion_synchronous_belief_propagation_projected_network(G, prob, dose, th
         t+=1
     return G, np.array(adopter_history)
 
+def projected_weight_matrix(G, weight_type, nodes=None):
+    """
+    Row normalized weighted adjacency of the projected network, the same weights
+    contagion_synchronous_belief_propagation_projected_network uses:
+    W[i, j] = weight(i, j) / sum of the edge weights of i
+    Input:
+        G - projected network, or a network_builder.ProducerProjection
+        weight_type - 'none', 'days', 'shifts', see calculate_weight
+        nodes - row order of the matrix, G.nodes() if not given
+    Output:
+        W - scipy.sparse csr matrix, rows of isolated nodes are empty
+    *The rows of a ProducerProjection are its producers and nodes is ignored,
+     its movies have no days, so it takes 'years' instead of 'days'
+    """
+    if hasattr(G, 'adjacency') and hasattr(G, 'incidence'):
+        return normalize_rows(G.adjacency(weight_type))
+    if nodes is None:
+        nodes = list(G.nodes())
+    G = calculate_weight(G.copy(), weight_type)
+    node_index = {n:k for k, n in enumerate(nodes)}
+    rows, cols, weights = [], [], []
+    for n in nodes:
+        for neighbor in G.neighbors(n):
+            rows.append(node_index[n])
+            cols.append(node_index[neighbor])
+            weights.append(G[n][neighbor]['weight'])
+    W = sparse.csr_matrix((np.array(weights, dtype=float), (rows, cols)), shape=(len(nodes), len(nodes)))
+    return normalize_rows(W)
+
+def normalize_rows(W):
+    """
+    Divide each row of the sparse weight matrix by its sum, empty rows stay empty
+    """
+    total_edge_weights = np.asarray(W.sum(axis=1)).ravel()
+    total_edge_weights[total_edge_weights == 0] = 1.0
+    return sparse.diags(1.0/total_edge_weights).dot(W).tocsr()
+
+def synchronous_sparse_steps(W, belief, prob, dose, threshold, time_limit, rng=np.random):
+    """
+    Steps of the synchronous update on a row normalized weight matrix,
+    see contagion_synchronous_belief_propagation_projected_sparse
+    Input:
+        W - row normalized scipy.sparse csr matrix
+        belief - array of beliefs in the row order of W, updated in place
+        prob, dose, threshold - contagion model parameters
+        time_limit - number of steps, including time 0
+        rng - numpy random number generator, np.random or a np.random.RandomState
+    Output:
+        adopter_history - array of [time, number of adopters]
+    """
+    adopter_history = np.empty([max(time_limit, 1), 2], dtype=int)
+    for t, record in enumerate(iter_synchronous_sparse_steps(W, belief, prob, dose, threshold, time_limit, rng)):
+        adopter_history[t] = record
+    return adopter_history
+
+def iter_synchronous_sparse_steps(W, belief, prob, dose, threshold, time_limit, rng=np.random):
+    """
+    Generator version of synchronous_sparse_steps, yields [time, number of adopters] after each step
+    """
+    #edge list of W, row i is the node whose belief changes
+    rows = np.repeat(np.arange(W.shape[0]), np.diff(W.indptr))
+    cols = W.indices
+    adopter = belief >= threshold
+
+    yield [0, int(adopter.sum())]
+    changed = True
+    for t in range(1, time_limit):
+        if changed:
+            #edges from a non adopter to an adopter, the only ones that can change a belief
+            boundary = np.nonzero(~adopter[rows] & adopter[cols])[0]
+            if prob <= 0 or dose == 0 or not len(boundary):
+                #absorbing state, fill the remaining steps with the final count
+                n_adopters = int(adopter.sum())
+                for t_rest in range(t, time_limit):
+                    yield [t_rest, n_adopters]
+                break
+        infected = boundary[rng.random_sample(len(boundary)) <= prob]
+        if len(infected):
+            delta = np.bincount(rows[infected], weights=W.data[infected], minlength=len(belief))
+            belief[:] = np.clip(belief + dose*delta, 0.0, 1.0)
+            new_adopter = belief >= threshold
+            #the boundary only moves when somebody adopts
+            changed = (new_adopter != adopter).any()
+            adopter = new_adopter
+        else:
+            changed = False
+        yield [t, int(adopter.sum())]
+
+def contagion_synchronous_belief_propagation_projected_sparse(G, prob, dose, threshold, weight_type, time_limit=10000,
+                                                              W=None, rng=np.random):
+    """
+    Sparse matrix version of contagion_synchronous_belief_propagation_projected_network.
+    A non adopter i gets infected by each adopter neighbor j with probability prob, and
+    its belief grows by dose * W[i, j], all at once for time t+1.
+    The weights are normalized once, and each step draws the Bernoulli trials only for
+    the edges between a non adopter and an adopter. Without such edges nothing can change,
+    so the run stops and the remaining steps keep the final number of adopters.
+    Input:
+        G - NX graph of producers, static
+        prob - probability of infection
+        dose - dosage of infection
+        threshold - threshold for being infected
+        weight_type - 'none', 'days', 'shifts'
+        W - output of projected_weight_matrix with the G.nodes() order, to avoid building it again
+        rng - numpy random number generator, np.random or a np.random.RandomState
+    Output:
+        G - copy of G with the final beliefs and status
+        adopter_history - array of [time, number of adopters]
+    """
+    G = G.copy()
+    nodes = list(G.nodes())
+    if W is None:
+        W = projected_weight_matrix(G, weight_type, nodes)
+    belief = np.array([G.node[n]['belief'] for n in nodes], dtype=float)
+    adopter_history = synchronous_sparse_steps(W, belief, prob, dose, threshold, time_limit, rng)
+    adopter_history[0, 1] = sum(1 for n in nodes if G.node[n]['status'] == 'Adopter')
+    adopter = belief >= threshold
+
+    for n, b, a in zip(nodes, belief.tolist(), adopter.tolist()):
+        G.node[n]['belief'] = b
+        G.node[n]['status'] = 'Adopter' if a else 'NonAdopter'
+    return G, adopter_history
 
 
 def calculate_weight(G, weight_type):
     """
     Add edge attribute depending on which weight type:
     type 'shifts' number of shifts together 'days' = number of days together
+    The weights of all the pairs are summed in one pass over the parallel edges
     input:
     G - Network graph
     weight_type - 'shifts', or 'days'
     return
     G - Netwrk graph with edge attributute 'weight' added
     """
-    for edge_pair in set(G.edges()):
-        node1, node2 = edge_pair
+    if G.is_multigraph():
+        edges = G.edges(keys=True, data=True)
+    else:
+        edges = ((node1, node2, 0, att) for node1, node2, att in G.edges(data=True))
+    weights = {}
+    for node1, node2, key, att in edges:
+        if type(key) != int: #skip the weight written by an earlier call
+            continue
+        pair = (node1, node2)
         if weight_type == 'shifts':
-            weight = len([k for k in G.edge[node1][node2].keys() if type(k)==int])
+            weights[pair] = weights.get(pair, 0) + 1
         elif weight_type == 'days':
-            weight = sum([att['days'] for k, att in G.edge[node1][node2].items() if type(k)==int])
+            weights[pair] = weights.get(pair, 0) + att['days']
         else:
-            weight = 1
+            weights[pair] = 1
+    for (node1, node2), weight in weights.items():
         G.edge[node1][node2]['weight'] = weight
+    #the weighted draws of choose_neighbor use the new weights
+    _neighbor_samplers.pop(G, None)
     return G
 
-def choose_neighbor(G, node, weight_choice):
+class NeighborSampler(object):
+    """
+    Draws a neighbor of a node with probability proportional to the edge weight.
+    The cumulative weights of a node are built the first time it is drawn from, and a draw
+    is a binary search, O(log d), instead of a list with every neighbor repeated weight times.
+    The tables are dropped when the network changes: for a ProjectedWindow when the window
+    moves, for a networkx graph when calculate_weight writes new weights or invalidate is called.
+    """
+    def __init__(self, edge_weights, version=None):
+        '''
+        Input:
+            edge_weights - function node -> (list of neighbors, list of weights)
+            version - function returning the version of the network, the tables are rebuilt when it changes
+        '''
+        self.edge_weights = edge_weights
+        self.version = version
+        self.seen_version = version() if version is not None else None
+        self.tables = {}
+
+    @classmethod
+    def from_graph(cls, G):
+        '''
+        Sampler on the 'weight' edge attribute of G, see calculate_weight
+        '''
+        def edge_weights(node):
+            neighbors = list(G.neighbors(node))
+            return neighbors, [G[node][n]['weight'] for n in neighbors]
+        return cls(edge_weights)
+
+    @classmethod
+    def from_window(cls, window):
+        '''
+        Sampler on the number of movies together in a network_builder.ProjectedWindow
+        '''
+        def edge_weights(k):
+            counts = window.pair_count[k]
+            return list(counts.keys()), list(counts.values())
+        return cls(edge_weights, lambda: window.version)
+
+    def invalidate(self, node=None):
+        '''
+        Drop the table of the node, or all of them
+        '''
+        if node is None:
+            self.tables = {}
+        else:
+            self.tables.pop(node, None)
+
+    def table(self, node):
+        if self.version is not None and self.version() != self.seen_version:
+            self.seen_version = self.version()
+            self.tables = {}
+        if node not in self.tables:
+            neighbors, weights = self.edge_weights(node)
+            self.tables[node] = (neighbors, np.cumsum(weights, dtype=float).tolist())
+        return self.tables[node]
+
+    def choose(self, node, rng=random):
+        '''
+        Returns one neighbor of the node, weighted by the edge weights
+        '''
+        neighbors, cumulative = self.table(node)
+        if not neighbors or cumulative[-1] <= 0:
+            raise IndexError('node {} has no weighted neighbors'.format(node))
+        return neighbors[bisect_right(cumulative, rng.random()*cumulative[-1])]
+
+#NeighborSampler of every network choose_neighbor draws from, dropped with the network
+_neighbor_samplers = weakref.WeakKeyDictionary()
+
+def neighbor_sampler(G):
+    """
+    NeighborSampler of G kept between the draws of choose_neighbor
+    input:
+        G - networkx graph with the 'weight' edge attribute, or a network_builder.ProjectedWindow
+    """
+    sampler = _neighbor_samplers.get(G)
+    if sampler is None:
+        #the sampler only holds a proxy, so the network can still be dropped
+        if isinstance(G, build.ProjectedWindow):
+            sampler = NeighborSampler.from_window(weakref.proxy(G))
+        else:
+            sampler = NeighborSampler.from_graph(weakref.proxy(G))
+        _neighbor_samplers[G] = sampler
+    return sampler
+
+def choose_neighbor(G, node, weight_choice, rng=random):
     """
     returns one neighbor of given node to interacct
     input:
-        G - network
+        G - network, or a network_builder.ProjectedWindow
         node - the given node
         weight - True/False weither we are going to consdier weighting
+        rng - random number generator, random module or random.Random instance
     return:
         neighbor - neighboring node of given node
+    *the weighted draws use the cumulative weights of the node, built once per network and node
     """
     #weigh in 
     if weight_choice == 'neighbor':
-        neighbors = [n for n in G.neighbors(node) for i in range(G.edge[node][n]['weight'])]
-        neighbor = random.choice(neighbors)
+        neighbor = neighbor_sampler(G).choose(node, rng)
     else:
-        neighbor = random.choice(G.neighbors(node))
+        neighbor = rng.choice(list(G.neighbors(node)))
     return neighbor    
 
 
@@ -351,41 +1722,71 @@ def check_adopter(G, nodes_data, b):
 Here is the aggreagate of all the above partial functions
 """
 
-def cumulative_adopters_over_time_projected_network_synchronous_update(physician_sched_dict, belief_type, p, d, b, weight_type, time_limit=10000):
+def block_projections(physician_sched_dict, weight_type):
+    """
+    Row normalized weighted projection of every block, computed once from the data
+    and shared by every run of cumulative_adopters_over_time_projected_network_synchronous_update
+    input:
+        physcian_sched_dict: cut up sched. dictionary of dfs
+        weight_type - 'none', 'shifts'/'movies', 'days', 'years', see network_builder.weighted_projection,
+                      'days' sums the Days of the shifts together as calculate_weight
+    output:
+        producer_ids - list of producers, the row order of the matrices
+        projections - {block key: (scipy.sparse csr matrix, producers of the block)}
+    """
+    all_blocks = pd.concat([physician_sched_dict[key] for key in sorted(physician_sched_dict.keys())])
+    window = build.ProjectedWindow.from_dataframe(all_blocks)
+    projections = {}
+    for key in sorted(physician_sched_dict.keys()):
+        window.slide(window.teams(physician_sched_dict[key], 'Date').values())
+        projections[key] = (normalize_rows(window.adjacency(weight_type)), window.nodes())
+    return window.producer_ids, projections
+
+def cumulative_adopters_over_time_projected_network_synchronous_update(physician_sched_dict, belief_type, p, d, b, weight_type,
+                                                                        time_limit=10000, seeds=(), projections=None,
+                                                                        rng=np.random):
     """
     When the schedule is cut into months, get the cumulative adopters over time for the projected network. 
+    The projected network of each block is made by sliding one ProjectedWindow over the blocks,
+    and the beliefs carry over in one array
     input:
         physcian_sched_dict: cut up sched. dictionary of dfs
         belieft_type: 'empirical' for the contagion model
         p, d, b - contagion model parameters
+        weight_type - 'none', 'shifts'/'movies', 'days', 'years', see network_builder.weighted_projection
+        seeds - initial adopters
+        projections - output of block_projections, to avoid computing the weights again
+        rng - numpy random number generator, np.random or a np.random.RandomState
     output:
         entire_adopter_history: numpy array of cumulative adopters [days, adopters]
+    *the positional arguments are the ones of the networkx version, but the initial adopters are now given
+     by seeds instead of the shift graph maker, so a call without seeds starts without 'empirical' adopters.
+    *the adopters are counted over the producers seen in the blocks so far, an earlier adopter outside the block
+     counts with its belief now instead of staying an adopter. It is the same count as the networkx version,
+     which test_projection checks, unless a negative dose takes the belief of an adopter back under the threshold
     """
     entire_adopter_history = np.empty([0,2],dtype=int)
     start_date = physician_sched_dict[0].Date.iloc[0]
-    belief_dict = {}
-    cumulative_adopters = [] #account for addional adopters
+    if projections is None:
+        projections = block_projections(physician_sched_dict, weight_type)
+    producer_ids, projections = projections
+    belief = build.initial_beliefs(producer_ids, seeds, belief_type, b)
+    seen = np.zeros(len(belief), dtype=bool) #producers that were in one of the blocks so far
     for key in sorted(physician_sched_dict.keys()):
         df = physician_sched_dict[key]
         block_start_date = df['Date'].iloc[0] 
         block_end_date = df['Date'].iloc[-1]
         time_limit = (block_end_date - block_start_date).days + df['Days'].iloc[-1]
         add_up_date = (block_start_date-start_date).days
-        G = sgm.build_projected_network(df, belief_type, b)
-        #get the updated G and adopter history
-        G = update_beliefs_for_existing_nodes(G, belief_dict, b)
-        add_adopters = len([x for x in cumulative_adopters if x not in G.nodes()])
-
-        G, adopter_history = contagion_synchronous_belief_propagation_projected_network(G, p, d, b, weight_type, time_limit)
-        #get the beliefs for new G
-        belief_dict.update({n:G.node[n]['belief'] for n in G.nodes()})
-        #get the adopters for new G
-        new_adopters = [n for n in G.nodes() if G.node[n]['status'] == 'Adopter']
-        cumulative_adopters.extend(new_adopters)
-        cumulative_adopters = list(set(cumulative_adopters))
-        #adjust for the date and additionarl adopters
+        #producers outside the block have no edges and keep their beliefs
+        W, block_producers = projections[key]
+        seen[block_producers] = True
+        #only the adopters that were seen are counted
+        not_seen_adopters = ((belief >= b) & ~seen).sum()
+        adopter_history = synchronous_sparse_steps(W, belief, p, d, b, time_limit, rng)
+        #adjust for the date and the adopters that have not been in the system yet
         adopter_history[:,0] += add_up_date
-        adopter_history[:,1] += add_adopters
+        adopter_history[:,1] -= not_seen_adopters
         entire_adopter_history = np.append(entire_adopter_history, adopter_history, 0)
     return entire_adopter_history
 
@@ -9,6 +9,8 @@ import os
 from operator import itemgetter
 from itertools import combinations
 from math import ceil
+from bisect import bisect_right
+import heapq
 
 #from dateutil import parse
 
@@ -49,6 +51,191 @@ def update_adoption_status(G, producer_nodes, threshold):
             G.node[pnode]['status'] = 'NonAdopter'
     return G
 
+class AdoptionTracker(object):
+    '''
+    Keeps the adoption status of the producers with a running count of adopters,
+    so the network does not have to be rescanned after every interaction.
+    Every threshold crossing is recorded as an event [node, time, status].
+    '''
+    def __init__(self, status, threshold, record_events=True):
+        '''
+        Input:
+            status - dictionary {node: True if adopter}
+            threshold - the adoption threshold
+            record_events - keep the log of the status changes
+        '''
+        self.threshold = threshold
+        self.status = dict(status)
+        self.n_adopters = sum(1 for s in self.status.values() if s)
+        self.record_events = record_events
+        self.events = []
+        self.last_active = None
+        self.horizon = None
+        self.frontier = None
+
+    @classmethod
+    def from_graph(cls, G, nodes, threshold, record_events=True):
+        '''
+        Make the tracker from the 'status' attribute of the nodes in G
+        '''
+        status = {n: G.node[n]['status'] == 'Adopter' for n in nodes}
+        return cls(status, threshold, record_events)
+
+    def track_horizon(self, last_active):
+        '''
+        Keep the last position at which an adopter still meets other nodes,
+        so the run can stop once it is passed (see is_absorbed)
+        Input:
+            last_active - dictionary {node: position of the last group (i.e. movie) of the node}
+        '''
+        self.last_active = last_active
+        self.horizon = max([last_active.get(n, -1) for n, s in self.status.items() if s] + [-1])
+        return self
+
+    def track_frontier(self, groups):
+        '''
+        Keep a GroupFrontier of the coming groups with an adopter in them, the new adopters
+        add their coming groups as they adopt
+        Input:
+            groups - groups[node] is the sorted list of the positions of the groups of node
+        '''
+        self.frontier = GroupFrontier(groups, [n for n, s in self.status.items() if s])
+        return self
+
+    def is_absorbed(self, position):
+        '''
+        True if no status can change from the group at position on:
+        everybody adopted, or no adopter is in a group at or after position
+        '''
+        if self.n_adopters == len(self.status):
+            return True
+        return self.horizon is not None and position > self.horizon
+
+    def is_adopter(self, node):
+        return self.status[node]
+
+    def update(self, node, belief, time=None):
+        '''
+        Update the status of one node from its belief
+        Input:
+            node - node id
+            belief - new belief of the node
+            time - time of the update, saved in the event log
+        Output:
+            changed - True if the node crossed the threshold
+        '''
+        new_status = belief >= self.threshold
+        if new_status == self.status[node]:
+            return False
+        self.status[node] = new_status
+        if new_status:
+            self.n_adopters += 1
+            if self.last_active is not None:
+                self.horizon = max(self.horizon, self.last_active.get(node, -1))
+            if self.frontier is not None:
+                self.frontier.add(node)
+        else:
+            self.n_adopters -= 1
+        if self.record_events:
+            self.events.append([node, time, 'Adopter' if new_status else 'NonAdopter'])
+        return True
+
+    def partition(self, nodes):
+        '''
+        Split the given nodes (i.e. the producers of a movie) into adopters and non adopters
+        '''
+        return StatusPartition(self, nodes)
+
+    def event_log(self):
+        '''
+        Returns the list of status changes [node, time, status] in the order they happened
+        '''
+        return list(self.events)
+
+
+class StatusPartition(object):
+    '''
+    Adopters and non adopters of a group of nodes, kept up to date in O(1) per update.
+    The order inside the lists is not kept, a moved node takes the place of the last one.
+    '''
+    def __init__(self, tracker, nodes):
+        self.tracker = tracker
+        self.adopters = []
+        self.nonadopters = []
+        self.position = {}
+        for n in nodes:
+            group = self.adopters if tracker.status[n] else self.nonadopters
+            self.position[n] = len(group)
+            group.append(n)
+
+    def update(self, node, belief, time=None):
+        '''
+        Update the status of the node in the tracker and move it to the other group if it changed
+        Output:
+            changed - True if the node crossed the threshold
+        '''
+        changed = self.tracker.update(node, belief, time)
+        if changed and node in self.position:
+            if self.tracker.status[node]:
+                source, target = self.nonadopters, self.adopters
+            else:
+                source, target = self.adopters, self.nonadopters
+            #swap the last node into the place of the moved node
+            i = self.position[node]
+            last = source.pop()
+            if last != node:
+                source[i] = last
+                self.position[last] = i
+            self.position[node] = len(target)
+            target.append(node)
+        return changed
+
+class GroupFrontier(object):
+    '''
+    The coming groups (i.e. movies) that have at least one adopter in them, in position order.
+    Groups without an adopter cannot change anything, so a run can jump from one frontier group
+    to the next instead of visiting every group.
+    Nodes are only added, so the frontier can hold groups whose adopters changed back,
+    which the run then plays without any change.
+    '''
+    def __init__(self, groups, nodes=()):
+        '''
+        Input:
+            groups - groups[node] is the sorted list of the positions of the groups of node
+            nodes - the adopters at the start
+        '''
+        self.groups = groups
+        self.position = -1 #position of the group that is played
+        self.heap = []
+        self.queued = set()
+        for n in nodes:
+            self.add(n)
+
+    def add(self, node):
+        '''
+        Add the groups of node after the current position
+        '''
+        positions = self.groups[node]
+        for p in positions[bisect_right(positions, self.position):]:
+            if p not in self.queued:
+                self.queued.add(p)
+                heapq.heappush(self.heap, p)
+
+    def pop(self):
+        '''
+        Move to the next group of the frontier
+        Output:
+            position - position of the group, None if no group is left
+        '''
+        if not self.heap:
+            return None
+        self.position = heapq.heappop(self.heap)
+        self.queued.discard(self.position)
+        return self.position
+
+    def __len__(self):
+        return len(self.heap)
+
 def backfill_dates(dataset, end_date=None):
     '''
     Backfills missing datepoints in the adoption history, so that the generated 
@@ -13,15 +13,18 @@ Created by Hyojun Ada Lee, October 13, 2016
 import networkx as nx
 from networkx.readwrite import json_graph
 import json
+import hashlib
 import sys
 import random
 from copy import copy
 import numpy as np
 import os
+import shutil
 from copy import deepcopy
 import graph_tool.all as gt
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, deque
 from itertools import combinations
+import scipy.sparse as sparse
 
 ###Local###
 src_dir = os.path.abspath(os.path.join(os.pardir, os.pardir,'src'))
@@ -33,6 +36,8 @@ import gale.general.errors as gerr
 
 #Classes
 class Producers(object):
+    __slots__ = ('node_ID', 'type', 'belief', 'status', 'role', 'gender', 'movie_ids', 'index')
+
     def __init__(self):
         self.node_ID = None        #Last name
         self.type = 'P'
@@ -41,6 +46,7 @@ class Producers(object):
         self.role = [] #role of the producers, if the role has changed each movie
         self.gender = None #gender of the producers, 0: male, 1: female
         self.movie_ids = []
+        self.index = None #dense integer id, given by the ProducerRegistry
 
     def instantiate_belief(self, belief_type, b_threshold, seeds):
         '''
@@ -71,12 +77,70 @@ class Producers(object):
             gerr.generic_error_handler(message=m)
 
 class Movies(object):
+    __slots__ = ('node_ID', 'type', 'title', 'producers', 'year', 'producer_index')
+
     def __init__(self):  
         self.node_ID = None
         self.type = 'M'          
         self.title = None
         self.producers = None
         self.year = None
+        self.producer_index = [] #dense integer ids of the producers, from the ProducerRegistry
+
+
+class ProducerRegistry(object):
+    """
+    Producers by id, in the order they first appear, with every producer id interned
+    to a dense integer (its position), so the graph backends can use integer indices
+    and a returning producer is found in O(1)
+    """
+    def __init__(self):
+        self.producers = []
+        self.index = {}
+
+    @staticmethod
+    def key(entry):
+        """
+        Hashable form of a producer entry, lists become tuples
+        """
+        return tuple(entry) if isinstance(entry, list) else entry
+
+    def __len__(self):
+        return len(self.producers)
+
+    def __contains__(self, entry):
+        return self.key(entry) in self.index
+
+    def __getitem__(self, entry):
+        return self.producers[self.index[self.key(entry)]]
+
+    def __iter__(self):
+        return iter(self.producers)
+
+    def intern(self, entry):
+        """
+        Dense integer id of a registered producer
+        """
+        return self.index[self.key(entry)]
+
+    def add(self, producer):
+        """
+        Register a new Producers record, and give it the next integer id
+        """
+        key = self.key(producer.node_ID)
+        if key in self.index:
+            raise ValueError('producer {} is already registered'.format(producer.node_ID))
+        producer.index = len(self.producers)
+        self.index[key] = producer.index
+        self.producers.append(producer)
+        return producer
+
+    @property
+    def ids(self):
+        """
+        Producer ids, list position is the integer id
+        """
+        return [producer.node_ID for producer in self.producers]
 
 class ComplexEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -119,68 +183,64 @@ def generate_gender_seeds(df_gender, gender='female'):
     return list(set(df_gender[df_gender.gender == gender]._id.tolist()))
 
 #making attributes for synthetic
-def make_attribute_list(df_raw, seeds, belief_type, belief_threshold=1.0):
+def make_producer_registry(df_raw, seeds, belief_type, belief_threshold=1.0, roles=False):
     """
-    Making attribute dictionary: Shifts and Doctors
+    Making attribute records: movies and a ProducerRegistry of the producers
     Input:
         df_raw - DataFrame with freshly read data
+        seeds - list of initial adopters
         belief_type - string, what kind of belief 'empirical', 'empirical-random', 'apirori' + to be added
         belief_threshold - float 0-1
+        roles - keep the role of the [producer, role] entries of the real data in the producer records.
+                The entries are read with producer_id either way, so [producer, role] pairs and bare ids
+                give the same producer ids
     Output:
         movies - list of movie class (NODE)
-        producers - list of producer classes (NODE)
+        registry - ProducerRegistry of producer classes (NODE)
     """
     #drop movies if there are no producers
-    df = df_raw.copy(deep=True).dropna(subset=['producers'])
-    producer_ids = [] #producer id list
-    producers = [] #producer class list
+    df = df_raw.dropna(subset=['producers'])
+    registry = ProducerRegistry()
     movies = [] #movie class list
-    years = []
-    #Start of experiment date
-    exp_start_year = df['year'].iloc[0]
+    seeds = set(seeds)
 
     #get shifts as class
-    for i, row in df.iterrows():
-        #get list of producers for the movie
-        movie_producers = [i[0] for i in row['producers']] #get only producers ids, get rid of producer roles
+    for movie_id, year, row_producers in zip(df['_id'], df['year'], df['producers']):
         #add movies, assume that there are no duplicate movie rows
         movie = Movies()
-        movie_id = row['_id']
         movie.node_ID = movie_id
         movie.type = 'M'
-        movie.producers = movie_producers
-        movie.year = row['year']
-        movie.title = row['_id']
-        years.append(movie.year)
+        movie.producers = [producer_id(i) for i in row_producers] #get only producers ids, get rid of producer roles
+        movie.year = year
+        movie.title = movie_id
         movies.append(movie)
-        
 
-        for p in row['producers']:
-            #instiantiate producer if the producer is not already in the systme
-            if p not in producer_ids:
+        for entry in row_producers:
+            #the same producer id as ProjectedWindow, before any seed lookup
+            p = producer_id(entry)
+            if roles:
+                record = [entry[1], movie_id, year]
+            else:
+                record = [movie_id, year]
+            if p in registry:
+                #add the movie
+                producer = registry[p]
+            else:
+                #instiantiate producer if the producer is not already in the systme
                 producer = Producers()
                 producer.node_ID = p
                 producer.instantiate_belief(belief_type, belief_threshold, seeds)
                 producer.type='P'
-                producer.role.append([movie_id, movie.year])
-                producer.movie_ids.append(movie_id)
-                producer_ids.append(p)
-                producers.append(producer)
                 #assign gender, if in seeds, 1 (female), not in seeds, 0 (male)
-                if p in seeds:
-                    producer.gender=1
-                else:
-                    producer.gender=0
-            else:
-                #add the movie
-                for p_class in producers:
-                    if p_class.node_ID == p:
-                        p_class.role.append([movie_id, movie.year])
-                        p_class.movie_ids.append(movie_id)
-    return movies, producers
+                producer.gender = 1 if p in seeds else 0
+                registry.add(producer)
+            producer.role.append(record)
+            producer.movie_ids.append(movie_id)
+            if producer.index not in movie.producer_index:
+                movie.producer_index.append(producer.index)
+    return movies, registry
 
-#making attributes for real network
-def make_attribute_list_real(df_raw, seeds, belief_type, belief_threshold=1.0):
+def make_attribute_list(df_raw, seeds, belief_type, belief_threshold=1.0):
     """
     Making attribute dictionary: Shifts and Doctors
     Input:
@@ -191,58 +251,50 @@ def make_attribute_list_real(df_raw, seeds, belief_type, belief_threshold=1.0):
         movies - list of movie class (NODE)
         producers - list of producer classes (NODE)
     """
-    #drop movies if there are no producers
-    df = df_raw.copy(deep=True).dropna(subset=['producers'])
-    producer_ids = [] #producer id list
-    producers = [] #producer class list
-    movies = [] #movie class list
-    years = []
-    #Start of experiment date
-    exp_start_year = df['year'].iloc[0]
-
-    #get shifts as class
-    for i, row in df.iterrows():
-        #get list of producers for the movie
-        movie_producers = [i[0] for i in row['producers']] #get only producers ids, get rid of producer roles
-        #add movies, assume that there are no duplicate movie rows
-        movie = Movies()
-        movie_id = row['_id']
-        movie.node_ID = movie_id
-        movie.type = 'M'
-        movie.producers = movie_producers
-        movie.year = row['year']
-        movie.title = row['_id']
-        years.append(movie.year)
-        movies.append(movie)
-        
+    movies, registry = make_producer_registry(df_raw, seeds, belief_type, belief_threshold)
+    return movies, registry.producers
 
-        for p, role in row['producers']:
-            #instiantiate producer if the producer is not already in the systme
-            if p not in producer_ids:
-                producer = Producers()
-                producer.node_ID = p
-                producer.instantiate_belief(belief_type, belief_threshold, seeds)
-                producer.type='P'
-                producer.role.append([role, movie_id, movie.year])
-                producer.movie_ids.append(movie_id)
-                producer_ids.append(p)
-                producers.append(producer)
-                #assign gender, if in seeds, 1 (female), not in seeds, 0 (male)
-                if p in seeds:
-                    producer.gender=1
-                else:
-                    producer.gender=0
-            else:
-                #add the movie
-                for p_class in producers:
-                    if p_class.node_ID == p:
-                        p_class.role.append([role, movie_id, movie.year])
-                        p_class.movie_ids.append(movie_id)
-    return movies, producers
+#making attributes for real network
+def make_attribute_list_real(df_raw, seeds, belief_type, belief_threshold=1.0):
+    """
+    Making attribute dictionary: Shifts and Doctors, the producers come with their roles
+    Input:
+        df_raw - DataFrame with freshly read data
+        belief_type - string, what kind of belief 'empirical', 'empirical-random', 'apirori' + to be added
+        belief_threshold - float 0-1
+    Output:
+        movies - list of movie class (NODE)
+        producers - list of producer classes (NODE)
+    """
+    movies, registry = make_producer_registry(df_raw, seeds, belief_type, belief_threshold, roles=True)
+    return movies, registry.producers
 
 #########################
 #### Make schedules  ####
 #########################
+def movie_producer_edges(movies, producers):
+    """
+    Edges between the movie nodes and the producers, from the movies of each producer.
+    The movie nodes are numbered from 1 in the order of movies, as in build_temporal_network.
+    The edges come producer by producer, with the movies of a producer in node order,
+    so the neighbors of every node are in the same order as when each movie was tested
+    against every producer. O(number of edges)
+    input:
+        movies - list of movie classes, from make_attribute_list
+        producers - list of producer classes, from make_attribute_list
+    output:
+        edges - list of (movie node, producer id)
+    """
+    #movie id -> movie nodes, a movie id can be in more than one row
+    movie_nodes = defaultdict(list)
+    for _id, key in enumerate(movies, 1):
+        movie_nodes[key.node_ID].append(_id)
+    edges = []
+    for key in producers:
+        nodes = sorted(set(n for movie_id in key.movie_ids for n in movie_nodes.get(movie_id, ())))
+        edges.extend((n, key.node_ID) for n in nodes)
+    return edges
+
 def build_temporal_network(df_data, seeds, belief_type, b_threshold=1.0, plot_graph = False):
     """
     Create network between doctors and shifts
@@ -275,21 +327,360 @@ def build_temporal_network(df_data, seeds, belief_type, b_threshold=1.0, plot_gr
         G.add_node(key.node_ID, **att_dict)
 
     # Add edges - between movies and producers
-    # Look Here to see the edge connection 
-    for node1 in G.nodes():
-        if G.node[node1]['node_type'] =='M':
-            movie = G.node[node1]['movie_id']
-            for node2 in G.nodes():
-                if G.node[node2]['node_type'] == 'P':
-                    movies = G.node[node2]['movies']
-                    if movie in movies:
-                        G.add_edge(node1, node2) 
+    G.add_edges_from(movie_producer_edges(movies, producers))
     #Graph visualization, if chosen
     if plot_graph:
         plot_network(G)
     return G
 
 
+class BipartiteIncidence(object):
+    """
+    Movie - producer network as scipy.sparse incidence matrices, with the node attributes as columns.
+    The movies are the rows in play order (movie node row + 1 of build_temporal_network) and the
+    producers are the columns in the order of the ProducerRegistry. The contagion, projection and
+    statistics code can run on the arrays, networkx and graph-tool graphs are only built when asked.
+    """
+    def __init__(self, movie_ids, year, movie_producers, producer_ids, belief, status, gender, producer_movies=None):
+        '''
+        Input:
+            movie_ids - movie id of every row
+            year - year of every movie
+            movie_producers - scipy.sparse matrix, movies x producers, 1 where the producer made the movie
+            producer_ids - producer id of every column
+            belief - initial belief of every producer
+            status - initial status of every producer, True for the adopters
+            gender - gender of every producer, 0: male, 1: female
+            producer_movies - the transpose of movie_producers as a csr matrix, computed if not given
+        *Numeric columns that already have the right dtype are kept as they are, not copied,
+         so the memory mapped arrays of load_network_cache stay shared between processes
+        '''
+        self.movie_ids = self._object_column(movie_ids)
+        self.year = np.asarray(year, dtype=int)
+        self.producer_ids = self._object_column(producer_ids)
+        self.belief = np.asarray(belief, dtype=float)
+        self.status = np.asarray(status, dtype=bool)
+        self.gender = np.asarray(gender, dtype=int)
+        #movie -> producers, the producers of every movie in column order
+        self.movie_producers = sparse.csr_matrix(movie_producers)
+        self.movie_producers.sort_indices()
+        if self.movie_producers.shape != (len(self.movie_ids), len(self.producer_ids)):
+            raise ValueError('movie_producers is {}, expected {} movies x {} producers'.format(
+                self.movie_producers.shape, len(self.movie_ids), len(self.producer_ids)))
+        #producer -> movies, the csr of the transpose is the csc of movie_producers
+        if producer_movies is None:
+            producer_movies = self.movie_producers.T.tocsr()
+        self.producer_movies = sparse.csr_matrix(producer_movies)
+        self.producer_movies.sort_indices()
+
+    @staticmethod
+    def _object_column(values):
+        '''
+        1-d object array of ids, also when the ids are tuples
+        '''
+        values = list(values)
+        column = np.empty(len(values), dtype=object)
+        try:
+            column[:] = values
+        except ValueError:
+            #tuples of the same length would be read as a 2-d array
+            for k, value in enumerate(values):
+                column[k] = value
+        return column
+
+    @classmethod
+    def from_registry(cls, movies, registry):
+        """
+        Incidence of the records of make_producer_registry, with the edges of movie_producer_edges
+        """
+        rows = []
+        cols = []
+        for node, p in movie_producer_edges(movies, registry.producers):
+            rows.append(node - 1)
+            cols.append(registry.intern(p))
+        B = sparse.coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(movies), len(registry)))
+        producers = registry.producers
+        return cls([key.node_ID for key in movies], [int(key.year) for key in movies], B.tocsr(),
+                   registry.ids, [key.belief for key in producers],
+                   [key.status == 'Adopter' for key in producers], [key.gender for key in producers])
+
+    @classmethod
+    def from_dataframe(cls, df_raw, seeds, belief_type, belief_threshold=1.0):
+        """
+        Incidence of the movie dataframe, the same network as build_temporal_network
+        """
+        movies, registry = make_producer_registry(df_raw, seeds, belief_type, belief_threshold)
+        return cls.from_registry(movies, registry)
+
+    @property
+    def n_movies(self):
+        return len(self.movie_ids)
+
+    @property
+    def n_producers(self):
+        return len(self.producer_ids)
+
+    @property
+    def movie_degree(self):
+        '''
+        number of producers of every movie
+        '''
+        return np.diff(self.movie_producers.indptr)
+
+    @property
+    def producer_degree(self):
+        '''
+        number of movies of every producer
+        '''
+        return np.diff(self.producer_movies.indptr)
+
+    def producers_of(self, movie):
+        '''
+        producer indices of the movie in row movie
+        '''
+        B = self.movie_producers
+        return B.indices[B.indptr[movie]:B.indptr[movie + 1]]
+
+    def movies_of(self, producer):
+        '''
+        movie rows of the producer with index producer, in play order
+        '''
+        B = self.producer_movies
+        return B.indices[B.indptr[producer]:B.indptr[producer + 1]]
+
+    def projection(self, weight_type='none'):
+        '''
+        Weighted producer projection, see incidence_projection
+        Output:
+            A - scipy.sparse csr matrix, producers x producers
+        '''
+        return incidence_projection(self.movie_producers, self.year, weight_type)
+
+    def to_networkx(self):
+        '''
+        The graph of build_temporal_network: movie nodes numbered from 1, producer nodes by id,
+        the same attributes and the same neighbor order.
+        The 'producers' of a movie are its producer ids in producer order, and the 'movies' of a producer
+        have one entry per movie row
+        Output:
+            G - NX Graph Object
+        '''
+        G = nx.Graph()
+        year = self.year.tolist()
+        for _id, movie_id in enumerate(self.movie_ids, 1):
+            att_dict = {'movie_id':movie_id, 'node_type':'M', 'title':movie_id,
+                        'producers':self.producer_ids[self.producers_of(_id - 1)].tolist(), 'year':year[_id - 1]}
+            G.add_node(_id, **att_dict)
+
+        edges = []
+        for k, p in enumerate(self.producer_ids):
+            G.add_node(p, **self.producer_attributes(k))
+            edges.extend((i + 1, p) for i in self.movies_of(k).tolist())
+        #producer by producer, as movie_producer_edges
+        G.add_edges_from(edges)
+        return G
+
+    def producer_attributes(self, producer):
+        '''
+        node attribute dictionary of the producer with index producer, as in build_temporal_network
+        '''
+        rows = self.movies_of(producer).tolist()
+        return {'node_type':'P', 'belief':float(self.belief[producer]),
+                'status':'Adopter' if self.status[producer] else 'NonAdopter',
+                'movies':[self.movie_ids[i] for i in rows], 'roles':[[self.movie_ids[i], int(self.year[i])] for i in rows],
+                'gender':int(self.gender[producer])}
+
+    def to_graph_tool(self):
+        '''
+        graph-tool Graph of the network, the movies are the vertices 0 to n_movies - 1 and the producers follow.
+        The columns are vertex properties, the year is -1 and belief, status and gender are 0 on the movies
+        Output:
+            g - graph_tool Graph
+        '''
+        g = gt.Graph(directed=False)
+        g.add_vertex(self.n_movies + self.n_producers)
+        B = self.producer_movies.tocoo()
+        g.add_edge_list(np.column_stack([B.col, B.row + self.n_movies]))
+
+        node_type = g.new_vertex_property('string')
+        node_id = g.new_vertex_property('object')
+        for v, movie_id in enumerate(self.movie_ids):
+            node_type[g.vertex(v)] = 'M'
+            node_id[g.vertex(v)] = movie_id
+        for v, p in enumerate(self.producer_ids, self.n_movies):
+            node_type[g.vertex(v)] = 'P'
+            node_id[g.vertex(v)] = p
+        g.vertex_properties['node_type'] = node_type
+        g.vertex_properties['node_id'] = node_id
+        for name, value_type, movie_values, producer_values in [
+                ('year', 'int', self.year, np.full(self.n_producers, -1)),
+                ('belief', 'double', np.zeros(self.n_movies), self.belief),
+                ('status', 'bool', np.zeros(self.n_movies), self.status),
+                ('gender', 'int', np.zeros(self.n_movies), self.gender)]:
+            prop = g.new_vertex_property(value_type)
+            prop.a = np.concatenate([movie_values, producer_values])
+            g.vertex_properties[name] = prop
+        return g
+
+def build_temporal_incidence(df_data, seeds, belief_type, b_threshold=1.0):
+    """
+    Movie - producer network of build_temporal_network as a BipartiteIncidence, without networkx
+    input:
+        df_data - DataFrame, movie data
+        seeds - list of initial adopters
+        belief_type: Way to generate belief value.
+                     choices are: empirical, random, apriori
+    output:
+        incidence - BipartiteIncidence of the network
+    """
+    return BipartiteIncidence.from_dataframe(df_data, seeds, belief_type, b_threshold)
+
+
+#########################
+#### Network cache   ####
+#########################
+NETWORK_CACHE_VERSION = 1
+
+def dataset_fingerprint(df, seeds=()):
+    """
+    Fingerprint of the movie data a network is built from: the id, year and producers of every movie, and the seeds
+    Input:
+        df - DataFrame of all the movies, before the time window is taken
+        seeds - list of initial adopters
+    Output:
+        fingerprint - hex string of the sha1 digest
+    """
+    digest = hashlib.sha1()
+    for movie_id, year, producers in zip(df['_id'], df['year'], df['producers']):
+        digest.update(repr((movie_id, year, producers)).encode('utf-8'))
+    digest.update(repr(sorted(seeds, key=repr)).encode('utf-8'))
+    return digest.hexdigest()
+
+def network_cache_path(cache_dir, fingerprint, start_year, end_year, belief_type, b_threshold=1.0, seed=None):
+    """
+    Folder of the cached network of one key
+    Input:
+        fingerprint - dataset_fingerprint of the movie data
+        start_year, end_year - time window of the movies
+        belief_type, b_threshold - how the initial beliefs are made
+        seed - seed of the shuffle of the movies, None for the movies in year order, a list for [master seed, n]
+    """
+    if isinstance(seed, (list, tuple)):
+        seed = '-'.join(str(s) for s in seed)
+    name = '_'.join(['network', str(start_year), str(end_year), belief_type, str(b_threshold),
+                     'seed{}'.format(seed), fingerprint[:16]])
+    return os.path.join(os.path.abspath(cache_dir), name)
+
+def _id_column(ids):
+    '''
+    ids as a fixed width string or integer array, so they can be memory mapped
+    '''
+    column = np.array(list(ids))
+    if column.ndim != 1 or column.dtype.kind not in 'UiS':
+        raise ValueError('only string or integer ids can be cached, got {}'.format(column.dtype))
+    return column
+
+def save_network_cache(incidence, path, **key):
+    """
+    Write the BipartiteIncidence as one .npy file per column, so load_network_cache can memory map them.
+    The files are written to a temporary folder that is renamed at the end, so the jobs that read
+    the cache never see half a network. When another job wrote the same key first, its copy is kept,
+    a cache of an older version at path is replaced
+    Input:
+        incidence - BipartiteIncidence
+        path - folder of the cache, see network_cache_path
+        key - parameters of the network, saved in meta.json to check the cache against
+    Output:
+        path - folder of the cache
+    """
+    B = incidence.movie_producers
+    T = incidence.producer_movies
+    columns = {'movie_ids':_id_column(incidence.movie_ids), 'year':incidence.year,
+               'indptr':B.indptr, 'indices':B.indices, 'data':B.data,
+               'producer_indptr':T.indptr, 'producer_indices':T.indices, 'producer_data':T.data,
+               'producer_ids':_id_column(incidence.producer_ids), 'belief':incidence.belief,
+               'status':incidence.status, 'gender':incidence.gender}
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    os.makedirs(tmp_path)
+    for name, column in columns.items():
+        np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(column))
+    meta = {'version':NETWORK_CACHE_VERSION, 'n_movies':incidence.n_movies, 'n_producers':incidence.n_producers,
+            'key':key}
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    try:
+        os.rename(tmp_path, path)
+        return path
+    except OSError:
+        pass
+    if load_network_cache(path) is None:
+        #a cache of an older version, moved aside before the new one takes its place
+        stale_path = '{}.stale{}'.format(path, os.getpid())
+        try:
+            os.rename(path, stale_path)
+            os.rename(tmp_path, path)
+        except OSError:
+            #another job replaced it first
+            pass
+        shutil.rmtree(stale_path, ignore_errors=True)
+    #another job saved the same network first
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    return path
+
+def load_network_cache(path, mmap_mode='r'):
+    """
+    Open a network written by save_network_cache. The numeric columns and the csr arrays are memory mapped
+    read only, so the jobs on one node share the same pages and nothing is read until it is used
+    Input:
+        path - folder of the cache
+        mmap_mode - mode of np.load, None reads the arrays into memory
+    Output:
+        incidence - BipartiteIncidence, None if there is no cache of the current version at path
+    """
+    meta_file = os.path.join(path, 'meta.json')
+    if not os.path.isfile(meta_file):
+        return None
+    with open(meta_file) as f:
+        meta = json.load(f)
+    if meta['version'] != NETWORK_CACHE_VERSION:
+        return None
+    column = lambda name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+    n_movies, n_producers = meta['n_movies'], meta['n_producers']
+    B = sparse.csr_matrix((column('data'), column('indices'), column('indptr')), shape=(n_movies, n_producers))
+    T = sparse.csr_matrix((column('producer_data'), column('producer_indices'), column('producer_indptr')),
+                          shape=(n_producers, n_movies))
+    return BipartiteIncidence(column('movie_ids').tolist(), column('year'), B, column('producer_ids').tolist(),
+                              column('belief'), column('status'), column('gender'), producer_movies=T)
+
+def cached_temporal_incidence(cache_dir, fingerprint, df_data, seeds, belief_type, b_threshold=1.0,
+                              start_year=None, end_year=None, seed=None):
+    """
+    build_temporal_incidence through the network cache: the cached network of the key is opened
+    if there is one, otherwise the network is built and saved for the next jobs
+    Input:
+        cache_dir - folder of the network cache
+        fingerprint - dataset_fingerprint of the movie data
+        df_data - DataFrame, movies of the time window, in the order they are played
+        seeds, belief_type, b_threshold - see build_temporal_incidence
+        start_year, end_year - time window of df_data
+        seed - seed of the shuffle that gave df_data, None for the movies in year order
+    Output:
+        incidence - BipartiteIncidence
+    """
+    key = {'fingerprint':fingerprint, 'start_year':start_year, 'end_year':end_year, 'belief_type':belief_type,
+           'b_threshold':b_threshold, 'seed':seed}
+    path = network_cache_path(cache_dir, fingerprint, start_year, end_year, belief_type, b_threshold, seed)
+    incidence = load_network_cache(path)
+    if incidence is not None:
+        return incidence
+    incidence = build_temporal_incidence(df_data, seeds, belief_type, b_threshold)
+    os.makedirs(cache_dir, exist_ok=True)
+    save_network_cache(incidence, path, **key)
+    cached = load_network_cache(path)
+    #the network that was just built if the cache could not be written
+    return incidence if cached is None else cached
+
+
 def build_projected_network(df, seeds, belief_type, threshold):
     """
     Create projected temporal network between doctors and shifts
@@ -301,6 +692,7 @@ def build_projected_network(df, seeds, belief_type, threshold):
         threshold - belief status threshold. Use to generate the initial adoption state
     output:
         G - NX graph object
+    *one edge per pair of producers of every movie, build_compact_projection keeps one entry per pair
     """
     movies, producers = make_attribute_list(df, seeds, belief_type, threshold)
 
@@ -317,199 +709,361 @@ def build_projected_network(df, seeds, belief_type, threshold):
         for p1, p2 in combinations(producers, 2):
             G.add_edge(p1, p2, **att_dict)
     return G
-    
-######################## From old code look at 
-def plot_network(G, wfname = '../../result/networks/shift_doctor_network_graph.eps'):
-    '''
-    Makes a networkx plot fo the network
-    '''
-    plt.figure(figsize=(12, 12))
-    
-    
-    #Step1: Get the list of the graph:
-    nodeTypeS = []
-    nodeTypeDA = []
-    nodeTypeDF = []
-    for node in G.nodes():
-        if G.node[node]['nodeType'] == 'S':
-            nodeTypeS.append(node)
-        if G.node[node]['nodeType'] == 'D':
-            if G.node[node]['docType'] == 'F':
-                nodeTypeDF.append(node)
-            if G.node[node]['docType'] == 'A':
-                nodeTypeDA.append(node)
-    pos = nx.spring_layout(G)
-    
-    #Step2: Draw the nodes
-    nx.draw_networkx_nodes(G, pos, nodelist = nodeTypeS, node_color = 'r', \
-                           node_size = 100)
-    nx.draw_networkx_nodes(G, pos, nodelist = nodeTypeDA, node_color = 'b', \
-                           node_size = 100)
-    nx.draw_networkx_nodes(G, pos, nodelist = nodeTypeDF, node_color = 'g', \
-                          node_size = 100)
-    #Step3: Draw the edges
-    edge_list = G.edges()
-    nx.draw_networkx_edges(G, pos, edgelist = edge_list, width = 1.0)
-    #Step4: Node labels:
-    label_dic = {}
-    for node in G.nodes():
-        if G.node[node]['nodeType'] == 'D':
-            label_dic[node] = node
-#         if G.node[node]['nodeType'] == 'S':
-#             label_dic[node] = str(G.node[node]['startDate']) + '-' + str(G.node[node]['team'])
-    
-    nx.draw_networkx_labels(G, pos, labels = label_dic, font_size = 10)
-    plt.savefig(wfname)
-    plt.show()
-
-
-def datetime_to_string_json(G):
-    """
-    for json.dump, change the datetime to datetime_to_string_json
-    """
-    for node in G.nodes():
-        if G.node[node]['node_type'] == 'S':
-            startDate = str(G.node[node]['start_date'])
-            G.node[node]['start_date'] = startDate
-    return G
 
+class ProducerProjection(object):
+    """
+    Compact producer projection of a BipartiteIncidence. Instead of one MultiGraph edge with an
+    attribute dictionary for every pair of producers of every movie, it keeps one entry per pair
+    of producers that made a movie together: the number of movies together, the first and last
+    year and the number of distinct years. The movie rows of every pair are kept only when asked.
+    The MultiGraph of build_projected_network is only built by to_multigraph.
+    """
+    def __init__(self, incidence, movies=False):
+        '''
+        Input:
+            incidence - BipartiteIncidence of the movie network
+            movies - keep the movie rows of every pair, see movies_of
+        '''
+        self.incidence = incidence
+        B = incidence.movie_producers
+        n = incidence.n_producers
+        #movies together of every pair, the upper triangle of B^T B
+        A = sparse.triu(B.T.dot(B), k=1).tocsr()
+        A.sort_indices()
+        #pairs (row, col) with row < col, in row major order
+        self.row = np.repeat(np.arange(n), np.diff(A.indptr))
+        self.col = A.indices.astype(int)
+        self.count = np.rint(A.data).astype(int)
+        key = self.row.astype(np.int64)*n + self.col
 
-def save_network(G, sched_type, sched_ver, result_dir = "../../result/networks/"):
-    '''
-    Saves the networkx graph object as a json file
-    Input:
-        G - networkx graph object
-        sched_type - string, heuristic or random, False - if it is real schedule
-        sched_ver - string, schedule version, so graph correlates with the schedule
-        result_dir - string, result directory
-    '''
-    new_G = datetime_to_string_json(G)
-    file_name = 'movie_producer_network_{}_{}.json'.format(sched_type, sched_ver)
-    wfname = os.path.join(result_dir, file_name)
-    with open(wfname, 'w') as outfile:
-        json.dump(new_G.nodes(data=True), outfile, cls=ComplexEncoder)
+        #first and last year, and years together, from the projection of every year
+        self.first_year = np.zeros(len(key), dtype=int)
+        self.last_year = np.zeros(len(key), dtype=int)
+        self.years = np.zeros(len(key), dtype=int)
+        for year in np.unique(incidence.year):
+            B_year = B[np.nonzero(incidence.year == year)[0]]
+            A_year = sparse.triu(B_year.T.dot(B_year), k=1).tocoo()
+            position = np.searchsorted(key, A_year.row.astype(np.int64)*n + A_year.col)
+            self.first_year[position[self.years[position] == 0]] = year
+            self.last_year[position] = year
+            self.years[position] += 1
 
+        #movie rows of the pair k are pair_movies[movie_ptr[k]:movie_ptr[k] + count[k]]
+        self.movie_ptr = None
+        self.pair_movies = None
+        if movies:
+            self.movie_ptr = np.concatenate([[0], np.cumsum(self.count)[:-1]]).astype(int)
+            self.pair_movies = self._pair_movies(B, n)
 
+    @staticmethod
+    def _pair_movies(B, n):
+        '''
+        movie rows of every pair, grouped by pair in row major order and in play order inside a pair
+        '''
+        entry_movie = np.repeat(np.arange(B.shape[0]), np.diff(B.indptr))
+        #every entry is paired with the entries after it in its row
+        partners = B.indptr[entry_movie + 1] - np.arange(len(B.indices)) - 1
+        first = np.repeat(np.arange(len(B.indices)), partners)
+        offset = np.arange(len(first)) - np.repeat(np.cumsum(partners) - partners, partners)
+        second = first + 1 + offset
+        key = B.indices[first].astype(np.int64)*n + B.indices[second]
+        return entry_movie[first][np.argsort(key, kind='mergesort')]
+
+    @classmethod
+    def from_dataframe(cls, df, seeds, belief_type, threshold, movies=False):
+        """
+        Projection of the movie dataframe, the producers of build_projected_network
+        """
+        return cls(BipartiteIncidence.from_dataframe(df, seeds, belief_type, threshold), movies)
+
+    def __len__(self):
+        return len(self.row)
+
+    @property
+    def producer_ids(self):
+        return self.incidence.producer_ids
+
+    def movies_of(self, pair):
+        '''
+        movie rows of the incidence where the k-th pair made a movie together
+        '''
+        if self.pair_movies is None:
+            raise ValueError('the movies of the pairs are not kept, use movies=True')
+        start = self.movie_ptr[pair]
+        return self.pair_movies[start:start + self.count[pair]]
+
+    def adjacency(self, weight_type='none'):
+        '''
+        Weighted adjacency of the producers, the same as incidence_projection
+        Output:
+            A - scipy.sparse csr matrix, producers x producers
+        '''
+        weights = {'none':np.ones(len(self)), 'shifts':self.count, 'movies':self.count, 'years':self.years}
+        if weight_type == 'days':
+            raise ValueError("the movies have no days, 'years' counts the years a pair made movies together")
+        if weight_type not in weights:
+            raise ValueError("`weight_type` must be one of: {}".format(", ".join(weights)))
+        n = self.incidence.n_producers
+        w = np.asarray(weights[weight_type], dtype=float)
+        return sparse.csr_matrix((np.append(w, w), (np.append(self.row, self.col), np.append(self.col, self.row))),
+                                 shape=(n, n))
+
+    def to_graph(self):
+        '''
+        networkx Graph with one edge per pair, the columns are the edge attributes
+        '''
+        G = nx.Graph()
+        for k, p in enumerate(self.producer_ids):
+            G.add_node(p, **self.incidence.producer_attributes(k))
+        ids = self.producer_ids
+        G.add_edges_from((ids[r], ids[c], {'count':count, 'first_year':first, 'last_year':last, 'years':years})
+                         for r, c, count, first, last, years in zip(self.row.tolist(), self.col.tolist(),
+                         self.count.tolist(), self.first_year.tolist(), self.last_year.tolist(), self.years.tolist()))
+        return G
 
-#make bipartite network using graph_tools
-def make_graph(movie_producer_dict):
+    def to_multigraph(self):
+        '''
+        The MultiGraph of build_projected_network, one edge per movie of every pair, movie by movie
+        with the producers of a movie in producer order
+        '''
+        incidence = self.incidence
+        G = nx.MultiGraph()
+        for k, p in enumerate(self.producer_ids):
+            G.add_node(p, **incidence.producer_attributes(k))
+        for i, movie_id in enumerate(incidence.movie_ids):
+            att_dict = {'movie_id':movie_id, 'title':movie_id, 'year':int(incidence.year[i])}
+            for p1, p2 in combinations(incidence.producer_ids[incidence.producers_of(i)].tolist(), 2):
+                G.add_edge(p1, p2, **att_dict)
+        return G
+
+def build_compact_projection(df, seeds, belief_type, threshold, movies=False):
     """
-    Transform movie documents into a bipartite producer-movie netowrk with M moveis and P producers
-    Input:
-        movie dictionary: {movie_id:{title, producer_list, year, }}
-    Output:
-        movie graph
-        nodes 0,...,M-1 Movie nodes
-        nodes M,....,M+P-1 Producer nodes
-    Vertex properties
-        - 'id' id of the movies or producers
-        - 'kind', 0 for movies, and 1 for producers
-    Edge properties 
-        - 'year' year for when the connection was made
-    """
-
-    M = len(set(movie_producer_dict.keys()))
-    #make a graph
-    g = gt.Graph(directed=False)
-    #define node properties
-    #id
-    prop_id = g.vp['name'] = g.new_vertex_property("string")
-    #bipartite group
-    prop_kind = g.vp['kind'] = g.new_vertex_property("int")
-    #edge property
-    prop_edge = g.ep['year'] = g.new_edge_property("int")
-
-    #add vertex dictionary
-    movie_add = defaultdict(lambda: g.add_vertex())
-    producer_add = defaultdict(lambda:g.add_vertex())
-    
-    #add all movies and producers as nodes
-    for _id, movie_dict in movie_producer_dict.items():
-        title = movie_dict['title']
-        #vertex
-        m = movie_add[_id]
-    #add all movies and producers as nodes
-    for _id, movie_dict in movie_producer_dict.items():
-        title = movie_dict['title']
-        producers = [lst[0] for lst in movie_dict['producers']]
-        year = movie_dict['year']
-        #vertex
-        m = movie_add[_id]
-        #property
-        prop_id[m] = _id
-        prop_kind[m] = 0
-        for producer in producers:
-            p = producer_add[producer]
-            prop_id[p] = producer
-            prop_kind[p] = 1
-            e = g.add_edge(m, p)
-            prop_edge[e] = year
-    return g
-
-def get_P(g):
-    '''
-    return number of producer-nodes == types
-    '''
-    return int(np.sum(g.vp['kind'].a==1)) # no. of types
-def get_M(g):
-    '''
-    return number of movie-nodes == number of documents
-    '''
-    return int(np.sum(g.vp['kind'].a==0)) # no. of types
-def get_E(g):
-    '''
-    return number of edges == tokens
-    '''
-    return int(g.num_edges()) # no. of types
+    Projected network of build_projected_network as a ProducerProjection, one entry per pair of producers
+    input:
+        df - DataFrame, movie data
+        seeds - list of initial adopters
+        belief_type - way to generate initial belief value.
+                    choices: empirical, random, apriori
+        threshold - belief status threshold. Use to generate the initial adoption state
+        movies - keep the movie rows of every pair
+    output:
+        projection - ProducerProjection
+    """
+    return ProducerProjection.from_dataframe(df, seeds, belief_type, threshold, movies)
 
+def producer_id(entry):
+    """
+    producer id of an entry of the producers column, [id, role] for the real data and id for the synthetic data
+    """
+    if isinstance(entry, (list, tuple)):
+        return entry[0]
+    return entry
 
-def sbm_fit(g, overlap=False):
-    '''
-    Infer the block structure of the bipartite word-document network.
-    Default: a hierarchical, nonoverlapping blockmodel.
-    IN:
-    - g, graph, see make_graph
-    OUT:
-    - result dictionary with groups, partitions, and prodperie
-    '''
+def initial_beliefs(producer_ids, seeds, belief_type, threshold):
+    """
+    Initial beliefs of the producers, the same as Producers.instantiate_belief
+    Input:
+        producer_ids - list of producer ids
+        seeds - list of initial adopters
+        belief_type - 'empirical', 'empirical-random'
+        threshold - belief threshold
+    Output:
+        belief - array of beliefs, in the order of producer_ids
+    """
+    seeds = set(seeds)
+    belief = np.empty(len(producer_ids), dtype=float)
+    for k, p in enumerate(producer_ids):
+        producer = Producers()
+        producer.node_ID = p
+        producer.instantiate_belief(belief_type, threshold, seeds)
+        belief[k] = producer.belief
+    return belief
 
-    #vertex property map to ensure that words and documents are not clustered together
+class ProjectedWindow(object):
+    """
+    Projected producer network of the movies inside a time window.
+    Instead of building a new MultiGraph for every window, the cliques of the incoming movies
+    are added and the ones of the outgoing movies are dropped. The producers are integer
+    indices into producer_ids, so the beliefs can stay in one array over the whole run.
+    """
+    def __init__(self, producer_ids):
+        '''
+        Input:
+            producer_ids - every producer that can come into the window, list position is the producer index
+        '''
+        self.producer_ids = list(producer_ids)
+        self.index = {p:k for k, p in enumerate(self.producer_ids)}
+        #number of movies in the window each pair of producers made together
+        self.pair_count = [Counter() for _ in self.producer_ids]
+        #number of movies in the window of each producer
+        self.movie_count = np.zeros(len(self.producer_ids), dtype=int)
+        #(team, time, days) of the movies in the window, oldest first
+        self.movies = deque()
+        #weighted projections of the current window, by weight type
+        self.projections = {}
+        #changes every time the window moves
+        self.version = 0
 
-    clabel = g.vp['kind']
+    @classmethod
+    def from_dataframe(cls, df):
+        '''
+        Window over the producers of the movie dataframe, in the order they first appear
+        '''
+        producer_ids = []
+        seen = set()
+        for producers in df['producers']:
+            if not isinstance(producers, list):
+                continue
+            for entry in producers:
+                p = producer_id(entry)
+                if p not in seen:
+                    seen.add(p)
+                    producer_ids.append(p)
+        return cls(producer_ids)
 
-    # inferecne 
-    state = gt.minimize_blockmodel_dl(g, deg_corr=True, overlap=False, state_args={'clabel':clabel, 'pclabel':clabel})
+    def teams(self, df, time_column='year', days_column='Days'):
+        '''
+        Producer indices of every movie of df, computed once so the windows can reuse them
+        Input:
+            df - movie dataframe
+            time_column - column with the time of the movie, used by the 'years' weights
+            days_column - column with the length of the shift, used by the 'days' weights
+        Output:
+            teams - dict {df index: (list of producer indices, time, days)}
+        '''
+        times = df[time_column] if time_column in df else [None]*len(df)
+        days = df[days_column] if days_column in df else [None]*len(df)
+        teams = {}
+        for i, producers, time, n_days in zip(df.index, df['producers'], times, days):
+            if not isinstance(producers, list):
+                producers = []
+            team = []
+            for entry in producers:
+                k = self.index[producer_id(entry)]
+                if k not in team:
+                    team.append(k)
+            teams[i] = (team, time, n_days)
+        return teams
 
-    #collect all the results
-    result = {}
-    result['state'] = state
-    result['mdl'] = state.entropy()
+    def add_movie(self, team, time=None, days=None):
+        '''
+        Add the clique of one movie, team is the list of producer indices
+        '''
+        for k in team:
+            self.movie_count[k] += 1
+        for k1, k2 in combinations(team, 2):
+            self.pair_count[k1][k2] += 1
+            self.pair_count[k2][k1] += 1
+        self.movies.append((team, time, days))
+        self.projections = {}
+        self.version += 1
 
-    # keep the list of movies and producers
-    movies = [g.vp['name'][v] for v in g.vertices() if g.vp['kind'][v]==0]
-    producers = [g.vp['name'][v] for v in g.vertices() if g.vp['kind'][v]==1]
+    def drop_movie(self):
+        '''
+        Drop the clique of the oldest movie in the window
+        '''
+        team = self.movies.popleft()[0]
+        self.projections = {}
+        self.version += 1
+        for k in team:
+            self.movie_count[k] -= 1
+        for k1, k2 in combinations(team, 2):
+            for a, b in ((k1, k2), (k2, k1)):
+                self.pair_count[a][b] -= 1
+                if not self.pair_count[a][b]:
+                    del self.pair_count[a][b]
+        return team
 
-    result['movies'] = movies
-    result['producers'] = producers
+    def slide(self, movies, n_drop=None):
+        '''
+        Drop the n_drop oldest movies (all of them by default) and add the new ones
+        Input:
+            movies - (team, time, days) of the new movies, values of teams()
+        '''
+        if n_drop is None:
+            n_drop = len(self.movies)
+        for _ in range(n_drop):
+            self.drop_movie()
+        for movie in movies:
+            self.add_movie(*movie)
+        return self
 
-    P = get_P(g) #get producer numbers
-    M = get_M(g) #get movie numbers
-    E = get_E(g) #get edge numbers
+    def nodes(self):
+        '''
+        producer indices with at least one movie in the window
+        '''
+        return np.nonzero(self.movie_count)[0].tolist()
 
-    #get the group membership statistics
-    L = len(state.levels)
-    result['L'] = L
+    def neighbors(self, k):
+        return list(self.pair_count[k])
 
-    dict_stats_groups={}
-    #martin what is this?
-    #for each level in the hierachy we make a dictionary with the node-group statistics
-    #e.g. group-membership
-    # we omit the highest level in the hierarchy as there will be no more distinction between 
-    # movie and producer groups
+    def adjacency(self, weight_type='none'):
+        '''
+        Weighted adjacency of the window over all the producers, see weighted_projection.
+        It is kept until the window moves, so every run on the same window shares it
+        Output:
+            A - scipy.sparse csr matrix, producers x producers
+        '''
+        if weight_type not in self.projections:
+            self.projections[weight_type] = weighted_projection(self.movies, len(self.producer_ids), weight_type)
+        return self.projections[weight_type]
 
-    for l in range(L-1):
-        dict_stats_groups_l = get_groups(state,g,l=1)
-        dict_stats_groups[l] = dict_stats_groups_l
-    result['stats_groups'] = dict_stats_gropus
+def weighted_projection(movies, n_producers, weight_type='none'):
+    """
+    Producer projection of the movie - producer incidence B in one sparse product, B^T B without the diagonal
+    Input:
+        movies - list of (team, time, days), team is the list of producer indices of the movie
+        n_producers - number of producers
+        weight_type - 'none' for 1 per pair,
+                      'shifts' or 'movies' for the number of movies together,
+                      'days' for the sum of the days of the shifts together, as calculate_weight,
+                      'years' for the number of distinct times (i.e. years) together
+    Output:
+        A - scipy.sparse csr matrix, producers x producers
+    """
+    movies = list(movies)
+    teams = [movie[0] for movie in movies]
+    indptr = np.cumsum([0] + [len(team) for team in teams])
+    indices = np.array([k for team in teams for k in team], dtype=int)
+    B = sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(teams), n_producers))
+    days = [movie[2] for movie in movies] if weight_type == 'days' else None
+    return incidence_projection(B, [movie[1] for movie in movies], weight_type, days)
 
-    return result
\ No newline at end of file
+def incidence_projection(B, times=None, weight_type='none', days=None):
+    """
+    Producer projection of a movie - producer incidence matrix, B^T B without the diagonal
+    Input:
+        B - scipy.sparse csr matrix, movies x producers, 1 where the producer made the movie
+        times - time (i.e. year) of every movie, only used by 'years'
+        weight_type - see weighted_projection
+        days - days of every movie (i.e. the Days of a shift), only used by 'days'
+    Output:
+        A - scipy.sparse csr matrix, producers x producers
+    """
+    valid = {'none', 'shifts', 'movies', 'days', 'years'}
+    if weight_type not in valid:
+        raise ValueError("`weight_type` must be one of: {}".format(", ".join(valid)))
+    n_producers = B.shape[1]
+    if weight_type == 'days':
+        if days is None or any(x is None for x in days):
+            raise ValueError("'days' weights need the days of every movie")
+        #every movie counts its days, B^T diag(days) B
+        A = B.T.dot(sparse.diags(np.asarray(days, dtype=float)).dot(B))
+    elif weight_type == 'years':
+        #one projection per time, every pair counts once per time
+        rows = defaultdict(list)
+        for i, time in enumerate(times):
+            rows[time].append(i)
+        A = sparse.csr_matrix((n_producers, n_producers))
+        for time_rows in rows.values():
+            B_time = B[time_rows]
+            A_time = B_time.T.dot(B_time).tocsr()
+            A_time.data[:] = 1.0
+            A = A + A_time
+    else:
+        A = B.T.dot(B)
+    A = (A - sparse.diags(A.diagonal())).tocsr()
+    A.eliminate_zeros()
+    if weight_type == 'none':
+        A.data[:] = 1.0
+    return A
@@ -1,8 +1,10 @@
 from os import listdir
 from os.path import isfile, join
 import re
+import numpy as np
 import pandas as pd
 import os
+from common.stats import StreamingSummary
 
 def get_parameters(file_names):
     """
@@ -17,26 +19,67 @@ def get_parameters(file_names):
     param_list = list(set(param_list))
     return param_list
 
-def read_raw_files_w_parameter(result_dir, param,N=1):
+def iter_raw_files_w_parameter(result_dir, param, N=1, ver=None):
     '''
-    read files with the given parameter divided by N, either 1 or total number of players
+    read files with the given parameter one at a time, divided by N, either 1 or total number of players
+    Input:
+        ver - version to read first, e.g. '0' for the files with ver_0
+    Output:
+        generator of (version, dataframe) with the columns as they are saved
     '''
-    df_list = []
     file_names = [join(result_dir, f) for f in listdir(result_dir) if isfile(join(result_dir, f))]
     file_param = [fs for fs in file_names if param in fs]
     v = re.compile(r'ver_[0-9]+')
+    if ver is not None:
+        #stable sort, so only the files of the given version move to the front
+        file_param.sort(key=lambda fs: v.search(fs).group() != 'ver_{}'.format(ver))
     for fs in file_param:
-        df = pd.read_json(fs, orient='split')
-        ver = v.search(fs).group()
-        df.name = ver
+        if fs.endswith('.csv'):
+            df = read_replicate_csv(fs)
+        else:
+            df = pd.read_json(fs, orient='split')
         #divide df by N except for the year column
         df.loc[:,df.columns != 'year'] = df.loc[:,df.columns != 'year']/N
+        yield v.search(fs).group(), df
+
+def read_raw_files_w_parameter(result_dir, param,N=1):
+    '''
+    read files with the given parameter divided by N, either 1 or total number of players
+    '''
+    df_list = []
+    for ver, df in iter_raw_files_w_parameter(result_dir, param, N):
+        df.name = ver
         #rename columns to drop duplicate columns
         rename_col = {col:'{}_{}'.format(col, ver) for col in df.columns}
         df = df.rename(columns=rename_col)
         df_list.append(df)
     return df_list
 
+def summarize_files_w_parameter(result_dir, param, N=1, ver=None, quantiles=(0.025, 0.5, 0.975)):
+    '''
+    summary of the replicates of every file with the given parameter, read one file at a time
+    so only one file is in memory, instead of all of them as with read_raw_files_w_parameter
+    Input:
+        ver - version whose years the other files are checked against, otherwise the first file read
+        quantiles - quantiles to keep track of
+    Output:
+        summary - common.stats.StreamingSummary over every replicate column, of the counts divided by N
+        year - series of the years, indexed by movie_order
+    '''
+    summary = None
+    year = None
+    #the summary keeps a histogram of the counts, so the files are read undivided and the summary divides by N
+    for file_ver, df in iter_raw_files_w_parameter(result_dir, param, 1, ver):
+        if summary is None:
+            summary = StreamingSummary(len(df), quantiles, divisor=N)
+            year = df['year']
+        elif not (df.index.equals(year.index) and np.array_equal(df['year'].values, year.values)):
+            raise ValueError('years of {} do not line up'.format(file_ver))
+        summary.update(df.loc[:, df.columns != 'year'].values)
+    if summary is None:
+        raise ValueError('no files with parameter {}'.format(param))
+    return summary, year
+
 def read_mean_files_w_parameter(result_dir, param):
     '''
     read files with the given parameter
@@ -51,4 +94,19 @@ def read_mean_files_w_parameter(result_dir, param):
         raise ValueError('Multiple files exist files for the mean')
 
     return df
-    
\ No newline at end of file
+    
+def read_history_csv(path):
+    '''
+    read the adopter history written by saver.HistoryWriter, indexed by its first column
+    '''
+    return pd.read_csv(path, index_col=0)
+
+def read_replicate_csv(path):
+    '''
+    read the replicates written by saver.replicate_history_writer in the layout of the json results:
+    indexed by movie_order, with the year and one column per replicate
+    '''
+    df = pd.read_csv(path, index_col=0).T
+    df.index = pd.Index(df.index.astype(int), name='movie_order')
+    df.columns = ['year'] + ['{}'.format(c) for c in df.columns[1:]]
+    return df
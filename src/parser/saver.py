@@ -1,6 +1,9 @@
 import os
 import contextlib
 import errno
+import json
+import numpy as np
+import pandas as pd
 
 
 
@@ -78,3 +81,276 @@ def save_file_csv(df, root, fname_primer, parameter_dictionary):
     
     with open(path, 'w') as f:
         df.to_csv(f, sep=',')
+
+class HistoryWriter(object):
+    """
+    Sink for the records of the contagion generators (i.e. contagion.iter_contagion_temporal_network).
+    Every record is written to a csv file as it comes, so a long run does not have to be kept in memory
+    """
+    def __init__(self, path, columns, flush_every=1000):
+        '''
+        Input:
+            path - csv file to write
+            columns - header of the csv, i.e. ['movie_order', 'year', '0']
+            flush_every - number of records between flushes to disk
+        '''
+        mkdir_p(os.path.dirname(os.path.abspath(path)))
+        self.path = path
+        self.flush_every = flush_every
+        self.n_records = 0
+        self.f = open(path, 'w')
+        self.f.write(','.join(str(c) for c in columns) + '\n')
+
+    def __call__(self, record):
+        '''
+        write one record, array entries (i.e. the replicates of the batch engine) are spread over columns
+        '''
+        values = []
+        for value in record:
+            if isinstance(value, np.ndarray):
+                values.extend(value.tolist())
+            else:
+                values.append(value)
+        self.f.write(','.join(str(v) for v in values) + '\n')
+        self.n_records += 1
+        if self.n_records % self.flush_every == 0:
+            self.f.flush()
+
+    def write_all(self, records):
+        '''
+        consume a generator of records
+        '''
+        for record in records:
+            self(record)
+        return self
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def replicate_history_writer(path, index, year, flush_every=1):
+    """
+    HistoryWriter for the replicates of one parameter set, one row per replicate written as it finishes,
+    so nothing but the current replicate is kept in memory and a stopped job leaves its finished rows.
+    The header holds the movie order, the first row the years, and every other row is the replicate
+    number and its number of adopters per movie. reader.read_replicate_csv reads it back
+    Input:
+        path - csv file to write
+        index - movie_order of each movie
+        year - year of each movie
+    Output:
+        writer - HistoryWriter, call it with [i, array of adopters]
+    """
+    writer = HistoryWriter(path, ['movie_order'] + [int(x) for x in index], flush_every)
+    writer(['year', np.asarray(year, dtype=int)])
+    return writer
+
+class ReplicateMatrix(object):
+    """
+    Number of adopters of all the replicates of one parameter set, in one preallocated
+    (movies x replicates) int32 array, optionally backed by a np.memmap file.
+    The movie_order and year axis is kept once, and the DataFrame in the 'split' layout
+    of save_file_json is only made when saving.
+    """
+    def __init__(self, index, year, replicates, index_name='movie_order', columns=(0, 1, 2), dtype=np.int32, path=None):
+        '''
+        Input:
+            index - movie_order (or step) of each row
+            year - year of each row
+            replicates - number of replicates (columns)
+            columns - positions of (index, year, adopters) in the adopter histories,
+                      (0, 1, 2) for the temporal model and (1, 0, 2) for the aggregated model
+            path - file of the np.memmap, in memory if None
+        '''
+        self.index = np.asarray(index)
+        self.year = np.asarray(year)
+        self.index_name = index_name
+        self.columns = columns
+        self.path = path
+        shape = (len(self.index), replicates)
+        if path is None:
+            self.values = np.zeros(shape, dtype=dtype)
+        else:
+            mkdir_p(os.path.dirname(os.path.abspath(path)))
+            self.values = np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+        self.filled = np.zeros(replicates, dtype=bool)
+
+    @classmethod
+    def from_history(cls, adopter_history, replicates, columns=(0, 1, 2), index_name='movie_order', path=None):
+        '''
+        Matrix with the axis of the first adopter_history, see __init__ for columns
+        '''
+        return cls(adopter_history[:, columns[0]], adopter_history[:, columns[1]], replicates, index_name, columns,
+                   path=path)
+
+    @property
+    def n_replicates(self):
+        return int(self.filled.sum())
+
+    def matches(self, adopter_history):
+        '''
+        True if adopter_history has the same years as the matrix
+        '''
+        return np.array_equal(self.year, adopter_history[:, self.columns[1]])
+
+    def set(self, i, adopter_history):
+        '''
+        Store the number of adopters of replicate i from its adopter_history
+        '''
+        self.set_counts(i, adopter_history[:, self.columns[2]])
+
+    def set_counts(self, i, counts):
+        self.values[:, i] = counts
+        self.filled[i] = True
+
+    def to_frame(self):
+        '''
+        DataFrame indexed by movie_order, with the year and one column per filled replicate ('0', '1', ...)
+        '''
+        replicates = np.nonzero(self.filled)[0]
+        df = pd.DataFrame(np.asarray(self.values[:, replicates]), index=pd.Index(self.index, name=self.index_name),
+                          columns=['{}'.format(i) for i in replicates])
+        df.insert(0, 'year', self.year)
+        return df
+
+    def save_json(self, path):
+        save_file_json(self.to_frame(), path)
+
+    def flush(self):
+        if isinstance(self.values, np.memmap):
+            self.values.flush()
+
+class ReplicateCheckpoint(object):
+    """
+    Append-only checkpoint of the replicates of one parameter set, in json lines:
+    a header line with the movie order and the years, then one line per finished replicate
+    with its number of adopters. Only the new replicate is written, and a job that was
+    stopped (i.e. at walltime) can resume after the last complete line.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index = None
+        self.year = None
+        self.replicates = [] #finished replicates, the adopters stay on disk
+        self.complete = False
+        self.result = None
+
+    @property
+    def n_replicates(self):
+        return len(self.replicates)
+
+    def _records(self):
+        '''
+        (record, size in bytes) of every complete line of the file
+        '''
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                yield record, len(line)
+
+    def load(self):
+        '''
+        Read the checkpoint if it exists. A last line cut in the middle of writing is dropped
+        '''
+        if not os.path.isfile(self.path):
+            return self
+        good_bytes = 0
+        for record, size in self._records():
+            good_bytes += size
+            if 'complete' in record:
+                self.complete = True
+                self.result = record.get('result')
+            elif 'replicate' in record:
+                self.replicates.append(record['replicate'])
+            else:
+                self.index = record['index']
+                self.year = record['year']
+        with open(self.path, 'ab') as f:
+            f.truncate(good_bytes)
+        return self
+
+    def reset(self):
+        '''
+        Start over, removes the checkpoint file
+        '''
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+        self.__init__(self.path)
+        return self
+
+    def _write(self, record, mode='a'):
+        mkdir_p(os.path.dirname(os.path.abspath(self.path)))
+        with open(self.path, mode) as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, index, year):
+        '''
+        Write the header, the movie order and the years shared by all the replicates
+        '''
+        self.index = [int(x) for x in index]
+        self.year = [int(x) for x in year]
+        self._write({'index':self.index, 'year':self.year}, mode='w')
+
+    def append(self, i, adopters):
+        '''
+        Write the number of adopters of replicate i
+        '''
+        self._write({'replicate':int(i), 'adopters':[int(x) for x in adopters]})
+        self.replicates.append(int(i))
+
+    def iter_replicates(self):
+        '''
+        (i, number of adopters) of every replicate in the file, one line at a time
+        '''
+        for record, size in self._records():
+            if 'replicate' in record:
+                yield record['replicate'], record['adopters']
+
+    def to_matrix(self, path=None):
+        '''
+        Read the replicates back into a ReplicateMatrix, one line at a time
+        Input:
+            path - file of the np.memmap of the matrix, in memory if None
+        '''
+        matrix = ReplicateMatrix(self.index, self.year, max(self.replicates) + 1 if self.replicates else 0, path=path)
+        for i, adopters in self.iter_replicates():
+            matrix.set_counts(i, adopters)
+        return matrix
+
+    def save_csv(self, path):
+        '''
+        Stream the replicates to a csv of replicate_history_writer, line by line without building the DataFrame
+        '''
+        with replicate_history_writer(path, self.index, self.year, flush_every=1000) as writer:
+            for i, adopters in self.iter_replicates():
+                writer([i, np.asarray(adopters, dtype=int)])
+        return path
+
+    def to_frame(self):
+        '''
+        DataFrame indexed by movie_order, with the year and one column per replicate,
+        the same as the one the replicate loops build
+        '''
+        return self.to_matrix().to_frame()
+
+    def finish(self, result_path):
+        '''
+        Mark the parameter set as done once the result is saved, the replicates are dropped
+        from the checkpoint so it does not keep a second copy of the result
+        '''
+        n_replicates = self.n_replicates
+        self._write({'complete':True, 'replicates':n_replicates, 'result':result_path}, mode='w')
+        self.complete = True
+        self.result = result_path
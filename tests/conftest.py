@@ -0,0 +1,48 @@
+"""
+Shared setup of the tests: the src folder on the path and small synthetic movie data
+
+The suite runs against the src modules as they are, so it needs what they need:
+- networkx 1.x. The networkx builders and engines and calculate_weight use G.node and G.edge,
+  G.edge is gone in networkx 2 and G.node in 2.4, so every test that compares against a networkx
+  graph fails with networkx 3.x, and the calculate_weight ones with the 2.1 of requirements.txt.
+- graph_tool, which network_builder and network_generator import at the top. It is not on pip,
+  install it from conda-forge, or put a stub graph_tool module on the path when only the
+  tests are run, no test uses it
+"""
+import os
+import sys
+import random
+import pandas as pd
+
+#the src modules set sys.path[0] to their own guess of src when they are imported,
+#so src is put in front twice and survives the first of them
+src_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+sys.path[:0] = [src_dir, src_dir]
+
+
+def make_movies(n_movies=60, n_producers=40, team=(1, 5), start_year=1990, end_year=2000, roles=False, seed=1):
+    """
+    Synthetic movie dataframe sorted by year, with the columns network_builder reads
+    Input:
+        team - smallest and largest number of producers of a movie
+        roles - producers as [id, role] pairs, as in the real data, instead of bare ids
+    Output:
+        df - DataFrame with _id, year and producers
+    """
+    rng = random.Random(seed)
+    pool = ['p{:04d}'.format(i) for i in range(n_producers)]
+    rows = []
+    for m in range(n_movies):
+        producers = rng.sample(pool, rng.randint(*team))
+        if roles:
+            producers = [[p, rng.choice(['producer', 'executive producer'])] for p in producers]
+        rows.append({'_id':'m{:05d}'.format(m), 'year':rng.randint(start_year, end_year - 1), 'producers':producers})
+    df = pd.DataFrame(rows, columns=['_id', 'year', 'producers'])
+    return df.sort_values('year', kind='mergesort').reset_index(drop=True)
+
+def pick_seeds(df, n=5, seed=2):
+    """
+    n producers of df as the initial adopters
+    """
+    ids = sorted(set(p[0] if isinstance(p, list) else p for producers in df['producers'] for p in producers))
+    return random.Random(seed).sample(ids, n)
@@ -0,0 +1,73 @@
+"""
+Tests of the replicate checkpoints and of resuming a sweep from them
+"""
+import json
+import numpy as np
+import pytest
+import model.contagion as contagion
+import network.network_builder as build
+import parser.saver as save
+import parser.reader as reader
+from conftest import make_movies, pick_seeds
+
+
+@pytest.fixture(scope='module')
+def topology():
+    df = make_movies()
+    return contagion.compile_temporal_network(build.build_temporal_incidence(df, pick_seeds(df), 'empirical'))
+
+def checkpoint_sweep(checkpoints, sweep, stop=None):
+    '''
+    append the replicates of the sweep to their checkpoints, and stop after stop replicates as at a walltime
+    '''
+    for k, (parameter, i, adopter_history) in enumerate(sweep):
+        if k == stop:
+            break
+        checkpoint = checkpoints[parameter]
+        if checkpoint.index is None:
+            checkpoint.start(adopter_history[:, 0], adopter_history[:, 1])
+        checkpoint.append(i, adopter_history[:, 2])
+
+@pytest.mark.parametrize('engine, block, common_random', [('batch', 2, False), ('batch', 3, True), ('array', None, False)])
+def test_resumed_sweep_matches_uninterrupted(tmpdir, topology, engine, block, common_random):
+    parameters = [(0.2, 1.0, 1.0), (0.6, 1.0, 1.0)]
+    replicates = 5
+    kwargs = {'master_seed':4, 'common_random':common_random, 'block':block}
+    expected = contagion.sweep_temporal_network(topology, parameters, replicates, engine, **kwargs)
+
+    paths = {x: str(tmpdir.join('{}.jsonl'.format(k))) for k, x in enumerate(parameters)}
+    checkpoints = {x: save.ReplicateCheckpoint(paths[x]) for x in parameters}
+    checkpoint_sweep(checkpoints, contagion.iter_sweep_replicates(topology, parameters, replicates, engine, **kwargs),
+                     stop=7)
+    #the job stopped, a new one loads the checkpoints and runs the missing replicates
+    checkpoints = {x: save.ReplicateCheckpoint(paths[x]).load() for x in parameters}
+    start = {x: checkpoints[x].n_replicates for x in parameters}
+    assert start == {parameters[0]: 5, parameters[1]: 2}
+    checkpoint_sweep(checkpoints, contagion.iter_sweep_replicates(topology, parameters, replicates, engine,
+                                                                  start=start, **kwargs))
+    for x in parameters:
+        assert np.array_equal(checkpoints[x].to_frame().values, expected[x].values)
+
+def test_checkpoint_drops_a_cut_line(tmpdir):
+    path = str(tmpdir.join('cut.jsonl'))
+    checkpoint = save.ReplicateCheckpoint(path)
+    checkpoint.start([0, 1, 2], [1990, 1990, 1991])
+    checkpoint.append(0, [1, 2, 2])
+    checkpoint.append(1, [1, 1, 3])
+    with open(path, 'a') as f:
+        f.write(json.dumps({'replicate':2, 'adopters':[1, 2, 3]})[:10])
+    loaded = save.ReplicateCheckpoint(path).load()
+    assert loaded.replicates == [0, 1]
+    loaded.append(2, [1, 3, 3])
+    assert save.ReplicateCheckpoint(path).load().to_frame()['2'].tolist() == [1, 3, 3]
+
+def test_checkpoint_csv_reads_as_the_json_frame(tmpdir):
+    checkpoint = save.ReplicateCheckpoint(str(tmpdir.join('csv.jsonl')))
+    checkpoint.start([4, 5, 6], [1990, 1990, 1991])
+    checkpoint.append(1, [1, 1, 3])
+    checkpoint.append(0, [1, 2, 2])
+    df = reader.read_replicate_csv(checkpoint.save_csv(str(tmpdir.join('result.csv'))))
+    expected = checkpoint.to_frame()
+    assert list(df.index) == list(expected.index)
+    assert np.array_equal(df['year'].values, expected['year'].values)
+    assert np.array_equal(df[['0', '1']].values, expected[['0', '1']].values)
@@ -0,0 +1,75 @@
+"""
+Tests of the compiled contagion engines against the networkx engine on a small synthetic network
+"""
+import random
+import numpy as np
+import pytest
+import model.contagion as contagion
+import network.network_builder as build
+from conftest import make_movies, pick_seeds
+
+PARAMETERS = [(0.05, 1.0, 1.0), (0.3, 0.4, 0.6)]
+
+
+@pytest.fixture(scope='module')
+def movies():
+    df = make_movies()
+    return df, pick_seeds(df)
+
+def build_graph(movies, threshold):
+    df, seeds = movies
+    G = build.build_temporal_network(df, seeds, 'empirical', threshold)
+    return G, contagion.compile_temporal_network(G)
+
+def final_adopters(runs):
+    return np.array([np.asarray(adopter_history)[-1, 2] for adopter_history in runs], dtype=float)
+
+def assert_same_mean(a, b):
+    '''
+    the means of two sets of independent runs are within four standard errors of their difference
+    '''
+    error = np.sqrt(a.var(ddof=1)/len(a) + b.var(ddof=1)/len(b))
+    assert abs(a.mean() - b.mean()) <= 4*max(error, 1e-9)
+
+@pytest.mark.parametrize('threshold', [0.5, 1.0])
+def test_incidence_compiles_to_the_graph_topology(movies, threshold):
+    df, seeds = movies
+    G, expected = build_graph(movies, threshold)
+    topology = contagion.compile_temporal_network(build.build_temporal_incidence(df, seeds, 'empirical', threshold))
+    assert topology.producer_ids == expected.producer_ids
+    for name in ('movie_order', 'year', 'indptr', 'indices', 'belief', 'status', 'last_movie'):
+        assert np.array_equal(getattr(topology, name), getattr(expected, name)), name
+    assert topology.producer_movies == expected.producer_movies
+
+@pytest.mark.parametrize('prob, dose, threshold', PARAMETERS)
+def test_array_engine_replays_the_networkx_engine(movies, prob, dose, threshold):
+    G, topology = build_graph(movies, threshold)
+    for seed in range(5):
+        expected = contagion.contagion_belief_propagation_temporal_network(topology.reset_graph(G), prob, dose, threshold,
+                                                                           rng=random.Random(seed))
+        adopter_history = contagion.contagion_belief_propagation_temporal_array(None, prob, dose, threshold, topology=topology,
+                                                                                aggregate=False, rng=random.Random(seed))
+        assert np.array_equal(np.asarray(adopter_history), np.asarray(expected))
+
+@pytest.mark.parametrize('prob, dose, threshold', PARAMETERS)
+def test_engines_match_the_networkx_engine_in_distribution(movies, prob, dose, threshold):
+    G, topology = build_graph(movies, threshold)
+    runs = 200
+    expected = final_adopters(contagion.contagion_belief_propagation_temporal_network(topology.reset_graph(G), prob, dose,
+                                                                                      threshold, rng=random.Random(seed))
+                              for seed in range(runs))
+    engines = {
+        'array aggregate': [contagion.contagion_belief_propagation_temporal_array(None, prob, dose, threshold, topology=topology,
+                                                                                  rng=random.Random(runs + seed))
+                            for seed in range(runs)],
+        'jit': [contagion.contagion_belief_propagation_temporal_jit(None, prob, dose, threshold, topology=topology,
+                                                                    seed=seed, aggregate=False) for seed in range(runs)],
+        'jit aggregate': [contagion.contagion_belief_propagation_temporal_jit(None, prob, dose, threshold, topology=topology,
+                                                                              seed=seed) for seed in range(runs)],
+    }
+    batch = contagion.contagion_belief_propagation_temporal_batch(None, prob, dose, threshold, runs, topology=topology,
+                                                                  rng=np.random.RandomState(1))
+    assert np.array_equal(batch.index.values, np.asarray(engines['jit'][0])[:, 0])
+    assert_same_mean(batch.iloc[-1, 1:].values.astype(float), expected)
+    for name, adopter_histories in engines.items():
+        assert_same_mean(final_adopters(adopter_histories), expected)
@@ -0,0 +1,56 @@
+"""
+Tests of the weighted neighbor draws of choose_neighbor
+"""
+import gc
+import random
+import weakref
+import networkx as nx
+import numpy as np
+import model.contagion as contagion
+import network.network_builder as build
+
+
+def frequencies(G, node, draws=20000, seed=0):
+    rng = random.Random(seed)
+    counts = {}
+    for _ in range(draws):
+        neighbor = contagion.choose_neighbor(G, node, 'neighbor', rng=rng)
+        counts[neighbor] = counts.get(neighbor, 0) + 1
+    return {n: c/float(draws) for n, c in counts.items()}
+
+def shift_graph():
+    G = nx.MultiGraph()
+    for other, shifts in (('b', [1]), ('c', [1, 2]), ('d', [3, 3, 1])):
+        for days in shifts:
+            G.add_edge('a', other, days=days)
+    return G
+
+def test_draws_are_proportional_to_the_weights():
+    G = contagion.calculate_weight(shift_graph(), 'shifts')
+    observed = frequencies(G, 'a')
+    for n, weight in (('b', 1), ('c', 2), ('d', 3)):
+        assert abs(observed[n] - weight/6.0) < 0.015
+
+def test_new_weights_rebuild_the_tables():
+    G = contagion.calculate_weight(shift_graph(), 'shifts')
+    frequencies(G, 'a', draws=10)
+    G = contagion.calculate_weight(G, 'days')
+    observed = frequencies(G, 'a')
+    for n, weight in (('b', 1), ('c', 3), ('d', 7)):
+        assert abs(observed[n] - weight/11.0) < 0.015
+
+def test_window_tables_follow_the_window():
+    window = build.ProjectedWindow(['a', 'b', 'c'])
+    window.slide([([0, 1], 1990, None), ([0, 1], 1990, None), ([0, 2], 1990, None)])
+    assert abs(frequencies(window, 0)[1] - 2/3.0) < 0.015
+    window.slide([([0, 2], 1991, None)])
+    assert frequencies(window, 0, draws=100) == {2: 1.0}
+
+def test_samplers_are_dropped_with_the_graph():
+    G = contagion.calculate_weight(shift_graph(), 'shifts')
+    frequencies(G, 'a', draws=10)
+    graph = weakref.ref(G)
+    assert graph() in contagion._neighbor_samplers
+    del G
+    gc.collect()
+    assert graph() is None
@@ -0,0 +1,29 @@
+"""
+Tests of the movie - producer network builders
+"""
+import pytest
+import network.network_builder as build
+from conftest import make_movies, pick_seeds
+
+
+@pytest.mark.parametrize('roles', [False, True])
+def test_registry_reads_role_pairs(roles):
+    #[id, role] entries, with and without keeping the roles
+    df = make_movies(roles=True)
+    seeds = pick_seeds(df)
+    movies, registry = build.make_producer_registry(df, seeds, 'empirical', roles=roles)
+    window = build.ProjectedWindow.from_dataframe(df)
+    assert registry.ids == window.producer_ids
+    assert sorted(p.node_ID for p in registry if p.status == 'Adopter') == sorted(seeds)
+    assert all(p.gender == (1 if p.node_ID in seeds else 0) for p in registry)
+    assert movies[0].producers == [entry[0] for entry in df['producers'].iloc[0]]
+
+def test_role_pairs_same_network_as_ids():
+    df = make_movies(roles=True)
+    df_ids = df.assign(producers=[[entry[0] for entry in producers] for producers in df['producers']])
+    seeds = pick_seeds(df)
+    G = build.build_temporal_network(df, seeds, 'empirical')
+    G_ids = build.build_temporal_network(df_ids, seeds, 'empirical')
+    assert list(G.nodes()) == list(G_ids.nodes())
+    assert all(list(G.neighbors(n)) == list(G_ids.neighbors(n)) for n in G.nodes())
+    assert all(G.node[n].get('status') == G_ids.node[n].get('status') for n in G.nodes())
@@ -0,0 +1,61 @@
+"""
+Tests of the memory mapped network cache
+"""
+import json
+import os
+import numpy as np
+import model.contagion as contagion
+import network.network_builder as build
+from conftest import make_movies, pick_seeds
+
+
+def is_mapped(array):
+    '''
+    True if array is a view of a np.memmap
+    '''
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+def same_topology(a, b):
+    return (a.producer_ids == b.producer_ids and np.array_equal(a.movie_order, b.movie_order)
+            and np.array_equal(a.year, b.year) and np.array_equal(a.indptr, b.indptr)
+            and np.array_equal(a.indices, b.indices) and np.array_equal(a.belief, b.belief)
+            and np.array_equal(a.status, b.status))
+
+def cached(cache_dir, df, seeds, fingerprint):
+    return build.cached_temporal_incidence(cache_dir, fingerprint, df, seeds, 'empirical', 1.0, 1990, 2000)
+
+def test_cache_round_trip_is_mapped(tmpdir):
+    df = make_movies()
+    seeds = pick_seeds(df)
+    fingerprint = build.dataset_fingerprint(df, seeds)
+    expected = contagion.compile_temporal_network(build.build_temporal_incidence(df, seeds, 'empirical'))
+    first = cached(str(tmpdir), df, seeds, fingerprint)
+    second = cached(str(tmpdir), df, seeds, fingerprint)
+    assert is_mapped(second.belief) and is_mapped(second.movie_producers.indices)
+    for incidence in (first, second):
+        topology = contagion.compile_temporal_network(incidence)
+        assert same_topology(topology, expected)
+    topology = contagion.compile_temporal_network(second)
+    assert is_mapped(topology.belief) and is_mapped(topology.indices)
+    assert not topology.belief.flags.writeable
+
+def test_cache_of_an_older_version_is_replaced(tmpdir):
+    df = make_movies()
+    seeds = pick_seeds(df)
+    fingerprint = build.dataset_fingerprint(df, seeds)
+    cached(str(tmpdir), df, seeds, fingerprint)
+    path = build.network_cache_path(str(tmpdir), fingerprint, 1990, 2000, 'empirical', 1.0, None)
+    meta_file = os.path.join(path, 'meta.json')
+    with open(meta_file) as f:
+        meta = json.load(f)
+    meta['version'] = build.NETWORK_CACHE_VERSION - 1
+    with open(meta_file, 'w') as f:
+        json.dump(meta, f)
+    incidence = cached(str(tmpdir), df, seeds, fingerprint)
+    assert incidence is not None
+    assert build.load_network_cache(path) is not None
+    assert sorted(os.listdir(str(tmpdir))) == [os.path.basename(path)]
@@ -0,0 +1,114 @@
+"""
+Tests of the weighted producer projections against the networkx weights of calculate_weight
+"""
+import random
+from itertools import combinations
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pytest
+import model.contagion as contagion
+import network.network_builder as build
+from conftest import make_movies
+
+
+def make_shifts(n_shifts=80, n_producers=25, seed=3):
+    '''
+    schedule of shifts with a team of producers, the Date of the shift and its length in Days
+    '''
+    rng = random.Random(seed)
+    pool = ['p{:04d}'.format(i) for i in range(n_producers)]
+    dates = pd.date_range('2015-01-01', periods=20)
+    rows = [{'producers':rng.sample(pool, rng.randint(2, 5)), 'Date':dates[rng.randrange(len(dates))],
+             'Days':rng.randint(1, 3)} for _ in range(n_shifts)]
+    return pd.DataFrame(rows).sort_values('Date', kind='mergesort').reset_index(drop=True)
+
+def shift_multigraph(df):
+    '''
+    projected MultiGraph of the schedule, one edge with the days of the shift per pair of every shift
+    '''
+    G = nx.MultiGraph()
+    for producers in df['producers']:
+        G.add_nodes_from(producers)
+    for producers, days in zip(df['producers'], df['Days']):
+        for p1, p2 in combinations(producers, 2):
+            G.add_edge(p1, p2, days=days)
+    return G
+
+@pytest.mark.parametrize('weight_type', ['none', 'shifts', 'days'])
+def test_window_weights_match_networkx(weight_type):
+    df = make_shifts()
+    window = build.ProjectedWindow.from_dataframe(df)
+    window.slide(window.teams(df, 'Date').values())
+    W = contagion.normalize_rows(window.adjacency(weight_type))
+    expected = contagion.projected_weight_matrix(shift_multigraph(df), weight_type, nodes=window.producer_ids)
+    assert np.allclose(W.toarray(), expected.toarray())
+
+def test_block_projections_sum_the_days():
+    df = make_shifts()
+    blocks = {0:df.iloc[:40], 1:df.iloc[40:]}
+    producer_ids, projections = contagion.block_projections(blocks, 'days')
+    for key, block in blocks.items():
+        expected = contagion.projected_weight_matrix(shift_multigraph(block), 'days', nodes=producer_ids)
+        assert np.allclose(projections[key][0].toarray(), expected.toarray())
+
+def test_days_need_the_days_of_the_movies():
+    df = make_movies()
+    window = build.ProjectedWindow.from_dataframe(df)
+    window.slide(window.teams(df).values())
+    with pytest.raises(ValueError):
+        window.adjacency('days')
+
+@pytest.mark.parametrize('weight_type', ['none', 'movies', 'years'])
+def test_producer_projection_matches_incidence(weight_type):
+    df = make_movies()
+    incidence = build.BipartiteIncidence.from_dataframe(df, [], 'empirical', 1.0)
+    projection = build.ProducerProjection(incidence)
+    assert np.allclose(projection.adjacency(weight_type).toarray(), incidence.projection(weight_type).toarray())
+
+def test_producer_projection_has_no_days():
+    df = make_movies()
+    projection = build.ProducerProjection.from_dataframe(df, [], 'empirical', 1.0)
+    with pytest.raises(ValueError):
+        projection.adjacency('days')
+    with pytest.raises(ValueError):
+        contagion.projected_weight_matrix(projection, 'days')
+
+def dict_synchronous_update(blocks, seeds, p, d, b, weight_type):
+    '''
+    the cumulative synchronous update of the blocks as the networkx version did it: one projected graph
+    per block, the beliefs carried over in a dictionary and the earlier adopters outside the block added
+    '''
+    entire_adopter_history = np.empty([0, 2], dtype=int)
+    start_date = blocks[0].Date.iloc[0]
+    belief_dict = {}
+    cumulative_adopters = set()
+    for key in sorted(blocks.keys()):
+        df = blocks[key]
+        time_limit = (df['Date'].iloc[-1] - df['Date'].iloc[0]).days + df['Days'].iloc[-1]
+        G = shift_multigraph(df)
+        for n in G.nodes():
+            G.node[n]['belief'] = belief_dict.get(n, 1.0 if n in seeds else 0.0)
+            G.node[n]['status'] = 'Adopter' if G.node[n]['belief'] >= b else 'NonAdopter'
+        add_adopters = len([x for x in cumulative_adopters if x not in G.nodes()])
+        G, adopter_history = contagion.contagion_synchronous_belief_propagation_projected_network(G, p, d, b, weight_type,
+                                                                                                  time_limit)
+        belief_dict.update({n:G.node[n]['belief'] for n in G.nodes()})
+        cumulative_adopters.update(n for n in G.nodes() if G.node[n]['status'] == 'Adopter')
+        adopter_history[:, 0] += (df['Date'].iloc[0] - start_date).days
+        adopter_history[:, 1] += add_adopters
+        entire_adopter_history = np.append(entire_adopter_history, adopter_history, 0)
+    return entire_adopter_history
+
+@pytest.mark.parametrize('weight_type', ['none', 'shifts', 'days'])
+def test_synchronous_update_matches_networkx(weight_type):
+    df = make_shifts(n_shifts=60, n_producers=30)
+    blocks = {0:df.iloc[:20], 1:df.iloc[20:40], 2:df.iloc[40:]}
+    seeds = ['p0001', 'p0007', 'p0012']
+    #every contact with an adopter infects, so both versions take the same steps. The threshold is away from
+    #the sums of the doses, the sparse and the dict versions add the weights in a different order
+    expected = dict_synchronous_update(blocks, seeds, 1.0, 0.23, 0.61, weight_type)
+    adopter_history = contagion.cumulative_adopters_over_time_projected_network_synchronous_update(
+        blocks, 'empirical', 1.0, 0.23, 0.61, weight_type, seeds=seeds)
+    assert np.array_equal(adopter_history, expected)
+    assert expected[-1, 1] > len(seeds)
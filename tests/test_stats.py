@@ -0,0 +1,33 @@
+"""
+Tests of the streaming summary of the replicates against numpy
+"""
+import numpy as np
+import pytest
+from common.stats import StreamingSummary
+
+
+@pytest.mark.parametrize('replicates', [1, 2, 5, 7, 150])
+def test_streaming_summary_matches_numpy(replicates):
+    rng = np.random.RandomState(4)
+    #cumulative counts per row, replicates as columns, with ties and rows of one value
+    values = np.cumsum(rng.poisson(2, size=(40, replicates)), axis=0)
+    values[:3] = 7
+    summary = StreamingSummary(len(values), divisor=20)
+    for j in range(replicates):
+        summary.add(values[:, j])
+    assert summary.count == replicates
+    assert np.allclose(summary.mean, values.mean(axis=1)/20)
+    if replicates > 1:
+        assert np.allclose(summary.variance, values.var(axis=1, ddof=1)/400)
+    for q in (0.0, 0.025, 0.5, 0.975, 1.0, 0.3):
+        assert np.allclose(summary.quantile(q), np.percentile(values/20.0, 100*q, axis=1))
+    counts_values, counts = summary.histogram(5)
+    assert counts.sum() == replicates
+    assert np.array_equal(np.repeat(counts_values, counts), np.sort(values[5]))
+
+def test_streaming_summary_takes_counts_only():
+    summary = StreamingSummary(2)
+    with pytest.raises(ValueError):
+        summary.add([0.5, 1])
+    with pytest.raises(ValueError):
+        summary.add([-1, 1])
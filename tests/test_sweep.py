@@ -0,0 +1,59 @@
+"""
+Tests of the parameter sweep over compiled networks
+"""
+import numpy as np
+import pytest
+import model.contagion as contagion
+import network.network_builder as build
+from conftest import make_movies, pick_seeds
+
+
+def compile_movies(threshold, belief_type='empirical'):
+    df = make_movies()
+    incidence = build.build_temporal_incidence(df, pick_seeds(df), belief_type, threshold)
+    return contagion.compile_temporal_network(incidence)
+
+def test_sweep_rejects_one_topology_for_many_thresholds():
+    parameters = [(0.3, 1.0, 0.5), (0.3, 1.0, 1.0)]
+    with pytest.raises(ValueError):
+        list(contagion.iter_sweep_temporal_network(compile_movies(0.5), parameters, 4))
+
+def test_sweep_runs_every_threshold_on_its_topology():
+    parameters = [(0.3, 1.0, 0.5), (0.3, 1.0, 1.0)]
+    topologies = {T: compile_movies(T) for P, D, T in parameters}
+    results = contagion.sweep_temporal_network(topologies, parameters, 4, master_seed=3)
+    for (P, D, T), seed in zip(parameters, contagion.replicate_seeds(3, len(parameters))):
+        #one block of replicates, with the first seed derived from the seed of the parameter
+        rng = np.random.RandomState(contagion.replicate_seeds(seed, 1)[0])
+        expected = contagion.contagion_belief_propagation_temporal_batch(None, P, D, T, 4, topology=topologies[T], rng=rng)
+        assert np.array_equal(results[(P, D, T)].values, expected.values)
+
+def test_sir_takes_recovery_apart_from_dose():
+    topology = compile_movies(1.0)
+    with pytest.raises(ValueError):
+        contagion.make_kernel('sir', 0.5, 1.0, 1.0)
+    parameters = [(0.5, 1.0, 1.0)]
+    results = {r: contagion.sweep_temporal_network(topology, parameters, 8, master_seed=3, dynamics='sir', recovery=r)
+               for r in (0.0, 1.0)}
+    #more producers are ever infected when nobody recovers
+    assert results[0.0][parameters[0]].iloc[-1, 1:].mean() > results[1.0][parameters[0]].iloc[-1, 1:].mean()
+    assert not results[0.0][parameters[0]].equals(results[1.0][parameters[0]])
+
+def test_exposure_takes_a_whole_number_of_exposures():
+    for exposures in (None, 1.5, 0):
+        with pytest.raises(ValueError):
+            contagion.make_kernel('exposure', 0.5, 1.0, 1.0, exposures=exposures)
+    assert contagion.make_kernel('exposure', 0.5, 1.0, 1.0, exposures=2.0).k == 2
+    topology = compile_movies(1.0)
+    parameters = [(0.5, 1.0, 1.0)]
+    results = {k: contagion.sweep_temporal_network(topology, parameters, 8, master_seed=3, dynamics='exposure',
+                                                   exposures=k)[parameters[0]] for k in (1, 3)}
+    #the seeds are adopters whatever k is, and one exposure is enough to adopt more often than three
+    assert np.array_equal(results[1].iloc[0, 1:].values, results[3].iloc[0, 1:].values)
+    assert results[1].iloc[-1, 1:].mean() > results[3].iloc[-1, 1:].mean()
+
+def test_derived_seeds_differ_by_network_version():
+    seeds = [contagion.derive_seed(0, n) for n in range(30)]
+    assert len(set(seeds)) == 30
+    assert seeds == [contagion.derive_seed(0, n) for n in range(30)]
+    assert contagion.derive_seed(None, 3) is None